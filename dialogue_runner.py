@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -12,8 +14,9 @@ from pal_agent import constants
 from pal_agent.provider.palbot.palbot_interface import PalbotInterface
 from pal_agent.module.executor import Executor
 from pal_agent.memory.local_memory import LocalMemory
-from pal_agent.utils.file_utils import read_resource_file
-from pal_agent.utils.json_utils import parse_semi_formatted_text
+from pal_agent.utils.startup_utils import startup_step, log_startup_report
+from pal_agent.utils.prompt_utils import load_prompt_template
+from pal_agent.utils.json_utils import parse_semi_formatted_text, SemiFormattedTextParser
 
 config = Config()
 logger = Logger()
@@ -33,15 +36,17 @@ class DialogueRunner:
         self.pipeline_info = {}
         self.count = 0
 
-        lf = LLMFactory()
-        self.llm_provider, self.embedding_provider = lf.create(self.llm_provider_config_path)
+        with startup_step('llm providers'):
+            lf = LLMFactory()
+            self.llm_provider, self.embedding_provider = lf.create(self.llm_provider_config_path)
 
         self.memory = LocalMemory(memory_path=config.work_dir,
                                   max_recent_steps=config.max_recent_steps)
 
-        srf = SkillRegistryFactory()
-        srf.register_builder(config.env_short_name, config.skill_registry_name)
-        self.skill_registry = srf.create(config.env_short_name, skill_configs=config.skill_configs, embedding_provider=self.embedding_provider)
+        with startup_step('skill registry'):
+            srf = SkillRegistryFactory()
+            srf.register_builder(config.env_short_name, config.skill_registry_name)
+            self.skill_registry = srf.create(config.env_short_name, skill_configs=config.skill_configs, embedding_provider=self.embedding_provider)
         logger.info(f"Skill registry: {self.skill_registry}")
 
         self.gm = GameManager(env_name=config.env_name,
@@ -50,9 +55,10 @@ class DialogueRunner:
                               skill_registry=self.skill_registry,
                              )
 
-        skills = self.gm.retrieve_skills(query_task= "",
-                                    skill_num=config.skill_configs[constants.SKILL_CONFIG_MAX_COUNT],
-                                    screen_type=constants.GENERAL_GAME_INTERFACE)
+        with startup_step('skill retrieval'):
+            skills = self.gm.retrieve_skills(query_task= "",
+                                        skill_num=config.skill_configs[constants.SKILL_CONFIG_MAX_COUNT],
+                                        screen_type=constants.GENERAL_GAME_INTERFACE)
 
         self.skill_library = self.gm.get_skill_information(skills, False)
 
@@ -65,37 +71,60 @@ class DialogueRunner:
         self.gm.audio_log(hello_audio)
         self.pipeline_info["palbot_last_reply"] = hello_audio
 
-        self.skill_execute = Executor(env_manager=self.gm, robot_interface=self.palbot_interface)
+        with startup_step('executor'):
+            self.skill_execute = Executor(env_manager=self.gm, robot_interface=self.palbot_interface)
+
+        # Speaking the reply while the rest of the response streams in
+        self.reply_speech = None
+        self.speech_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Reply Speech')
+
+        log_startup_report()
 
 
     def run(self):
         logger.info("Starting dialogue runner...")
 
-        while not self.success_flag:
+        try:
+            while not self.success_flag:
+
+                action_info = ["listen()"]
+                self.memory.add_recent_history_kv(key=constants.PRE_ACTION, info=action_info)
+                response = self.skill_execute()
+
+                exec_info = response.get(constants.EXEC_INFO)
+                user_reply = exec_info.get(constants.LAST_SKILL)
+                user_reply = user_reply.split("#")[1].strip()
+                logger.info(f"User reply: {user_reply}")
+
+                self.pipeline_info["user_last_reply"] = user_reply
 
-            action_info = ["listen()"]
-            self.memory.add_recent_history_kv(key=constants.PRE_ACTION, info=action_info)
-            response = self.skill_execute()
+                self.generate_palbot_reply(self)
+                palbot_reply = self.pipeline_info.get("palbot_reply")
 
-            exec_info = response.get(constants.EXEC_INFO)
-            user_reply = exec_info.get(constants.LAST_SKILL)
-            user_reply = user_reply.split("#")[1].strip()
-            logger.info(f"User reply: {user_reply}")
+                if self.reply_speech is not None:
+                    self.reply_speech.result() # already spoken while the rest of the response was streamed
+                    self.reply_speech = None
+                else:
+                    self.gm.audio_log(palbot_reply)
 
-            self.pipeline_info["user_last_reply"] = user_reply
+                action_info = [self.pipeline_info["action"]]
+                self.memory.add_recent_history_kv(key=constants.PRE_ACTION, info=action_info)
+                response = self.skill_execute()
 
-            self.generate_palbot_reply(self)
-            palbot_reply = self.pipeline_info.get("palbot_reply")
+                # Ends the memory step, each dialogue turn is logged under its own step
+                self.memory.save()
 
-            self.gm.audio_log(palbot_reply)
+        except KeyboardInterrupt:
+            logger.info("Dialogue interrupted by user.")
 
-            action_info = [self.pipeline_info["action"]]
-            self.memory.add_recent_history_kv(key=constants.PRE_ACTION, info=action_info)
-            response = self.skill_execute()
+        finally:
+            self.memory.close() # Flush pending memory events
 
     def generate_palbot_reply(self, user_reply):
         logger.info(f"Generating PALBOT reply for: {user_reply}")
 
+        self.llm_provider.reset_image_payload_budget()
+
         image_introduction = [
             {
             constants.IMAGE_INTRO: "Don't pay attention to the image, just focus on my words.",
@@ -104,14 +133,21 @@ class DialogueRunner:
             }]
 
         self.pipeline_info[constants.IMAGE_INTRODUCTION] = image_introduction
+        self.pipeline_info[constants.IMAGE_PAYLOAD_POLICY] = config.image_payload_policies.get(constants.DIALOGUE_STAGE)
 
         # Generate a response using the LLM
-        dialogue_prompt_template = read_resource_file(constants.DIALOGUE_PROMPT_FILE_PATH)
-        dialogue_prompt = self.llm_provider.assemble_prompt(template_str=dialogue_prompt_template, params=self.pipeline_info)
+        dialogue_prompt_template = load_prompt_template(constants.DIALOGUE_PROMPT_FILE_PATH)
+        dialogue_prompt = self.llm_provider.assemble_prompt(template=dialogue_prompt_template, params=self.pipeline_info)
 
         logger.info(f"Dialogue prompt: {dialogue_prompt}")
 
-        response, _ = self.llm_provider.create_completion(messages=dialogue_prompt)
+        if config.streaming_completions:
+            parser = SemiFormattedTextParser(on_section=self.speak_streamed_reply)
+            response, _ = self.llm_provider.create_completion_stream(messages=dialogue_prompt, on_delta=parser.feed)
+            parser.finish()
+        else:
+            response, _ = self.llm_provider.create_completion(messages=dialogue_prompt)
+
         processed_response = parse_semi_formatted_text(response)
         logger.info(f"Dialogue response: {processed_response}")
 
@@ -126,6 +162,11 @@ class DialogueRunner:
             self.pipeline_info["palbot_reply"] = "I'm sorry, I didn't understand that."
 
 
+    def speak_streamed_reply(self, key, value):
+
+        if key == "palbot_reply" and value and self.reply_speech is None:
+            self.reply_speech = self.speech_executor.submit(self.gm.audio_log, value)
+
 
 if __name__ == "__main__":
 
@@ -1,3 +1,6 @@
+import threading
+import time
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pyrealsense2 as rs
@@ -5,45 +8,243 @@ import open3d as o3d
 from enum import Enum
 import cv2
 
+from pal_agent.log.logger import Logger
+from pal_agent.utils.depth_utils import DepthFrame
 from pal_agent.utils.singleton import Singleton
 
+logger = Logger()
+
+
+# Stream sets, fewer streams use less USB bandwidth and CPU
+STREAM_PROFILE_RGB = 'rgb'
+STREAM_PROFILE_RGBD = 'rgbd'
+STREAM_PROFILE_FULL = 'full' # RGB, depth and both infrared streams
+
+
+class CameraFrame:
+    """
+    One capture, with the device frame number and timestamp (ms) and the host receive time (s).
+
+    Images are extracted from the RealSense frameset when first accessed, and depth is aligned to color only when
+    it is requested, so readers that only need color pay for nothing else.
+    """
+
+    def __init__(self, camera, frames):
+        self.camera = camera
+        self.frames = frames
+        self.frame_number = frames.get_frame_number()
+        self.timestamp = frames.get_timestamp()
+        self.received_time = time.time()
+        self.taken = False
+
+        self._color_frame = None
+        self._aligned_frames = None
+        self._depth_frame = None
+
+    @property
+    def color_frame(self):
+        if self._color_frame is None:
+            self._color_frame = np.asanyarray(self.frames.get_color_frame().get_data())
+        return self._color_frame
+
+    @property
+    def aligned_frames(self):
+        if self._aligned_frames is None:
+            self._aligned_frames = self.camera.align_frames(self.frames)
+        return self._aligned_frames
+
+    @property
+    def depth_frame(self):
+        """Depth aligned to color as a DepthFrame (raw units, meters on demand), or None without a depth stream."""
+        if self._depth_frame is None and self.camera.has_depth:
+            raw = np.asanyarray(self.aligned_frames.get_depth_frame().get_data())
+            self._depth_frame = DepthFrame(raw, self.camera.depth_scale)
+        return self._depth_frame
+
+    @property
+    def ir_l_image(self):
+        if not self.camera.has_infrared:
+            return None
+        return np.asanyarray(self.aligned_frames.get_infrared_frame(1).get_data())
+
+    @property
+    def ir_r_image(self):
+        if not self.camera.has_infrared:
+            return None
+        return np.asanyarray(self.aligned_frames.get_infrared_frame(2).get_data())
+
+    def as_tuple(self):
+        return self.color_frame, self.depth_frame, self.ir_l_image, self.ir_r_image
+
+
 class RealSenseCamera(metaclass=Singleton):
 
-    def __init__(self, width=640, height=480, mode = rs.rs400_visual_preset.high_accuracy):
+    def __init__(self, width=640, height=480, mode = rs.rs400_visual_preset.high_accuracy, stream_profile = STREAM_PROFILE_RGB, fps = 30, max_frame_age = 1.0):
         self.width = width
         self.height = height
-        # Configure depth and color streams
+        self.stream_profile = stream_profile
+        self.has_depth = stream_profile in (STREAM_PROFILE_RGBD, STREAM_PROFILE_FULL)
+        self.has_infrared = stream_profile == STREAM_PROFILE_FULL
+
+        # Configure the streams of the profile
         self.config = rs.config()
-        self.config.enable_stream(rs.stream.depth, self.width, self.height, rs.format.z16, 30)
-        self.config.enable_stream(rs.stream.color, self.width, self.height, rs.format.rgb8, 30)
-        self.config.enable_stream(rs.stream.infrared, 1, self.width, self.height, rs.format.y8, 30)
-        self.config.enable_stream(rs.stream.infrared, 2, self.width, self.height, rs.format.y8, 30)
+        self.config.enable_stream(rs.stream.color, self.width, self.height, rs.format.rgb8, fps)
+        if self.has_depth:
+            self.config.enable_stream(rs.stream.depth, self.width, self.height, rs.format.z16, fps)
+        if self.has_infrared:
+            self.config.enable_stream(rs.stream.infrared, 1, self.width, self.height, rs.format.y8, fps)
+            self.config.enable_stream(rs.stream.infrared, 2, self.width, self.height, rs.format.y8, fps)
 
         # Start RealSense pipeline
         self.pipeline = rs.pipeline()
         self.align = rs.align(rs.stream.color)
+        self.align_lock = threading.Lock()
         self.profile = self.pipeline.start(self.config)
 
-        device = self.pipeline.get_active_profile().get_device()
-        depth_sensor = device.first_depth_sensor()
-        if depth_sensor.supports(rs.option.visual_preset):
-            depth_sensor.set_option(rs.option.visual_preset, mode.value)
+        self.depth_scale = 0.001
+        if self.has_depth:
+            device = self.pipeline.get_active_profile().get_device()
+            depth_sensor = device.first_depth_sensor()
+            if depth_sensor.supports(rs.option.visual_preset):
+                depth_sensor.set_option(rs.option.visual_preset, mode.value)
+            self.depth_scale = depth_sensor.get_depth_scale()
+
+        # Background capture, see start_capture. Older frames are not served, readers wait for the device instead.
+        self.max_frame_age = max_frame_age
+        self.capture_thread = None
+        self.capture_running = False
+        self.latest_frame = None
+        self.first_frame_event = threading.Event()
+        self.captured_count = 0
+        self.device_dropped_count = 0
+        self.unread_dropped_count = 0
+        self.capture_error_count = 0
+
+    def align_frames(self, frames):
+        if not self.has_depth:
+            return frames # Nothing to align
+        # The align block is shared by the capture thread and readers
+        with self.align_lock:
+            return self.align.process(frames)
+
+    def _wrap_frames(self, frames) -> CameraFrame:
+        # Keep the frameset alive outside the SDK frame queue, it is processed lazily
+        frames.keep()
+        return CameraFrame(self, frames)
+
+    def _get_fresh_frame(self):
+        """The latest background frame, or None if capture is not running or the frame is too old."""
+        if not self.capture_running:
+            return None
+
+        camera_frame = self.get_latest_frame()
+        if camera_frame is None:
+            return None
+
+        age = time.time() - camera_frame.received_time
+        if age > self.max_frame_age:
+            logger.warning(f'Latest RealSense frame is {age:.2f}s old, waiting for the device instead')
+            return None
+
+        return camera_frame
+
+    def get_latest_color_frame(self):
+        """Color image only, no alignment or depth conversion."""
+        camera_frame = self._get_fresh_frame()
+        if camera_frame is not None:
+            return camera_frame.color_frame
+
+        return np.asanyarray(self.pipeline.wait_for_frames().get_color_frame().get_data())
 
     def get_aligned_frames(self):
+        # With background capture, return the freshest frame without waiting for the device
+        camera_frame = self._get_fresh_frame()
+        if camera_frame is not None:
+            return camera_frame.as_tuple()
+
         # Wait for a coherent pair of frames: aligned depth and color
         frames = self.pipeline.wait_for_frames()
-        aligned_frames = self.align.process(frames)
-        color_frame = np.asanyarray(aligned_frames.get_color_frame().get_data())
-        depth_frame = np.float32(np.asanyarray(aligned_frames.get_depth_frame().get_data())) / 1000.
-        ir_l_image = np.asanyarray(aligned_frames.get_infrared_frame(1).get_data())
-        ir_r_image = np.asanyarray(aligned_frames.get_infrared_frame(2).get_data())
-        return color_frame, depth_frame, ir_l_image, ir_r_image
+        return self._wrap_frames(frames).as_tuple()
+
+    def start_capture(self):
+        """Run the pipeline on a background thread, publishing each frame to a latest-frame slot."""
+        if self.capture_running:
+            return
+
+        self.capture_running = True
+        self.capture_thread = threading.Thread(target=self._capture_loop, name='RealSense Capture')
+        self.capture_thread.daemon = True
+        self.capture_thread.start()
+
+    def stop_capture(self):
+        self.capture_running = False
+        if self.capture_thread is not None:
+            self.capture_thread.join(timeout=2)
+            self.capture_thread = None
+
+    def _capture_loop(self):
+        logger.info('RealSense background capture started')
+        last_frame_number = None
+
+        try:
+            while self.capture_running:
+                try:
+                    frames = self.pipeline.wait_for_frames(1000)
+                    camera_frame = self._wrap_frames(frames)
+                except RuntimeError as e: # Timeout waiting for frames
+                    self.capture_error_count += 1
+                    logger.warning(f'RealSense capture failed: {e}')
+                    continue
+
+                if last_frame_number is not None and camera_frame.frame_number > last_frame_number + 1:
+                    self.device_dropped_count += camera_frame.frame_number - last_frame_number - 1
+                last_frame_number = camera_frame.frame_number
+
+                previous = self.latest_frame
+                if previous is not None and not previous.taken:
+                    self.unread_dropped_count += 1
+
+                # A single reference assignment, readers never wait on a lock
+                self.latest_frame = camera_frame
+                self.captured_count += 1
+                self.first_frame_event.set()
+
+        except Exception as e:
+            self.capture_error_count += 1
+            logger.error(f'RealSense background capture crashed: {e}')
+
+        finally:
+            # Readers go back to waiting for the device
+            self.capture_running = False
+            logger.info('RealSense background capture stopped')
+
+    def get_latest_frame(self, timeout=1.0):
+        """The freshest captured frame, waiting up to timeout seconds for the first one."""
+        if self.latest_frame is None:
+            self.first_frame_event.wait(timeout)
+
+        camera_frame = self.latest_frame
+        if camera_frame is not None:
+            camera_frame.taken = True
+        return camera_frame
+
+    def get_capture_stats(self):
+        camera_frame = self.latest_frame
+        return {
+            "captured": self.captured_count,
+            "device_dropped": self.device_dropped_count,
+            "unread_dropped": self.unread_dropped_count,
+            "errors": self.capture_error_count,
+            "latest_age": None if camera_frame is None else time.time() - camera_frame.received_time,
+        }
 
     def get_frames(self):
         # Wait for a coherent pair of frames: depth and color
         frames = self.pipeline.wait_for_frames()
         color_frame = np.asanyarray(frames.get_color_frame().get_data())
-        depth_frame = np.float32(np.asanyarray(frames.get_depth_frame().get_data())) / 1000.
+        depth_frame = None
+        if self.has_depth:
+            depth_frame = DepthFrame(np.asanyarray(frames.get_depth_frame().get_data()), self.depth_scale)
         return color_frame, depth_frame
 
     def get_camera_intrinsics(self):
@@ -88,11 +289,12 @@ class RealSenseCamera(metaclass=Singleton):
         plt.show()
 
     def close(self):
+        self.stop_capture()
         self.pipeline.stop()
 
 def main():
 
-    camera = RealSenseCamera()
+    camera = RealSenseCamera(stream_profile=STREAM_PROFILE_FULL) # Depth and infrared are printed below
     # camera.show_frames()
     color_frame, depth_frame, ir_l_image, ir_r_image = camera.get_aligned_frames()
     print(f"Color frame shape: {color_frame.shape}")
@@ -43,9 +43,69 @@ class Config(metaclass = Singleton):
         # Memory parameters
         self.max_recent_steps = 5
 
+        # Pipeline parameters
+        self.concurrent_stages = False # Run turn stages with the TurnScheduler; the current stages form a chain, so they still run one after another
+        self.speculative_gathering = False # Start the next information gathering while the action executes
+        self.speculation_delay = 0.5 # Seconds into the action before capturing the speculative frame
+        self.speculation_diff_threshold = 0.02 # Max normalized frame diff to commit the speculative result
+        self.streaming_completions = False # Stream action planning and dialogue responses, acting on each section as it completes
+
+        # Image encoding
+        self.encoded_image_cache_size = 32 # Max data URLs kept by the prompt image cache
+        self.image_payload_policies = { # Per stage image downscaling before upload, see ImagePayloadPolicy
+            'information_gathering': {'max_width': 640, 'max_height': 480, 'jpeg_quality': 85, 'detail': 'high'},
+            'self_reflection': {'max_width': 512, 'max_height': 384, 'jpeg_quality': 75, 'detail': 'low'},
+            'task_inference': {'max_width': 512, 'max_height': 384, 'jpeg_quality': 75, 'detail': 'low'},
+            'action_planning': {'max_width': 640, 'max_height': 480, 'jpeg_quality': 85, 'detail': 'high'},
+            'dialogue': {'max_width': 320, 'max_height': 240, 'jpeg_quality': 70, 'detail': 'low'},
+        }
+        self.image_payload_turn_budget = 1024 * 1024 # Max image bytes uploaded per turn before degrading images
+
+        # Embeddings
+        self.embedding_cache_path = './runs/cache/embeddings.db' # Shared by all runs, None to disable
+        self.embedding_max_workers = 4 # Concurrent requests when a batch spans several embedding chunks
+
+        # Robot server client
+        self.robot_client_timeout = (3.05, 30) # Connect and read timeouts in seconds
+        self.robot_client_retries = 2 # Retries of idempotent requests on connection errors
+        self.robot_client_pool_size = 8 # Keep-alive connections to the robot server
+        self.robot_frame_format = 'json' # 'json' (base64 images) or 'binary' (raw image and depth parts), see frame_protocol
+        self.robot_depth_encoding = 'npy' # 'npy' or 'zlib' (compressed DepthFrame) for stored and uploaded depth frames
+        self.robot_trace_path = None # Replay this trace directory instead of requesting frames from the robot
+        self.robot_frame_streaming = False # Record video from the server MJPEG stream instead of polling frames
+        self.robot_stream_fps = None # Stream rate requested from the server, None for the capture rate video_fps / duplicate_frames
+
+        # Camera
+        self.frame_source = 'realsense' # 'realsense' or 'trace', see frame_source
+        self.frame_trace_path = None # Directory of recorded <id>.jpg/.png frames (and <id>.npy depth) for the trace source
+        self.frame_trace_fps = 30 # Recording rate of the trace
+        self.frame_trace_speed = 1.0 # Replay speed, 0 to advance one frame per request (deterministic)
+        self.frame_save_timeout = 5.0 # Seconds to wait for a frame to be written when its path is needed
+        self.camera_stream_profile = 'rgb' # 'rgb', 'rgbd' or 'full' (with infrared), see hardware/camera.py
+        self.camera_fps = 30
+        self.camera_background_capture = True # Capture on a background thread, frame requests return the latest frame
+        self.camera_max_frame_age = 1.0 # Seconds, older background frames are not returned, the device is read instead
+
+        # Memory
+        self.memory_event_log = True # Log memory writes to an append-only SQLite log instead of dumping memory.json each turn
+        self.memory_flush_interval = 1.0 # Seconds between background flushes of the memory event log
+        self.memory_snapshot_interval = 20 # Steps between full memory snapshots in the event log
+
         # Video
         self.video_fps = 8
         self.frames_per_slice = 1000
+        self.video_clip_cache_size = 32 # Clips memoized by frame id range
+        self.frame_buffer_capacity = 10000 # Max frames kept in memory by the recorder
+        self.frame_buffer_max_bytes = 1024 * 1024 * 1024 # Memory cap of the frame buffer, lowers the capacity for large frames
+        self.capture_queue_sizes = {'convert': 4, 'encode': 64, 'ocr': 1} # Bounded queues of the capture pipeline stages
+        self.duplicate_frames = 1 # Frame ids per captured frame, the frame is stored once; above 1, video slices are not reused as clips
+        self.ocr_enabled = False # OCR the captured frames to detect text changes
+        self.ocr_gate_pixel_threshold = 32 # Grayscale difference for a pixel of the OCR region to count as changed
+        self.ocr_gate_max_changed_pixels = 16 # Max changed pixels since the last OCR'd frame for skipping OCR
+        self.ocr_max_workers = 2 # OCR worker threads in batch mode, each with its own reader
+        self.ocr_cache_size = 512 # OCR results cached by frame hash
+        self.ocr_similarity_threshold = 0.9 # Below this similarity to the previous text, the text has changed
+        self.ocr_different_previous_text = False # Set by the recorder when OCR is enabled
 
         # Skill_data
         self.skill_data_path = './res/skills/data/'
@@ -32,12 +32,21 @@ TASK_INFERENCE_PROMPT_FILE_PATH = './res/prompts/task_inference.prompt'
 ACTION_PLANNING_PROMPT_FILE_PATH = './res/prompts/action_planning.prompt'
 DIALOGUE_PROMPT_FILE_PATH = './res/prompts/dialogue.prompt'
 
+# Pipeline stages
+INFORMATION_GATHERING_STAGE = 'information_gathering'
+SELF_REFLECTION_STAGE = 'self_reflection'
+TASK_INFERENCE_STAGE = 'task_inference'
+ACTION_PLANNING_STAGE = 'action_planning'
+DIALOGUE_STAGE = 'dialogue'
+
 IMAGE_INTRODUCTION = 'image_introduction'
 IMAGE_INTRO = 'image_intro'
 IMAGE_PATH = 'image_path'
 ASSISTANT = 'assistant'
 IMAGE_RESOLUTION = 'image_resolution'
 IMAGE_RESIZE = 'image_resize'
+IMAGE_PAYLOAD_POLICY = 'image_payload_policy'
+IMAGE_PAYLOAD_CHARGED = 'image_payload_charged'
 TASK_DESCRIPTION = 'task_description'
 SUBTASK_DESCRIPTION = 'sub_ask_description'
 PREVIOUS_ACTION_CALL = 'previous_action_call'
@@ -0,0 +1,127 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from pal_agent.environment.skill import Skill
+from pal_agent.utils.check import is_valid_value
+
+
+class SkillEmbeddingIndex():
+    """
+    Skill embeddings kept as one contiguous, row-normalized float32 matrix.
+
+    Retrieval is a single matrix-vector product plus a partial sort, instead of a Python-level dot product per skill.
+    Rows are added and removed in place as skills are registered or deleted.
+    """
+
+    def __init__(self, initial_capacity: int = 64):
+
+        self.initial_capacity = initial_capacity
+        self.clear()
+
+
+    def clear(self) -> None:
+        self.matrix: Optional[np.ndarray] = None
+        self.names: List[str] = []
+        self.positions: Dict[str, int] = {}
+
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+    def __contains__(self, skill_name: str) -> bool:
+        return skill_name in self.positions
+
+
+    def rebuild(self, skills: Dict[str, Skill]) -> None:
+
+        self.clear()
+
+        for skill_name, skill in skills.items():
+            self.add(skill_name, skill.skill_embedding)
+
+
+    def add(self, skill_name: str, embedding: Any) -> None:
+        """Add or replace the embedding of a skill. Skills without a valid embedding are not indexed."""
+
+        if not is_valid_value(embedding):
+            self.remove(skill_name)
+            return
+
+        row = np.asarray(embedding, dtype=np.float32).ravel()
+        if row.shape[0] == 0:
+            self.remove(skill_name)
+            return
+
+        norm = np.linalg.norm(row)
+        if norm > 0:
+            row = row / norm
+
+        if self.matrix is None:
+            self.matrix = np.zeros((self.initial_capacity, row.shape[0]), dtype=np.float32)
+        elif row.shape[0] != self.matrix.shape[1]:
+            raise ValueError(f"Embedding of skill {skill_name} has dimension {row.shape[0]}, expected {self.matrix.shape[1]}.")
+
+        if skill_name in self.positions:
+            self.matrix[self.positions[skill_name]] = row
+            return
+
+        size = len(self.names)
+        if size == self.matrix.shape[0]:
+            grown = np.zeros((self.matrix.shape[0] * 2, self.matrix.shape[1]), dtype=np.float32)
+            grown[:size] = self.matrix[:size]
+            self.matrix = grown
+
+        self.matrix[size] = row
+        self.names.append(skill_name)
+        self.positions[skill_name] = size
+
+
+    def remove(self, skill_name: str) -> None:
+
+        position = self.positions.pop(skill_name, None)
+        if position is None:
+            return
+
+        # Move the last row into the freed slot to keep the matrix contiguous
+        last = len(self.names) - 1
+        last_name = self.names.pop()
+
+        if position != last:
+            self.matrix[position] = self.matrix[last]
+            self.names[position] = last_name
+            self.positions[last_name] = position
+
+
+    def top_k(self, query_embedding: Any, k: int, exclude: Iterable[str] = ()) -> List[str]:
+        """Names of the k skills most similar to the query, best first, skipping the excluded ones."""
+
+        exclude = set(exclude)
+        size = len(self.names)
+
+        if k <= 0 or size == 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        scores = self.matrix[:size] @ query
+
+        # Excluded skills may take some of the top slots, so fetch enough to still return k
+        count = min(size, k + len(exclude))
+        if count < size:
+            candidates = np.argpartition(-scores, count - 1)[:count]
+        else:
+            candidates = np.arange(size)
+
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+        results = []
+        for position in candidates:
+            skill_name = self.names[position]
+            if skill_name in exclude:
+                continue
+            results.append(skill_name)
+            if len(results) >= k:
+                break
+
+        return results
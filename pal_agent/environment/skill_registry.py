@@ -16,6 +16,7 @@ from pal_agent.config.config import Config
 from pal_agent.utils.json_utils import load_json, save_json
 from pal_agent.utils.dict_utils import kget
 from pal_agent.environment.skill import Skill
+from pal_agent.environment.skill_index import SkillEmbeddingIndex
 from pal_agent.environment.utils import serialize_skills, deserialize_skills
 from pal_agent.utils.check import is_valid_value
 from pal_agent.utils.singleton import Singleton
@@ -90,6 +91,7 @@ class SkillRegistry(metaclass=Singleton):
         self.embedding_provider = embedding_provider
 
         self.skills = {}
+        self.skill_index = SkillEmbeddingIndex()
 
         os.makedirs(config.skill_local_path, exist_ok=True)
         logger.info(f"Skill local path: {config.skill_local_path}")
@@ -100,6 +102,7 @@ class SkillRegistry(metaclass=Singleton):
             self.skills = self.load_skills_from_scripts()
 
         self.skills = self.filter_skills(self.skills)
+        self.skill_index.rebuild(self.skills)
 
     # Function to transform the data
     def transform_skill_library_format(self,original_data):
@@ -168,6 +171,41 @@ class SkillRegistry(metaclass=Singleton):
         return np.array(self.embedding_provider.embed_query('{}: {}'.format(skill_name, skill_doc)))
 
 
+    def get_embeddings(self, skill_docs: Dict[str, str]) -> Dict[str, np.ndarray]:
+        """Embed several skills with one batched request, using the same text as get_embedding."""
+
+        if len(skill_docs) == 0:
+            return {}
+
+        skill_names = list(skill_docs.keys())
+        embeddings = self.embedding_provider.embed_documents(['{}: {}'.format(skill_name, skill_docs[skill_name]) for skill_name in skill_names])
+
+        return {skill_name: np.array(embedding) for skill_name, embedding in zip(skill_names, embeddings)}
+
+
+    @staticmethod
+    def is_valid_embedding(skill_embedding) -> bool:
+        if isinstance(skill_embedding, np.ndarray):
+            return skill_embedding.size > 0
+        return is_valid_value(skill_embedding)
+
+
+    def embed_pending_skills(self, skills: Dict[str, Skill]) -> None:
+        """Fill in the embeddings of the skills that have none, in a single batch."""
+
+        pending = {skill_name: inspect.getdoc(skill.skill_function)
+                   for skill_name, skill in skills.items() if not self.is_valid_embedding(skill.skill_embedding)}
+
+        if len(pending) == 0:
+            return
+
+        logger.info(f"Embedding {len(pending)} skills in one batch")
+
+        embeddings = self.get_embeddings(pending)
+        for skill_name, skill_embedding in embeddings.items():
+            skills[skill_name].skill_embedding = skill_embedding
+
+
     def load_skills_from_file(self, file_path) -> Dict[str, Skill]:
 
         logger.info(f"Loading skills from {file_path}")
@@ -176,6 +214,7 @@ class SkillRegistry(metaclass=Singleton):
         skill_local = deserialize_skills(skill_local)
 
         skills = {}
+        previous_skill_names = set(self.skills.keys())
 
         for skill_name in skill_local.keys():
 
@@ -187,7 +226,7 @@ class SkillRegistry(metaclass=Singleton):
             if skill_code_base64 != skill_local[skill_name].skill_code_base64: # The skill_code is modified
                 regenerate_flag = True
 
-            if not is_valid_value(skill_embedding): # The skill_embedding is invalid
+            if not self.is_valid_embedding(skill_embedding): # The skill_embedding is invalid
                 regenerate_flag = True
 
             if skill_name not in self.skill_registered.keys(): # The skill is not in the skill registry
@@ -202,7 +241,13 @@ class SkillRegistry(metaclass=Singleton):
                                            skill_code_base64)
             else: # skill_code has been modified, we should recompute embedding
                 logger.info(f"Regenerate skill {skill_name}")
-                self.register_skill_from_code(skill_local[skill_name].skill_code)
+                self.register_skill_from_code(skill_local[skill_name].skill_code, defer_embedding=True)
+
+        # Regenerated skills were registered into self.skills, keep them in the loaded library
+        for skill_name in self.skills.keys() - previous_skill_names:
+            skills[skill_name] = self.skills[skill_name]
+
+        self.embed_pending_skills(skills)
 
         self.store_skills_to_file(file_path, skills)
 
@@ -229,7 +274,7 @@ class SkillRegistry(metaclass=Singleton):
             if skill_code_base64 != self.skill_registered[skill_name].skill_code_base64: # The skill_code is modified
                 regenerate_flag = True
 
-            if not is_valid_value(skill_embedding): # The skill_embedding is invalid
+            if not self.is_valid_embedding(skill_embedding): # The skill_embedding is invalid
                 regenerate_flag = True
 
             if not regenerate_flag:
@@ -243,10 +288,12 @@ class SkillRegistry(metaclass=Singleton):
                 logger.info(f"Regenerate skill {skill_name}")
                 skills[skill_name] = Skill(skill_name,
                                            self.skill_registered[skill_name].skill_function,
-                                           self.get_embedding(skill_name, inspect.getdoc(self.skill_registered[skill_name].skill_function)),
+                                           None, # embedded below with the other stale skills
                                            self.skill_registered[skill_name].skill_code,
                                            skill_code_base64)
 
+        self.embed_pending_skills(skills)
+
         self.store_skills_to_file(os.path.join(config.skill_local_path, self.skill_library_filename), skills)
 
         return skills
@@ -433,12 +480,13 @@ class SkillRegistry(metaclass=Singleton):
         time.sleep(2)
 
 
-    def register_skill_from_code(self, skill_code: str, overwrite = False) -> Tuple[bool, str]:
+    def register_skill_from_code(self, skill_code: str, overwrite = False, defer_embedding = False) -> Tuple[bool, str]:
         """Register the skill function from the code string.
 
         Args:
             skill_code: the code of skill.
             overwrite: the flag indicates whether to overwrite the skill with the same name or not.
+            defer_embedding: leave the embedding empty, to be computed in a batch by embed_pending_skills.
 
         Returns:
             bool: the true value means that there is no problem in the skill_code. The false value means that we may need to re-generate it.
@@ -527,11 +575,12 @@ class SkillRegistry(metaclass=Singleton):
         skill_code_base64 = base64.b64encode(skill_code.encode('utf-8')).decode('utf-8')
         skill_ins = Skill(skill_name,
                           skill,
-                          self.get_embedding(skill_name, inspect.getdoc(skill)),
+                          None if defer_embedding else self.get_embedding(skill_name, inspect.getdoc(skill)),
                           skill_code,
                           skill_code_base64)
 
         self.skills[skill_name] = skill_ins
+        self.skill_index.add(skill_name, skill_ins.skill_embedding)
         self.recent_skills.append(skill_name)
 
         info = f"Skill '{skill_name}' has been registered."
@@ -548,6 +597,7 @@ class SkillRegistry(metaclass=Singleton):
 
         if skill_name in self.skills:
             del self.skills[skill_name]
+        self.skill_index.remove(skill_name)
         if skill_name in self.recent_skills:
             position = self.recent_skills.index(skill_name)
             self.recent_skills.pop(position)
@@ -557,19 +607,9 @@ class SkillRegistry(metaclass=Singleton):
         skill_num = min(skill_num, len(self.skills))
         target_skills = [skill for skill in self.recent_skills]
 
-        task_emb = np.array(self.embedding_provider.embed_query(query_task))
-
-        sorted_skills = sorted(self.skills.items(), key=lambda x: -np.dot(x[1].skill_embedding, task_emb))
-
-        for skill in sorted_skills:
-
-            skill_name, skill = skill
-
-            if len(target_skills) >= skill_num:
-                break
-            else:
-                if skill_name not in target_skills:
-                    target_skills.append(skill_name)
+        if len(target_skills) < skill_num:
+            task_emb = np.array(self.embedding_provider.embed_query(query_task))
+            target_skills += self.skill_index.top_k(task_emb, skill_num - len(target_skills), exclude=target_skills)
 
         self.recent_skills = []
 
@@ -592,6 +632,7 @@ class SkillRegistry(metaclass=Singleton):
         for skill_key in list(self.skills.keys()):
             if skill_key not in candidates:
                 del self.skills[skill_key]
+                self.skill_index.remove(skill_key)
 
 
     def get_all_skills(self) -> List[str]:
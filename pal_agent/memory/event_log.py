@@ -0,0 +1,181 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from pal_agent.log.logger import Logger
+from pal_agent.utils.json_utils import serialize_data
+
+logger = Logger()
+
+EVENT_APPEND = 'append' # Value appended to a memory bucket
+EVENT_SET = 'set' # Memory bucket replaced by the value
+
+
+class MemoryEventLog():
+    """
+    Append-only SQLite log of memory writes, indexed by key and step.
+
+    Writes are queued in memory and flushed in batches by a background thread, so persisting a turn costs only
+    that turn's writes. Snapshots of the whole memory are stored as zlib compressed JSON; loading replays the
+    events after the latest snapshot.
+    """
+
+    def __init__(self, db_path: str, flush_interval: float = 1.0):
+
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.flush_interval = flush_interval
+        self.pending: List[Tuple[int, str, str, str]] = []
+        self.pending_lock = threading.Lock()
+        self.db_lock = threading.Lock()
+
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.db_lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    step INTEGER NOT NULL,
+                    key TEXT NOT NULL,
+                    op TEXT NOT NULL,
+                    value TEXT NOT NULL
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS events_key_step ON events (key, step)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS events_step ON events (step)")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    step INTEGER NOT NULL,
+                    last_seq INTEGER NOT NULL,
+                    data BLOB NOT NULL
+                )""")
+
+        self.flush_event = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._flush_loop, name='Memory Flush')
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def append(self, step: int, key: str, value: Any, op: str = EVENT_APPEND) -> None:
+        # Serialized now, as the caller may mutate the value later
+        encoded = json.dumps(serialize_data(value), ensure_ascii=False, default=str)
+        with self.pending_lock:
+            self.pending.append((step, key, op, encoded))
+
+
+    def request_flush(self) -> None:
+        """Flush on the background thread without waiting."""
+        self.flush_event.set()
+
+
+    def flush(self) -> None:
+
+        # The database lock is held from taking the batch to writing it, so batches are written in order
+        with self.db_lock:
+            with self.pending_lock:
+                pending, self.pending = self.pending, []
+
+            if not pending:
+                return
+
+            with self.connection:
+                self.connection.executemany("INSERT INTO events (step, key, op, value) VALUES (?, ?, ?, ?)", pending)
+
+
+    def _flush_loop(self) -> None:
+
+        while self.running:
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to flush memory events: {e}")
+
+
+    def snapshot(self, step: int, state: Dict[str, Any]) -> None:
+        """Store the whole memory state, covering all events logged so far."""
+
+        self.flush()
+        data = zlib.compress(json.dumps(serialize_data(state), ensure_ascii=False, default=str).encode('utf-8'))
+
+        with self.db_lock, self.connection:
+            last_seq = self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+            self.connection.execute("INSERT INTO snapshots (step, last_seq, data) VALUES (?, ?, ?)", (step, last_seq, data))
+
+
+    def get_events(self,
+                   key: Optional[str] = None,
+                   step: Optional[int] = None,
+                   start_step: Optional[int] = None,
+                   end_step: Optional[int] = None,
+                   after_seq: int = 0) -> List[Dict[str, Any]]:
+        """Logged events in write order, filtered by key and step (or step range)."""
+
+        self.flush()
+
+        conditions, params = ["seq > ?"], [after_seq]
+        if key is not None:
+            conditions.append("key = ?")
+            params.append(key)
+        if step is not None:
+            conditions.append("step = ?")
+            params.append(step)
+        if start_step is not None:
+            conditions.append("step >= ?")
+            params.append(start_step)
+        if end_step is not None:
+            conditions.append("step <= ?")
+            params.append(end_step)
+
+        with self.db_lock:
+            rows = self.connection.execute(
+                f"SELECT seq, step, key, op, value FROM events WHERE {' AND '.join(conditions)} ORDER BY seq", params).fetchall()
+
+        return [{"seq": seq, "step": step, "key": key, "op": op, "value": json.loads(value)} for seq, step, key, op, value in rows]
+
+
+    def load_state(self, max_recent_steps: int) -> Tuple[Optional[Dict[str, Any]], int]:
+        """
+        Rebuild the memory from the latest snapshot and the events after it. Returns (state, step), where step is
+        the next step to log under: the snapshot's step, or one past the last logged event.
+        """
+
+        with self.db_lock:
+            row = self.connection.execute("SELECT step, last_seq, data FROM snapshots ORDER BY last_seq DESC LIMIT 1").fetchone()
+
+        state, step, last_seq = None, 0, 0
+        if row is not None:
+            step, last_seq, data = row
+            state = json.loads(zlib.decompress(data).decode('utf-8'))
+
+        events = self.get_events(after_seq=last_seq)
+        if state is None and not events:
+            return None, 0
+
+        state = state if state is not None else {}
+        for event in events:
+            step = max(step, event["step"] + 1)
+            if event["op"] == EVENT_SET:
+                state[event["key"]] = event["value"]
+            else:
+                bucket = state.setdefault(event["key"], [])
+                bucket.append(event["value"])
+                if len(bucket) > max_recent_steps:
+                    bucket.pop(0)
+
+        return state, step
+
+
+    def close(self) -> None:
+
+        self.running = False
+        self.flush_event.set()
+        self.thread.join(timeout=2)
+
+        self.flush()
+        with self.db_lock:
+            self.connection.close()
@@ -11,6 +11,7 @@ from pal_agent.config.config import Config
 from pal_agent import constants
 from pal_agent.log.logger import Logger
 from pal_agent.memory.base import BaseMemory, Image
+from pal_agent.memory.event_log import MemoryEventLog, EVENT_APPEND, EVENT_SET
 from pal_agent.utils.json_utils import load_json, save_json
 from pal_agent.utils import Singleton
 
@@ -21,6 +22,7 @@ logger = Logger()
 class LocalMemory(BaseMemory, metaclass=Singleton):
 
     storage_filename = "memory.json"
+    event_log_filename = "memory.db"
 
     def __init__(
         self,
@@ -57,6 +59,18 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
             constants.SUCCESS_DETECTION: [],
             }
 
+        # Each save() ends a step; writes are logged as they happen instead of rewriting the whole memory
+        self.step = 0
+        self.event_log = None
+        if config.memory_event_log:
+            self.event_log = MemoryEventLog(os.path.join(self.memory_path, self.event_log_filename),
+                                            flush_interval=config.memory_flush_interval)
+
+
+    def _log_event(self, key: str, value: Any, op: str = EVENT_APPEND) -> None:
+        if self.event_log is not None:
+            self.event_log.append(self.step, key, value, op)
+
 
     def add_recent_history_kv(
         self,
@@ -69,6 +83,7 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
             self.recent_history[key] = []
 
         self.recent_history[key].append(info)
+        self._log_event(key, info)
 
         if len(self.recent_history[key]) > self.max_recent_steps:
             self.recent_history[key].pop(0)
@@ -84,6 +99,7 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
             if key not in self.recent_history:
                 self.recent_history[key] = []
             self.recent_history[key].append(value)
+            self._log_event(key, value)
 
             if len(self.recent_history[key]) > self.max_recent_steps:
                 self.recent_history[key].pop(0)
@@ -113,6 +129,7 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
 
     def add_summarization(self, summary: str) -> None:
         self.recent_history[constants.SUMMARIZATION_MEM_BUCKET] = [summary]
+        self._log_event(constants.SUMMARIZATION_MEM_BUCKET, [summary], EVENT_SET)
 
 
     def get_summarization(self) -> str:
@@ -122,8 +139,11 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
     def add_task_guidance(self, task_description: str, long_horizon: bool) -> None:
         self.recent_history[constants.LAST_TASK_GUIDANCE] = task_description
         self.recent_history[constants.LAST_TASK_DURATION] = self.task_duration
+        self._log_event(constants.LAST_TASK_GUIDANCE, task_description, EVENT_SET)
+        self._log_event(constants.LAST_TASK_DURATION, self.task_duration, EVENT_SET)
         if long_horizon:
             self.recent_history['long_horizon_task'] = task_description
+            self._log_event('long_horizon_task', task_description, EVENT_SET)
 
 
     def get_task_guidance(self, use_last = True) -> str:
@@ -131,28 +151,67 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
             return self.recent_history[constants.LAST_TASK_GUIDANCE]
         else:
             self.recent_history[constants.LAST_TASK_DURATION] -= 1
+            self._log_event(constants.LAST_TASK_DURATION, self.recent_history[constants.LAST_TASK_DURATION], EVENT_SET)
             if self.recent_history[constants.LAST_TASK_DURATION] >= 0:
                 return self.recent_history[constants.LAST_TASK_GUIDANCE]
             else:
                 return self.recent_history['long_horizon_task']
 
 
+    def get_history_events(self, key: str = None, step: int = None, start_step: int = None, end_step: int = None) -> List[Dict[str, Any]]:
+        """Logged memory writes by key and step, including the ones trimmed from recent_history."""
+        if self.event_log is None:
+            return []
+        return self.event_log.get_events(key=key, step=step, start_step=start_step, end_step=end_step)
+
+
     def load(self, load_path=None) -> None:
-        """Load the memory from the local file."""
+        """Load the memory from the local file, a JSON dump or an event log (.db)."""
         # @TODO load and store whole memory
         if load_path != None:
-            if os.path.exists(os.path.join(load_path)):
-                self.recent_history = load_json(load_path)
-                logger.write(f"{load_path} has been loaded.")
-            else:
+            if not os.path.exists(os.path.join(load_path)):
                 logger.error(f"{load_path} does not exist.")
+            elif load_path.endswith('.db'):
+                event_log = MemoryEventLog(load_path)
+                state, step = event_log.load_state(self.max_recent_steps)
+                event_log.close()
+                if state is not None:
+                    self.recent_history.update(state)
+                    self.step = step
+                    self._snapshot_loaded_state()
+                logger.info(f"{load_path} has been loaded, continuing at step {step}.")
+            else:
+                self.recent_history = load_json(load_path)
+                self._snapshot_loaded_state()
+                logger.info(f"{load_path} has been loaded.")
+
+
+    def _snapshot_loaded_state(self) -> None:
+        # The loaded state is not in this run's event log yet, later events are deltas on top of it
+        if self.event_log is not None:
+            self.event_log.snapshot(self.step, self.recent_history)
 
 
     def save(self, local_path=None) -> None:
-        """Save the memory to the local file."""
+        """
+        Save the memory. With the event log, this ends the step: the step's writes are flushed in the background,
+        with a snapshot every config.memory_snapshot_interval steps. A path, or no event log, writes a full JSON dump.
+        """
         # @TODO load and store whole memory
         if local_path:
             save_json(file_path=local_path, json_dict=self.recent_history, indent=4)
+        elif self.event_log is not None:
+            self.step += 1
+            if self.step % config.memory_snapshot_interval == 0:
+                self.event_log.snapshot(self.step, self.recent_history)
+            else:
+                self.event_log.request_flush()
         else:
             save_json(file_path=os.path.join(self.memory_path, self.storage_filename), json_dict=self.recent_history,
                       indent=4)
+
+
+    def close(self) -> None:
+        if self.event_log is not None:
+            self.event_log.close()
+            self.event_log = None
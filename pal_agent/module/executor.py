@@ -1,6 +1,7 @@
 import os
 import time
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
 
 from pal_agent.config.config import Config
 from pal_agent.log.logger import Logger
@@ -28,7 +29,89 @@ class Executor(BaseProvider):
         self.video_recorder = VideoRecordProvider(os.path.join(config.work_dir, 'video.mp4'))
         self.memory = LocalMemory(memory_path=config.work_dir, max_recent_steps=config.max_recent_steps)
         self.robot_interface = robot_interface
-        pass
+
+        # Action started before the plan was complete, e.g. from a streamed action planning response
+        self.dispatched_action = None
+        self.dispatch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Action Dispatch')
+
+
+    def dispatch_action(self, action: str) -> None:
+        """Start executing an action early. The next call picks up its result instead of executing it again."""
+
+        if self.dispatched_action is not None:
+            logger.warning(f'Action {self.dispatched_action[0]} already dispatched, ignoring {action}.')
+            return
+
+        logger.info(f'>>> Dispatching action early: {action}')
+        # The action's frames start now, not when the plan is executed
+        start_frame_id = self.video_recorder.get_current_frame_id()
+        future = self.dispatch_executor.submit(self.execute_skill_steps, [action])
+        self.dispatched_action = (action, future, start_frame_id)
+
+
+    def record_dispatched_action(self, action: str, exec_info: Dict[str, Any]) -> None:
+        """Keep an early action that is not part of the executed plan in the action history."""
+
+        self.memory.add_recent_history_kv(constants.ACTION, exec_info.get(constants.LAST_SKILL, action))
+        if exec_info[constants.ERRORS]:
+            self.memory.add_recent_history_kv(constants.ACTION_ERROR, exec_info[constants.ERRORS_INFO])
+        else:
+            self.memory.add_recent_history_kv(constants.ACTION_ERROR, '')
+
+
+    def discard_dispatched_action(self) -> None:
+        """Settle an early action whose plan was not completed, so the next turn does not pick it up."""
+
+        if self.dispatched_action is None:
+            return
+
+        action, future, _ = self.dispatched_action
+        self.dispatched_action = None
+
+        logger.warning(f'Action planning did not complete, keeping the result of the dispatched action {action}.')
+        self.record_dispatched_action(action, future.result())
+
+
+    def execute_skill_steps(self, skill_steps: List[str], announce: bool = True) -> Dict[str, Any]:
+
+        if config.is_robot is True:
+
+            if announce and 'speak' not in str(skill_steps) and 'listen' not in str(skill_steps):
+                    self.gm.audio_log(messages=skill_steps, is_skill=True)
+                    time.sleep(.1)
+            # exec_info = self.robot_interface.execute_actions(skill_steps)
+
+            exec_info = self.gm.execute_actions(skill_steps)
+
+        else:
+
+            exec_info = self.gm.execute_actions(skill_steps)
+
+        return exec_info
+
+
+    def execute_with_dispatched_action(self, skill_steps: List[str]) -> Dict[str, Any]:
+
+        action, future, _ = self.dispatched_action
+        self.dispatched_action = None
+
+        # Wait for the early action in any case, the robot should not run two actions at once
+        exec_info = future.result()
+
+        if len(skill_steps) == 0 or skill_steps[0] != action:
+            # The early action already ran, record it and execute only the plan
+            logger.warning(f'Dispatched action {action} does not match the planned actions {skill_steps}, '
+                           f'recording it and executing the plan.')
+            self.record_dispatched_action(action, exec_info)
+            return self.execute_skill_steps(skill_steps)
+
+        if exec_info[constants.ERRORS] or len(skill_steps) == 1:
+            return exec_info
+
+        remaining_exec_info = self.execute_skill_steps(skill_steps[1:], announce=False)
+        remaining_exec_info[constants.EXECUTED_SKILLS] = exec_info[constants.EXECUTED_SKILLS] + remaining_exec_info[constants.EXECUTED_SKILLS]
+
+        return remaining_exec_info
 
 
     @BaseProvider.write
@@ -71,18 +154,11 @@ class Executor(BaseProvider):
         # if "towards" in pre_action:
         #     print()
 
-        if config.is_robot is True:
-
-            if 'speak' not in str(skill_steps) and 'listen' not in str(skill_steps):
-                    self.gm.audio_log(messages=skill_steps, is_skill=True)
-                    time.sleep(.1)
-            # exec_info = self.robot_interface.execute_actions(skill_steps)
-
-            exec_info = self.gm.execute_actions(skill_steps)
-
+        if self.dispatched_action is not None:
+            start_frame_id = self.dispatched_action[2]
+            exec_info = self.execute_with_dispatched_action(skill_steps)
         else:
-
-            exec_info = self.gm.execute_actions(skill_steps)
+            exec_info = self.execute_skill_steps(skill_steps)
 
         # # > Post-processing
         logger.info(f'>>> Post skill execution sensing...')
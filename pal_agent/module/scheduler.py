@@ -0,0 +1,134 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pal_agent.log.logger import Logger
+
+logger = Logger()
+
+
+class TurnScheduler:
+    """
+    Runs the stages of one agent turn as a DAG.
+
+    Each stage is an async callable with a list of stages it depends on. A stage starts as soon as
+    all its dependencies have finished, so independent stages (e.g. several LLM calls) overlap and
+    the turn only waits on the critical path.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        self.dependencies: Dict[str, List[str]] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+
+    def add_stage(self, name: str, func: Callable[[], Awaitable[Any]], depends_on: Optional[List[str]] = None) -> None:
+
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already registered.")
+
+        self.stages[name] = func
+        self.dependencies[name] = list(depends_on) if depends_on else []
+
+
+    def get_execution_order(self) -> List[str]:
+        """Topologically sort the stages, raising on unknown dependencies or cycles."""
+
+        for name, deps in self.dependencies.items():
+            for dep in deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage {name} depends on unknown stage {dep}.")
+
+        order = []
+        visited = {}
+
+        def visit(name):
+            state = visited.get(name)
+            if state == "done":
+                return
+            if state == "visiting":
+                raise ValueError(f"Cycle detected in turn stages at {name}.")
+
+            visited[name] = "visiting"
+            for dep in self.dependencies[name]:
+                visit(dep)
+            visited[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+
+        return order
+
+
+    async def run_async(self, stop_condition: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+        """
+        Run all stages, respecting dependencies.
+
+        After each stage finishes, stop_condition is checked. If it returns True, stages that have not
+        started yet are skipped and the ones still running are cancelled.
+        """
+
+        order = self.get_execution_order()
+        results = {}
+        tasks: Dict[str, asyncio.Task] = {}
+        stop_event = asyncio.Event()
+        self.timings = {}
+
+        turn_start = time.perf_counter()
+
+        async def run_stage(name):
+
+            deps = [tasks[dep] for dep in self.dependencies[name]]
+            if deps:
+                # asyncio.wait does not cancel the dependencies when this stage itself gets cancelled
+                await asyncio.wait(deps)
+                for dep in deps:
+                    if not dep.cancelled() and dep.exception() is not None:
+                        raise dep.exception()
+
+            if stop_event.is_set():
+                logger.info(f"Skipping stage {name}, turn was stopped.")
+                return None
+
+            start = time.perf_counter()
+            result = await self.stages[name]()
+            end = time.perf_counter()
+
+            self.timings[name] = {
+                "start": start - turn_start,
+                "end": end - turn_start,
+                "duration": end - start,
+            }
+            results[name] = result
+
+            if stop_condition is not None and stop_condition():
+                stop_event.set()
+                for other_name, task in tasks.items():
+                    if other_name != name and not task.done():
+                        task.cancel()
+
+            return result
+
+        # Dependencies are created first, so each stage can await their tasks
+        for name in order:
+            tasks[name] = asyncio.create_task(run_stage(name), name=name)
+
+        outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        for name, outcome in zip(tasks.keys(), outcomes):
+            if isinstance(outcome, asyncio.CancelledError):
+                logger.info(f"Stage {name} was cancelled.")
+            elif isinstance(outcome, BaseException):
+                raise outcome
+
+        wall_time = time.perf_counter() - turn_start
+        sequential_time = sum(timing["duration"] for timing in self.timings.values())
+        logger.info(f"Turn stages finished in {wall_time:.2f}s (sequential sum {sequential_time:.2f}s): "
+                    + ", ".join(f"{name} {timing['duration']:.2f}s" for name, timing in self.timings.items()))
+
+        return results
+
+
+    def run(self, stop_condition: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+        return asyncio.run(self.run_async(stop_condition=stop_condition))
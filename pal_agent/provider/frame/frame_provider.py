@@ -1,21 +1,22 @@
 import time
 import os
-import cv2
-
 
 from pal_agent.log.logger import Logger
 from pal_agent.config.config import Config
 from pal_agent.provider.base_provider import BaseProvider
-from hardware.camera import RealSenseCamera
+from pal_agent.utils.frame_utils import Frame, FrameWriter
+from pal_agent.provider.frame.frame_source import FrameSource, create_frame_source
 
 config = Config()
 logger = Logger()
 
 class FrameProvider(BaseProvider):
-    def __init__(self):
+    def __init__(self, frame_source: FrameSource = None):
         super(FrameProvider).__init__()
 
-        self.camera = RealSenseCamera()
+        if frame_source is None:
+            frame_source = create_frame_source()
+        self.frame_source = frame_source
         self.rgb_frame = None
 
         self.screen_region = [0, 0, 640, 480]
@@ -23,21 +24,35 @@ class FrameProvider(BaseProvider):
         os.makedirs(self.frame_path_dir, exist_ok=True)
 
         self.frame_count = 0
+        self.frame_writer = FrameWriter()
 
-    def get_current_frame_path(self):
+    def capture_frame(self) -> Frame:
+        """
+        Capture a frame and keep it in memory. The JPEG is written to disk asynchronously.
+        """
 
-        self.rgb_frame, _, _, _ = self.camera.get_aligned_frames()
+        # BGR, like every frame source
+        self.rgb_frame = self.frame_source.get_color_frame()
 
-        # change the frame to BGR format
-        self.rgb_frame = cv2.cvtColor(self.rgb_frame, cv2.COLOR_RGB2BGR)
+        self.frame_count += 1
+        rgb_frame_img_path = os.path.join(self.frame_path_dir, f'rgb_frame_{time.strftime("%Y%m%d-%H%M%S")}_{self.frame_count}.jpg')
 
-        rgb_frame_img_path = os.path.join(self.frame_path_dir, f'rgb_frame_{time.strftime("%Y%m%d-%H%M%S")}.jpg')
-        cv2.imwrite(rgb_frame_img_path, self.rgb_frame)
+        frame = Frame(self.rgb_frame, path=rgb_frame_img_path)
+        self.frame_writer.save(frame)
 
-        self.frame_count += 1
-        logger.info(f"Frame {self.frame_count} captured and saved at {rgb_frame_img_path}")
+        logger.info(f"Frame {self.frame_count} captured, saving at {rgb_frame_img_path}")
+
+        return frame
+
+    def get_current_frame_path(self):
+
+        frame = self.capture_frame()
+        if not frame.wait_saved(config.frame_save_timeout):
+            raise IOError(f"Timed out saving frame to {frame.path}.")
+        if frame.save_error is not None:
+            raise IOError(f"Failed to save frame to {frame.path}: {frame.save_error}")
 
-        return rgb_frame_img_path
+        return frame.path
 
     def get_current_frame_cont(self):
         return self.frame_count
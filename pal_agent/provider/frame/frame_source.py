@@ -0,0 +1,161 @@
+import glob
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional
+
+import numpy as np
+import cv2
+
+from pal_agent.config.config import Config
+from pal_agent.log.logger import Logger
+from pal_agent.utils.depth_utils import DepthFrame
+
+config = Config()
+logger = Logger()
+
+FRAME_SOURCE_REALSENSE = 'realsense'
+FRAME_SOURCE_TRACE = 'trace'
+
+TRACE_FRAME_PATTERN = re.compile(r'\d+\.(jpg|png)')
+
+
+class FrameSource(ABC):
+    """Where FrameProvider gets its frames from. Color frames are BGR."""
+
+    @abstractmethod
+    def get_color_frame(self) -> np.ndarray:
+        pass
+
+
+    def get_depth_frame(self) -> Optional[DepthFrame]:
+        return None
+
+
+    def close(self) -> None:
+        pass
+
+
+class RealSenseFrameSource(FrameSource):
+
+    def __init__(self):
+        # Imported here, so other sources work on machines without the RealSense SDK
+        from hardware.camera import RealSenseCamera
+
+        self.camera = RealSenseCamera(stream_profile=config.camera_stream_profile, fps=config.camera_fps,
+                                      max_frame_age=config.camera_max_frame_age)
+        if config.camera_background_capture:
+            self.camera.start_capture()
+
+
+    def get_color_frame(self) -> np.ndarray:
+        # Only color is read, so no depth alignment or conversion
+        return cv2.cvtColor(self.camera.get_latest_color_frame(), cv2.COLOR_RGB2BGR)
+
+
+    def get_depth_frame(self) -> Optional[DepthFrame]:
+        return self.camera.get_aligned_frames()[1]
+
+
+    def close(self) -> None:
+        self.camera.close()
+
+
+def natural_sort_key(path: str):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', os.path.basename(path))]
+
+
+class TraceFrameSource(FrameSource):
+    """
+    Replays a recorded trace: a directory of frames named by their number, <id>.jpg or <id>.png, in id order. Each
+    can have a depth map saved next to it as <id>.npy or <id>_depth.npy. Other files, e.g. colored depth images
+    (<id>_depth.jpg), are ignored.
+
+    With speed > 0, the frame shown is the one the trace would show at the elapsed clock time, at fps frames per
+    second times speed. With speed 0, each request advances one frame, independent of wall time, so runs are
+    reproducible. The clock can be replaced for deterministic tests.
+    """
+
+    def __init__(self,
+                 trace_dir: str,
+                 fps: float = 30.,
+                 speed: float = 1.,
+                 loop: bool = True,
+                 clock: Callable[[], float] = time.monotonic):
+
+        self.trace_dir = trace_dir
+        self.fps = fps
+        self.speed = speed
+        self.loop = loop
+        self.clock = clock
+
+        self.image_paths: List[str] = sorted((path for path in glob.glob(os.path.join(trace_dir, '*'))
+                                              if TRACE_FRAME_PATTERN.fullmatch(os.path.basename(path))),
+                                             key=natural_sort_key)
+        if not self.image_paths:
+            raise ValueError(f"No frames found in trace {trace_dir}.")
+
+        self.start_time = None
+        self.step = -1
+        self.index = 0
+        self._cached_index = None
+        self._cached_frame = None
+
+        logger.info(f"Replaying trace {trace_dir}: {len(self.image_paths)} frames, fps {fps}, speed {speed}")
+
+
+    def _advance(self) -> int:
+
+        if self.speed > 0:
+            if self.start_time is None:
+                self.start_time = self.clock()
+            position = int((self.clock() - self.start_time) * self.fps * self.speed)
+        else:
+            self.step += 1
+            position = self.step
+
+        if self.loop:
+            self.index = position % len(self.image_paths)
+        else:
+            self.index = min(position, len(self.image_paths) - 1)
+
+        return self.index
+
+
+    def get_color_frame(self) -> np.ndarray:
+        """A copy of the frame, callers may modify it without changing later reads of the same frame."""
+
+        index = self._advance()
+        if index != self._cached_index:
+            frame = cv2.imread(self.image_paths[index])
+            if frame is None:
+                raise IOError(f"Failed to read trace frame {self.image_paths[index]}.")
+            self._cached_frame = frame
+            self._cached_index = index
+
+        return self._cached_frame.copy()
+
+
+    def get_depth_frame(self) -> Optional[DepthFrame]:
+        """Depth of the frame last returned by get_color_frame."""
+
+        stem = os.path.splitext(self.image_paths[self.index])[0]
+        for path in (stem + '.npy', stem + '_depth.npy'):
+            if os.path.exists(path):
+                return DepthFrame.load(path)
+
+        return None
+
+
+def create_frame_source(source: str = None) -> FrameSource:
+
+    if source is None:
+        source = config.frame_source
+
+    if source == FRAME_SOURCE_TRACE:
+        return TraceFrameSource(config.frame_trace_path, fps=config.frame_trace_fps, speed=config.frame_trace_speed)
+    elif source == FRAME_SOURCE_REALSENSE:
+        return RealSenseFrameSource()
+    else:
+        raise ValueError(f"Unknown frame source {source}.")
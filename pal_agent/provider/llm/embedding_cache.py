@@ -0,0 +1,105 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from pal_agent.log.logger import Logger
+
+logger = Logger()
+
+
+class EmbeddingCache():
+    """
+    On-disk store of text embeddings, keyed by embedding model and text hash.
+
+    Embeddings are kept as float32 blobs in SQLite, so they survive restarts and are shared between runs.
+    """
+
+    def __init__(self, db_path: str):
+
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    embedding BLOB NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )""")
+
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up embeddings for the texts, with None for the ones not in the cache."""
+
+        hashes = [self.hash_text(text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+
+        unique_hashes = list(set(hashes))
+        batch_size = 500 # stay below SQLite's host parameter limit
+
+        with self.lock:
+            for i in range(0, len(unique_hashes), batch_size):
+                batch = unique_hashes[i:i + batch_size]
+                rows = self.connection.execute(
+                    f"SELECT text_hash, dim, embedding FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model] + batch).fetchall()
+
+                for text_hash, dim, blob in rows:
+                    embedding = np.frombuffer(blob, dtype=np.float32)
+                    if embedding.shape[0] == dim:
+                        found[text_hash] = embedding
+
+            results = [found.get(text_hash) for text_hash in hashes]
+            hits = sum(1 for result in results if result is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+
+        return results
+
+
+    def put_many(self, model: str, texts: List[str], embeddings: List[List[float]]) -> None:
+
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            embedding = np.asarray(embedding, dtype=np.float32)
+            rows.append((model, self.hash_text(text), embedding.shape[0], embedding.tobytes()))
+
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, embedding) VALUES (?, ?, ?, ?)", rows)
+
+
+    def clear(self, model: Optional[str] = None) -> None:
+
+        with self.lock, self.connection:
+            if model is None:
+                self.connection.execute("DELETE FROM embeddings")
+            else:
+                self.connection.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            count = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {"entries": count, "hits": self.hits, "misses": self.misses}
+
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
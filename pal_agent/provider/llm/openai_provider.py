@@ -1,11 +1,14 @@
 """Base class for LLM model providers."""
 import abc
 import os
-import json
-import re
+import io
+import math
 import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import (
     Any,
+    Callable,
     Dict,
     List,
     Literal,
@@ -19,12 +22,16 @@ from typing import (
 import backoff
 import tiktoken
 import numpy as np
+from PIL import Image
 from openai import OpenAI, APIError, RateLimitError, APITimeoutError
 
 from pal_agent import constants
 from pal_agent.utils.json_utils import load_json
-from pal_agent.utils.encoding_utils import encode_data_to_base64_path
-from pal_agent.utils.file_utils import assemble_project_path, read_resource_file
+from pal_agent.utils.encoding_utils import encode_data_to_base64_path, decode_image
+from pal_agent.utils.frame_utils import Frame, ImagePayloadPolicy, payload_image_size
+from pal_agent.utils.prompt_utils import CompiledPromptTemplate
+from pal_agent.provider.llm.embedding_cache import EmbeddingCache
+from pal_agent.utils.file_utils import assemble_project_path
 from pal_agent.log.logger import Logger
 from pal_agent.config.config import Config
 
@@ -62,7 +69,10 @@ class LLMProvider(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def assemble_prompt(self, template_str: str = None, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    def assemble_prompt(self,
+                        template_str: str = None,
+                        params: Dict[str, Any] = None,
+                        template: CompiledPromptTemplate = None) -> List[Dict[str, Any]]:
         """Combine parametes in the appropriate way for the provider to use."""
         pass
 
@@ -131,6 +141,17 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         """
         self.retries = 5
 
+        # Image bytes sent in the current turn, checked against config.image_payload_turn_budget
+        self.image_payload_bytes = 0
+        self.image_payload_lock = threading.Lock()
+        # (width, height) of the encoded images of the turn, by data URL, for counting tokens without decoding
+        self.image_payload_sizes = {}
+
+        # Embeddings persisted across runs, keyed by embedding model and text
+        self.embedding_cache = None
+        if config.embedding_cache_path:
+            self.embedding_cache = EmbeddingCache(assemble_project_path(config.embedding_cache_path))
+
 
     def init_provider(self, provider_cfg = provider_cfg ) -> None:
         self.provider_cfg = self._parse_config(provider_cfg)
@@ -226,12 +247,23 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         _chunk_size = self.chunk_size
         _iter = range(0, len(tokens), _chunk_size)
 
-        for i in _iter:
+        def _embed_chunk(chunk):
             response = self.embed_with_retry(
-                input=tokens[i : i + self.chunk_size],
+                input=chunk,
                 **self._emb_invocation_params,
             )
-            batched_embeddings.extend(r.embedding for r in response.data)
+            return [r.embedding for r in response.data]
+
+        chunks = [tokens[i : i + _chunk_size] for i in _iter]
+
+        # Large batches (e.g. a cold skill library) send their chunks concurrently, bounded by config.embedding_max_workers
+        if len(chunks) > 1 and config.embedding_max_workers > 1:
+            with ThreadPoolExecutor(max_workers=min(config.embedding_max_workers, len(chunks))) as executor:
+                for chunk_embeddings in executor.map(_embed_chunk, chunks):
+                    batched_embeddings.extend(chunk_embeddings)
+        else:
+            for chunk in chunks:
+                batched_embeddings.extend(_embed_chunk(chunk))
 
         results: List[List[List[float]]] = [[] for _ in range(len(texts))]
         num_tokens_in_batch: List[List[int]] = [[] for _ in range(len(texts))]
@@ -268,7 +300,23 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         """
         # NOTE: to keep things simple, we assume the list may contain texts longer
         #       than the maximum context and use length-safe embedding function.
-        return self._get_len_safe_embeddings(texts)
+        if self.embedding_cache is None:
+            return self._get_len_safe_embeddings(texts)
+
+        cached = self.embedding_cache.get_many(self.embedding_model, texts)
+
+        # Only embed each distinct missing text once
+        missing_texts = list(dict.fromkeys(text for text, embedding in zip(texts, cached) if embedding is None))
+
+        if len(missing_texts) > 0:
+            missing_embeddings = self._get_len_safe_embeddings(missing_texts)
+            self.embedding_cache.put_many(self.embedding_model, missing_texts, missing_embeddings)
+            new_embeddings = dict(zip(missing_texts, missing_embeddings))
+        else:
+            new_embeddings = {}
+
+        return [embedding.tolist() if embedding is not None else new_embeddings[text]
+                for text, embedding in zip(texts, cached)]
 
 
     def embed_query(self, text: str) -> List[float]:
@@ -357,6 +405,104 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
             max_tokens,
         )
 
+    def create_completion_stream(
+        self,
+        messages: List[Dict[str, str]],
+        on_delta: Optional[Callable[[str], Any]] = None,
+        model: str | None = None,
+        temperature: float = constants.OPENAI_TEMPRATURE,
+        seed: int = constants.OPENAI_SEED,
+        max_tokens: int = constants.OPENAI_MAX_TOKENS,
+    ) -> Tuple[str, Dict[str, int]]:
+        """
+        Create a chat completion using the OpenAI API, streaming the response.
+
+        on_delta is called with each piece of text as it arrives. Returns the same (message, info) as create_completion.
+        """
+
+        if model is None:
+            model = self.llm_model
+
+        else:
+            logger.info(f"Requesting {model} completion stream...")
+
+        # Only opening the stream is retried, so on_delta never sees the same text twice
+        @backoff.on_exception(
+            backoff.constant,
+            (
+                APIError,
+                RateLimitError,
+                APITimeoutError),
+            max_tries=self.retries,
+            interval=10,
+        )
+        def _open_stream_with_retry():
+            return self.client.chat.completions.create(model=model,
+            messages=messages,
+            temperature=temperature,
+            seed=seed,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},)
+
+        stream = _open_stream_with_retry()
+
+        deltas = []
+        usage = None
+        system_fingerprint = None
+
+        for chunk in stream:
+
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.system_fingerprint is not None:
+                system_fingerprint = chunk.system_fingerprint
+
+            if len(chunk.choices) == 0:
+                continue
+
+            delta = chunk.choices[0].delta.content
+            if delta:
+                deltas.append(delta)
+                if on_delta is not None:
+                    on_delta(delta)
+
+        message = ''.join(deltas)
+
+        info = {
+            "prompt_tokens" : usage.prompt_tokens if usage is not None else None,
+            "completion_tokens" : usage.completion_tokens if usage is not None else None,
+            "total_tokens" : usage.total_tokens if usage is not None else None,
+            "system_fingerprint" : system_fingerprint,
+        }
+
+        logger.info(f'Response stream finished from {model}.')
+
+        return message, info
+
+
+    async def create_completion_stream_async(
+            self,
+            messages: List[Dict[str, str]],
+            on_delta: Optional[Callable[[str], Any]] = None,
+            model: str | None = None,
+            temperature: float = constants.OPENAI_TEMPRATURE,
+            seed: int = constants.OPENAI_SEED,
+            max_tokens: int = constants.OPENAI_MAX_TOKENS,
+    ) -> Tuple[str, Dict[str, int]]:
+
+        # on_delta runs on the worker thread
+        return await asyncio.to_thread(
+            self.create_completion_stream,
+            messages,
+            on_delta,
+            model,
+            temperature,
+            seed,
+            max_tokens,
+        )
+
+
     async def create_completion_async(
             self,
             messages: List[Dict[str, str]],
@@ -425,19 +571,17 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         )
 
 
-    def num_tokens_from_messages(self, messages, model):
+    def num_tokens_from_messages(self, messages, model, image_sizes = None):
         """Return the number of tokens used by a list of messages.
         Borrowed from https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+
+        With image_sizes (data URL to (width, height)), images are not decoded and images missing from it are not counted.
         """
         try:
             encoding = tiktoken.encoding_for_model(model)
         except KeyError:
             logger.info("Warning: model not found. Using cl100k_base encoding.")
             encoding = tiktoken.get_encoding("cl100k_base")
-        if model in {
-            "gpt-4-1106-vision-preview",
-        }:
-            raise ValueError("We don't support counting tokens of GPT-4V yet.")
 
         if model in {
             "gpt-3.5-turbo-0613",
@@ -447,7 +591,8 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
             "gpt-4-0613",
             "gpt-4-32k-0613",
             "gpt-4-1106-preview",
-        }:
+            "gpt-4-1106-vision-preview",
+        } or model.startswith("gpt-4o") or model.startswith("gpt-4-turbo"):
             tokens_per_message = 3
             tokens_per_name = 1
         elif model == "gpt-3.5-turbo-0301":
@@ -464,7 +609,17 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         for message in messages:
             num_tokens += tokens_per_message
             for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
+                if isinstance(value, list): # multi-part content with text and images
+                    for part in value:
+                        if part.get("type") == "text":
+                            num_tokens += len(encoding.encode(part["text"]))
+                        elif part.get("type") == "image_url":
+                            if image_sizes is None:
+                                num_tokens += self.num_tokens_from_image(part["image_url"])
+                            elif part["image_url"]["url"] in image_sizes:
+                                num_tokens += self.num_tokens_from_image(part["image_url"], image_sizes[part["image_url"]["url"]])
+                else:
+                    num_tokens += len(encoding.encode(value))
                 if key == "name":
                     num_tokens += tokens_per_name
 
@@ -473,7 +628,40 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         return num_tokens
 
 
-    def assemble_prompt_tripartite(self, template_str: str = None, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    def num_tokens_from_image(self, image_url: Dict[str, str], size: Optional[Tuple[int, int]] = None) -> int:
+        """
+        Estimate the tokens of an image input, following OpenAI's tile-based pricing for vision models.
+        Without the (width, height) size, a data URL is decoded to read it.
+        """
+
+        detail = image_url.get("detail", "auto")
+        if detail == "low":
+            return 85
+
+        if size is not None:
+            width, height = size
+        else:
+            url = image_url["url"]
+            if not url.startswith("data:"):
+                return 85 # remote images are not inspected
+
+            image_data = decode_image(url.split(",", 1)[1])
+            width, height = Image.open(io.BytesIO(image_data)).size
+
+        # Fit within 2048x2048, then scale the shortest side down to 768
+        scale = min(1., 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1., 768 / min(width, height))
+        width, height = width * scale, height * scale
+
+        tiles = math.ceil(width / 512) * math.ceil(height / 512)
+        return 85 + 170 * tiles
+
+
+    def assemble_prompt_tripartite(self,
+                                   template_str: str = None,
+                                   params: Dict[str, Any] = None,
+                                   template: CompiledPromptTemplate = None) -> List[Dict[str, Any]]:
 
         """
         A tripartite prompt is a message with the following structure:
@@ -482,62 +670,25 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         <user message part 1 before image introduction>
         <image introduction>
         <user message part 2 after image introduction>
-        """
 
-        pattern = re.compile(r"(.+?)(?=\n\n|$)", re.DOTALL)
-
-        paragraphs = re.findall(pattern, template_str)
+        Pass a compiled template (see prompt_utils.load_prompt_template) to skip re-parsing the template string.
+        """
 
-        filtered_paragraphs = [p for p in paragraphs if p.strip() != '']
+        if template is None:
+            template = CompiledPromptTemplate(template_str)
 
-        system_content = filtered_paragraphs[0]  # the system content defaults to the first paragraph of the template
         system_message = {
             "role": "system",
             "content": [
                 {
                     "type": "text",
-                    "text": f"{system_content}"
+                    "text": f"{template.system_content}"
                 }
             ]
         }
 
-        # segmenting "paragraphs"
-        image_introduction_paragraph_index = None
-        image_introduction_paragraph = None
-
-        for i, paragraph in enumerate(filtered_paragraphs):
-            if "<$" + constants.IMAGE_INTRODUCTION + "$>" in paragraph:
-                image_introduction_paragraph_index = i
-                image_introduction_paragraph = paragraph
-                break
-
-        user_messages_part1_paragraphs = filtered_paragraphs[1:image_introduction_paragraph_index]
-        user_messages_part2_paragraphs = filtered_paragraphs[image_introduction_paragraph_index + 1:]
-
         # assemble user messages part 1
-        user_messages_part1_contents = []
-        for paragraph in user_messages_part1_paragraphs:
-            search_placeholder_pattern = re.compile(r"<\$[^\$]+\$>")
-
-            placeholder = re.search(search_placeholder_pattern, paragraph)
-            if not placeholder:
-                user_messages_part1_contents.append(paragraph)
-            else:
-                placeholder = placeholder.group()
-                placeholder_name = placeholder.replace("<$", "").replace("$>", "")
-
-                paragraph_input = params.get(placeholder_name, None)
-                if paragraph_input is None or paragraph_input == "" or paragraph_input == []:
-                    continue
-                else:
-                    if isinstance(paragraph_input, str):
-                        paragraph_content = paragraph.replace(placeholder, paragraph_input)
-                        user_messages_part1_contents.append(paragraph_content)
-                    elif isinstance(paragraph_input, list):
-                        paragraph_content = paragraph.replace(placeholder, json.dumps(paragraph_input))
-                        user_messages_part1_contents.append(paragraph_content)
-                    else:
-                        raise ValueError(f"Unexpected input type: {type(paragraph_input)}")
+        user_messages_part1_contents = template.fill_part1(params)
 
         if len(user_messages_part1_contents) > 0:
 
@@ -559,13 +710,18 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         # assemble image introduction messages
         image_introduction_messages = []
 
+        policy = params.get(constants.IMAGE_PAYLOAD_POLICY, None)
+        if isinstance(policy, dict):
+            policy = ImagePayloadPolicy.from_dict(policy)
+        charge_budget = params.get(constants.IMAGE_PAYLOAD_CHARGED, True)
+
         # paragraph_input = params.get(constants.IMAGES_INPUT_TAG_NAME, []) # 'image_introduction'
         paragraph_input = params.get(constants.IMAGE_INTRODUCTION, [])
 
         if paragraph_input is None or paragraph_input == "" or paragraph_input == []:
             image_introduction_messages = []
         else:
-            paragraph_content_pre = image_introduction_paragraph.replace("<$image$>", "")
+            paragraph_content_pre = template.image_introduction_paragraph.replace("<$image$>", "")
             message = {
                 "role": "user",
                 "content": [
@@ -598,9 +754,9 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
                         })
 
                 if path is not None and path != "":
-                    encoded_images = encode_data_to_base64_path(path)
+                    encoded_images = self.encode_images_within_budget(path, policy, charge=charge_budget)
 
-                    for encoded_image in encoded_images:
+                    for encoded_image, detail in encoded_images:
                         msg_content = {
                                 "type": "image_url",
                                 "image_url":
@@ -611,6 +767,8 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
 
                         if resolution is not None and resolution != "":
                             msg_content["image_url"]["detail"] = resolution
+                        elif detail is not None:
+                            msg_content["image_url"]["detail"] = detail
 
                         if resize is not None and resize != "":
                             msg_content["image_url"]["resize"] = resize
@@ -633,32 +791,7 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
                     image_introduction_messages.append(message)
 
         # assemble user messages part 2
-        user_messages_part2_contents = []
-        for paragraph in user_messages_part2_paragraphs:
-            search_placeholder_pattern = re.compile(r"<\$[^\$]+\$>")
-
-            placeholder = re.search(search_placeholder_pattern, paragraph)
-            if not placeholder:
-                user_messages_part2_contents.append(paragraph)
-            else:
-                placeholder = placeholder.group()
-                placeholder_name = placeholder.replace("<$", "").replace("$>", "")
-
-                paragraph_input = params.get(placeholder_name, None)
-                if paragraph_input is None or paragraph_input == "" or paragraph_input == []:
-                    continue
-                else:
-                    if isinstance(paragraph_input, str):
-                        paragraph_content = paragraph.replace(placeholder, paragraph_input)
-                        user_messages_part2_contents.append(paragraph_content)
-                    elif isinstance(paragraph_input, bool) or isinstance(paragraph_input, int) or isinstance(paragraph_input, float):
-                        paragraph_content = paragraph.replace(placeholder, str(paragraph_input))
-                        user_messages_part2_contents.append(paragraph_content)
-                    elif isinstance(paragraph_input, list):
-                        paragraph_content = paragraph.replace(placeholder, json.dumps(paragraph_input))
-                        user_messages_part2_contents.append(paragraph_content)
-                    else:
-                        raise ValueError(f"Unexpected input type: {type(paragraph_input)}")
+        user_messages_part2_contents = template.fill_part2(params)
 
         user_messages_part2_content = "\n\n".join(user_messages_part2_contents)
         user_messages_part2 = {
@@ -676,17 +809,112 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         else:
             prompt_message =  [system_message] + [user_messages_part1] + image_introduction_messages + [user_messages_part2]
 
+        self.log_prompt_payload(prompt_message)
+
         # logger.info(f"Prompt message: {prompt_message}")
         return prompt_message
 
 
+    def reset_image_payload_budget(self) -> None:
+        """Start a new turn for the image payload byte budget."""
+        with self.image_payload_lock:
+            self.image_payload_bytes = 0
+            self.image_payload_sizes = {}
+
+
+    def charge_image_payload(self, num_bytes: int) -> None:
+        """Add image bytes of a prompt assembled outside the budget, e.g. a speculative one, to the current turn."""
+        with self.image_payload_lock:
+            self.image_payload_bytes += num_bytes
+
+
+    @staticmethod
+    def get_image_payload_bytes(messages: List[Dict[str, Any]]) -> int:
+        return sum(len(part["image_url"]["url"])
+                   for message in messages
+                   for part in message["content"] if part.get("type") == "image_url")
+
+
+    def encode_images_within_budget(self, images: Any, policy: Optional[ImagePayloadPolicy] = None, charge: bool = True) -> List[Tuple[str, Optional[str]]]:
+        """
+        Encode images with the payload policy. If an image would exceed the per-turn byte budget,
+        it is re-encoded with a degraded policy. With charge False, the budget is neither checked nor spent.
+
+        Returns (data URL, detail) pairs.
+        """
+
+        budget = config.image_payload_turn_budget if charge else None
+        items = images if isinstance(images, list) else [images]
+
+        results = []
+        for item in items:
+            item_policy = policy
+            encoded_images = encode_data_to_base64_path(item, item_policy)
+            size = sum(len(encoded_image) for encoded_image in encoded_images)
+
+            with self.image_payload_lock:
+                spent = self.image_payload_bytes
+
+            degrade_count = 0
+            while budget is not None and spent + size > budget and degrade_count < 2:
+                item_policy = (item_policy or ImagePayloadPolicy()).degrade()
+                encoded_images = encode_data_to_base64_path(item, item_policy)
+                size = sum(len(encoded_image) for encoded_image in encoded_images)
+                degrade_count += 1
+
+            if degrade_count > 0:
+                logger.info(f"Image payload budget {budget} bytes reached ({spent} spent), degraded image to {item_policy}.")
+
+            if charge:
+                with self.image_payload_lock:
+                    self.image_payload_bytes += size
+
+            # Sizes of in-memory images are known without decoding, for the prompt token count
+            image = item.image if isinstance(item, Frame) else item
+            if isinstance(image, np.ndarray):
+                with self.image_payload_lock:
+                    for encoded_image in encoded_images:
+                        self.image_payload_sizes[encoded_image] = payload_image_size(image, item_policy)
+
+            detail = item_policy.detail if item_policy is not None else None
+            results.extend((encoded_image, detail) for encoded_image in encoded_images)
+
+        return results
+
+
+    def log_prompt_payload(self, messages: List[Dict[str, Any]]) -> None:
+
+        image_parts = [part["image_url"]
+                       for message in messages
+                       for part in message["content"] if part.get("type") == "image_url"]
+        image_bytes = self.get_image_payload_bytes(messages)
+
+        with self.image_payload_lock:
+            image_sizes = dict(self.image_payload_sizes)
+        uncounted = sum(1 for part in image_parts if part["url"] not in image_sizes and part.get("detail") != "low")
+
+        # Logging only, it must not break prompt assembly
+        try:
+            num_tokens = self.num_tokens_from_messages(messages, self.llm_model, image_sizes=image_sizes)
+        except Exception as e:
+            logger.debug(f"Failed to count prompt tokens: {e}")
+            num_tokens = None
+
+        logger.info(f"Prompt payload: {len(image_parts)} images, {image_bytes} image bytes, "
+                    f"{self.image_payload_bytes} image bytes this turn, {num_tokens} prompt tokens"
+                    f"{f' ({uncounted} images of unknown size not counted)' if uncounted else ''}.")
+
+
     def assemble_prompt_paragraph(self, template_str: str = None, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         raise NotImplementedError("This method is not implemented yet.")
 
 
-    def assemble_prompt(self, template_str: str = None, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    def assemble_prompt(self,
+                        template_str: str = None,
+                        params: Dict[str, Any] = None,
+                        template: CompiledPromptTemplate = None) -> List[Dict[str, Any]]:
         # if config.DEFAULT_MESSAGE_CONSTRUCTION_MODE == constants.MESSAGE_CONSTRUCTION_MODE_TRIPART:
         #     return self.assemble_prompt_tripartite(template_str=template_str, params=params)
         # elif config.DEFAULT_MESSAGE_CONSTRUCTION_MODE == constants.MESSAGE_CONSTRUCTION_MODE_PARAGRAPH:
         #     return self.assemble_prompt_paragraph(template_str=template_str, params=params)
-        return self.assemble_prompt_tripartite(template_str=template_str, params=params)
+        return self.assemble_prompt_tripartite(template_str=template_str, params=params, template=template)
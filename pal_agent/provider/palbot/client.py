@@ -1,17 +1,20 @@
 import requests
-import base64
 import time
 import os
 import json
 import ast
+import threading
+from typing import Any, Dict, Tuple
 
-import numpy as np
-from requests_toolbelt.multipart.decoder import MultipartDecoder
+import httpx
+from requests.adapters import HTTPAdapter
 from requests_toolbelt import MultipartEncoder
-import cv2
+from urllib3.util.retry import Retry
 
 from pal_agent.config.config import Config
 from pal_agent.log.logger import Logger
+from pal_agent.provider.palbot.frame_protocol import IMAGE_MODE_RGB, decode_video_frame
+from pal_agent.utils.depth_utils import DEPTH_ENCODING_NPY, DEPTH_ENCODING_ZLIB, DepthFrame
 
 config = Config()
 logger = Logger()
@@ -20,98 +23,150 @@ logger = Logger()
 robot_ip = 'localhost'
 robot_port = 9080
 
-IMAGE_MODE_RGB = 'RGB'
-IMAGE_MODE_RGBD = 'RGB-D'
+
+
+class EndpointLatencyStats:
+    """Request latencies per robot server endpoint."""
+
+    def __init__(self):
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self.lock = threading.Lock()
+
+
+    def record(self, endpoint: str, latency: float, error: bool = False) -> None:
+
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {"count": 0, "errors": 0, "total": 0., "max": 0., "last": 0.})
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["total"] += latency
+            stats["max"] = max(stats["max"], latency)
+            stats["last"] = latency
+
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+
+        with self.lock:
+            return {endpoint: dict(stats, avg=stats["total"] / stats["count"]) for endpoint, stats in self.stats.items()}
+
+
+def encode_action_request(skill, parameters = None, frame_id = None) -> MultipartEncoder:
+
+    json_data = {
+        'skill': skill,
+        'parameters': parameters,
+        'frame_id': frame_id,
+    }
+
+    downloaded_depth_frame_path = os.path.join(config.work_dir, f'{frame_id}_downloaded_depth_frame.npy')
+    if os.path.exists(downloaded_depth_frame_path):
+        with open(downloaded_depth_frame_path, 'rb') as f:
+            depth_frame = f.read()
+        # Uploaded as stored, the server decodes compressed frames with DepthFrame.decompress
+        json_data['depth_encoding'] = DEPTH_ENCODING_ZLIB if DepthFrame.is_compressed(depth_frame) else DEPTH_ENCODING_NPY
+    else:
+        depth_frame = None
+
+    return MultipartEncoder(
+        fields={
+            'json_data': ('json_data', json.dumps(json_data), 'application/json'),
+            'depth_frame': ('depth_frame', depth_frame, 'application/octet-stream')
+        }
+    )
+
+
+def parse_action_response(skill, response_json: Dict[str, Any]) -> Tuple[bool, str]:
+
+    # @ TODO Agent: Handle the case when response shows that robot execution fails
+    if response_json['success']:
+        result = (True, 'Done')
+        logger.info(f"Action execution `{skill}`is successful.")
+    else:
+        logger.info(f"Action execution `{skill}` failed. Reason: {response_json['error_message']}")
+        result = (False, response_json['error_message'])
+    return result
 
 
 class Client:
+    """
+    Robot server client on a pooled keep-alive session.
 
-    def __init__(self, ip, port):
+    Frame and skill requests are retried on connection errors and gateway failures. Actions are not retried,
+    as they may not be idempotent.
+    """
+
+    def __init__(self, ip, port, timeout = None, retries = None, frame_format = None):
         self.robot_ip = ip # currently the ip of my laptop
         self.robot_port = port
         self.base_url =  f'http://{self.robot_ip}:{self.robot_port}'
 
+        self.timeout = timeout if timeout is not None else config.robot_client_timeout
+        retries = retries if retries is not None else config.robot_client_retries
+        self.frame_format = frame_format if frame_format is not None else config.robot_frame_format
+
+        retry = Retry(total=retries,
+                      backoff_factor=0.1,
+                      status_forcelist=[502, 503, 504],
+                      allowed_methods=frozenset(['GET']))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.robot_client_pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.latency_stats = EndpointLatencyStats()
+
+
+    def _request(self, method, endpoint, **kwargs) -> requests.Response:
+
+        start = time.perf_counter()
+        error = True
+        try:
+            response = self.session.request(method, f'{self.base_url}/{endpoint}', timeout=self.timeout, **kwargs)
+            error = not response.ok
+            return response
+        finally:
+            self.latency_stats.record(endpoint, time.perf_counter() - start, error)
+
+
+    def get_latency_stats(self) -> Dict[str, Dict[str, float]]:
+        return self.latency_stats.get_stats()
+
+
+    def close(self) -> None:
+        self.session.close()
+
 
     def get_video_frame(self, mode = IMAGE_MODE_RGB, full_resolution=False):
 
         # In this function, we call the "video_frame" API to get rgb and depth data from robot, then store the data in files.
-        url = f'{self.base_url}/video_frame'
-        print("GET", url)
-
-        response = requests.get(url, params={'mode': mode, "full_resolution": full_resolution})
-        # print("response = ", response.content)
-        # Decode the response
-        decoder = MultipartDecoder.from_response(response)
-
-        # Extract the JSON part
-        json_part = decoder.parts[0]
-        json_data = json.loads(json_part.text)
-
-        # Decode RGB image
-        encoded_rgb_image = json_data['encoded_rgb_image']
-        decoded_rgb_image = base64.b64decode(encoded_rgb_image)
-        rgb_image_np = np.frombuffer(decoded_rgb_image, np.uint8) # Convert bytes to numpy array
-        rgb_image = cv2.imdecode(rgb_image_np, cv2.IMREAD_COLOR)
-        # rgb_image = cv2.cvtColor(rgb_image, cv2.COLOR_BGR2RGB)
-        if rgb_image is None:
-            rgb_image = cv2.imdecode(rgb_image_np, cv2.IMREAD_UNCHANGED)
-
-        # Get frame id
-        frame_id = json_data['frame_id']
-
-        if mode == IMAGE_MODE_RGBD:
-            # Decode depth image
-            encoded_depth_image = json_data['encoded_depth_image']
-            decoded_depth_image = base64.b64decode(encoded_depth_image)
-            depth_image = np.frombuffer(decoded_depth_image, np.uint8) # Convert bytes to numpy array
-            depth_image = cv2.imdecode(depth_image, cv2.IMREAD_COLOR)
-
-            # Extract the depth_frame part
-            depth_frame = decoder.parts[1]
-
-        if mode == IMAGE_MODE_RGBD:
-            return frame_id, rgb_image, depth_image, depth_frame
-        else:
-            return frame_id, rgb_image, None, None
+        logger.debug(f"GET {self.base_url}/video_frame")
 
+        response = self._request('GET', 'video_frame', params={'mode': mode, "full_resolution": str(full_resolution), "format": self.frame_format})
+        response.raise_for_status()
 
-    def post_action(self, skill, parameters = None, frame_id = None):
-        url = f'{self.base_url}/action'
-        print("POST", url, skill, parameters)
+        return decode_video_frame(response.content, response.headers['Content-Type'], mode)
 
-        json_data = {
-            'skill': skill,
-            'parameters': parameters,
-            'frame_id': frame_id,
-        }
 
-        # Create MultipartEncoder object
-        downloaded_depth_frame_path = os.path.join(config.work_dir, f'{frame_id}_downloaded_depth_frame.npy')
-        if os.path.exists(downloaded_depth_frame_path):
-            m = MultipartEncoder(
-                fields={
-                    'json_data': ('json_data', json.dumps(json_data), 'application/json'),
-                    'depth_frame': ('depth_frame', open(downloaded_depth_frame_path, 'rb'), 'application/octet-stream')
-                }
-            )
-        else:
-            m = MultipartEncoder(
-                fields={
-                    'json_data': ('json_data', json.dumps(json_data), 'application/json'),
-                    'depth_frame': ('depth_frame', None, 'application/octet-stream')
-                }
-            )
+    def open_video_stream(self, fps = None) -> requests.Response:
+        """Open the "video_stream" MJPEG endpoint. The caller reads the response incrementally, see FrameSubscription."""
 
-        response = requests.post(url, data = m, headers={'Content-Type': m.content_type})
+        logger.debug(f"GET {self.base_url}/video_stream")
 
-        # @ TODO Agent: Handle the case when response shows that robot execution fails
-        if response.json()['success']:
-            result = (True, 'Done')
-            logger.info(f"Action execution `{skill}`is successful.")
-        else:
-            logger.info(f"Action execution `{skill}` failed. Reason: {response.json()['error_message']}")
-            result = (False, response.json()['error_message'])
-        return result
+        # Latency is not recorded, the request lasts as long as the stream
+        response = self.session.get(f'{self.base_url}/video_stream', params={'fps': fps}, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+
+        return response
+
+
+    def post_action(self, skill, parameters = None, frame_id = None):
+        logger.debug(f"POST {self.base_url}/action {skill} {parameters}")
+
+        m = encode_action_request(skill, parameters, frame_id)
+        response = self._request('POST', 'action', data = m, headers={'Content-Type': m.content_type})
+
+        return parse_action_response(skill, response.json())
 
 
     def parse_skills(self, code_str):
@@ -119,7 +174,7 @@ class Client:
         try:
             parsed_code = ast.parse(code_str)
         except SyntaxError as e:
-            print(f"Failed to parse the code. Reason: {e} : {code_str}")
+            logger.error(f"Failed to parse the code. Reason: {e} : {code_str}")
             raise e
 
         functions = []
@@ -140,10 +195,9 @@ class Client:
 
     def get_skills(self):
 
-        url = f'{self.base_url}/skills'
-        print("GET", url)
+        logger.debug(f"GET {self.base_url}/skills")
 
-        response = requests.get(url)
+        response = self._request('GET', 'skills')
         skill_lib_raw = response.json()
         skill_lib = []
         for skill in skill_lib_raw:
@@ -166,6 +220,78 @@ class Client:
         return skill_lib
 
 
+class AsyncClient:
+    """asyncio variant of Client, on a pooled httpx.AsyncClient."""
+
+    def __init__(self, ip, port, timeout = None, retries = None, frame_format = None):
+        self.robot_ip = ip
+        self.robot_port = port
+        self.base_url =  f'http://{self.robot_ip}:{self.robot_port}'
+
+        timeout = timeout if timeout is not None else config.robot_client_timeout
+        retries = retries if retries is not None else config.robot_client_retries
+        self.frame_format = frame_format if frame_format is not None else config.robot_frame_format
+
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+            timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+
+        # httpx transport retries only cover connection failures
+        transport = httpx.AsyncHTTPTransport(retries=retries,
+                                             limits=httpx.Limits(max_connections=config.robot_client_pool_size,
+                                                                 max_keepalive_connections=config.robot_client_pool_size))
+        self.client = httpx.AsyncClient(base_url=self.base_url, timeout=timeout, transport=transport)
+
+        self.latency_stats = EndpointLatencyStats()
+
+
+    async def _request(self, method, endpoint, **kwargs) -> httpx.Response:
+
+        start = time.perf_counter()
+        error = True
+        try:
+            response = await self.client.request(method, f'/{endpoint}', **kwargs)
+            error = response.is_error
+            return response
+        finally:
+            self.latency_stats.record(endpoint, time.perf_counter() - start, error)
+
+
+    def get_latency_stats(self) -> Dict[str, Dict[str, float]]:
+        return self.latency_stats.get_stats()
+
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+    async def get_video_frame(self, mode = IMAGE_MODE_RGB, full_resolution=False):
+        logger.debug(f"GET {self.base_url}/video_frame")
+
+        # str() as requests does, httpx would send a bool as 'false'
+        response = await self._request('GET', 'video_frame', params={'mode': mode, "full_resolution": str(full_resolution), "format": self.frame_format})
+        response.raise_for_status()
+
+        return decode_video_frame(response.content, response.headers['Content-Type'], mode)
+
+
+    async def post_action(self, skill, parameters = None, frame_id = None):
+        logger.debug(f"POST {self.base_url}/action {skill} {parameters}")
+
+        m = encode_action_request(skill, parameters, frame_id)
+        response = await self._request('POST', 'action', content=m.to_string(), headers={'Content-Type': m.content_type})
+
+        return parse_action_response(skill, response.json())
+
+
 if __name__ == '__main__':
 
     print('Testing robot client')
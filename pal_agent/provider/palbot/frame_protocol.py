@@ -0,0 +1,128 @@
+"""Wire formats of the robot server "video_frame" API."""
+import base64
+import json
+from typing import Any, Optional, Tuple
+
+import numpy as np
+import cv2
+from requests_toolbelt.multipart.decoder import MultipartDecoder
+from requests_toolbelt import MultipartEncoder
+
+from pal_agent.utils.depth_utils import DepthFrame
+
+IMAGE_MODE_RGB = 'RGB'
+IMAGE_MODE_RGBD = 'RGB-D'
+
+# Legacy format: base64 encoded images inside the JSON part, raw depth frame as a second part
+FRAME_FORMAT_JSON = 'json'
+# Binary format: small JSON header, then the encoded RGB image and the raw depth buffer as separate binary parts
+FRAME_FORMAT_BINARY = 'binary'
+
+
+def colorize_depth(depth: np.ndarray, depth_scale: float = 1.0, max_depth: float = 5.0) -> np.ndarray:
+    """Colored depth image for visualization, from depth in units of depth_scale meters."""
+    depth_meters = depth.astype(np.float32) * depth_scale
+    return cv2.applyColorMap(cv2.convertScaleAbs(depth_meters, alpha=255. / max_depth), cv2.COLORMAP_JET)
+
+
+def encode_binary_video_frame(frame_id: Any,
+                              rgb_image: np.ndarray,
+                              depth: Optional[np.ndarray] = None,
+                              depth_scale: float = 1.0,
+                              image_format: str = '.jpg',
+                              jpeg_quality: int = 90) -> Tuple[bytes, str]:
+    """Build a binary format response body, returning (body, content type)."""
+
+    params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality] if image_format == '.jpg' else []
+    success, rgb_buffer = cv2.imencode(image_format, rgb_image, params)
+    if not success:
+        raise ValueError(f"Failed to encode frame {frame_id} as {image_format}.")
+
+    header = {
+        'format': FRAME_FORMAT_BINARY,
+        'frame_id': frame_id,
+        'rgb_encoding': image_format.lstrip('.'),
+    }
+
+    fields = {}
+
+    if depth is not None:
+        depth = np.ascontiguousarray(depth)
+        header['depth_shape'] = list(depth.shape)
+        header['depth_dtype'] = depth.dtype.str
+        header['depth_scale'] = depth_scale
+
+    fields['header'] = ('header', json.dumps(header), 'application/json')
+    fields['rgb_image'] = ('rgb_image', rgb_buffer.tobytes(), f'image/{header["rgb_encoding"]}')
+    if depth is not None:
+        fields['depth_frame'] = ('depth_frame', depth.tobytes(), 'application/octet-stream')
+
+    encoder = MultipartEncoder(fields=fields)
+    return encoder.to_string(), encoder.content_type
+
+
+def decode_image_buffer(buffer: bytes) -> np.ndarray:
+
+    image_np = np.frombuffer(buffer, np.uint8) # No copy of the received bytes
+    image = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
+    # image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if image is None:
+        image = cv2.imdecode(image_np, cv2.IMREAD_UNCHANGED)
+    return image
+
+
+def decode_binary_video_frame(header: dict, parts, mode: str = IMAGE_MODE_RGB) -> Tuple[Any, np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+
+    frame_id = header['frame_id']
+    rgb_image = decode_image_buffer(parts[1].content)
+
+    if mode == IMAGE_MODE_RGBD and len(parts) > 2:
+        # A read-only view on the received bytes
+        depth_frame = np.frombuffer(parts[2].content, dtype=np.dtype(header['depth_dtype'])).reshape(header['depth_shape'])
+        depth_scale = header.get('depth_scale', 1.0)
+        depth_image = colorize_depth(depth_frame, depth_scale)
+        if depth_frame.dtype == np.uint16:
+            # Raw sensor units, converted to meters only when needed
+            depth_frame = DepthFrame(depth_frame, depth_scale)
+        return frame_id, rgb_image, depth_image, depth_frame
+
+    return frame_id, rgb_image, None, None
+
+
+def decode_video_frame(content: bytes, content_type: str, mode: str = IMAGE_MODE_RGB) -> Tuple[Any, np.ndarray, Optional[np.ndarray], Any]:
+    """
+    Decode a "video_frame" response into frame id, RGB image, colored depth image and depth frame.
+
+    The format is detected from the JSON part, so servers without binary support keep working. The depth frame is
+    the raw multipart part in the JSON format, and a DepthFrame (or a numpy array if not uint16) in the binary format.
+    """
+
+    decoder = MultipartDecoder(content, content_type)
+
+    # Extract the JSON part
+    json_part = decoder.parts[0]
+    json_data = json.loads(json_part.text)
+
+    if json_data.get('format') == FRAME_FORMAT_BINARY:
+        return decode_binary_video_frame(json_data, decoder.parts, mode)
+
+    # Decode RGB image
+    encoded_rgb_image = json_data['encoded_rgb_image']
+    rgb_image = decode_image_buffer(base64.b64decode(encoded_rgb_image))
+
+    # Get frame id
+    frame_id = json_data['frame_id']
+
+    if mode == IMAGE_MODE_RGBD:
+        # Decode depth image
+        encoded_depth_image = json_data['encoded_depth_image']
+        decoded_depth_image = base64.b64decode(encoded_depth_image)
+        depth_image = np.frombuffer(decoded_depth_image, np.uint8) # Convert bytes to numpy array
+        depth_image = cv2.imdecode(depth_image, cv2.IMREAD_COLOR)
+
+        # Extract the depth_frame part
+        depth_frame = decoder.parts[1]
+
+        return frame_id, rgb_image, depth_image, depth_frame
+    else:
+        return frame_id, rgb_image, None, None
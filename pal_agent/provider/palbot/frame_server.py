@@ -0,0 +1,147 @@
+"""
+Local stand-in for the robot server, for testing the client and frame transport without the robot.
+
+Serves frames from a directory of images (a recorded trace), or synthetic frames if none is given, in both
+the JSON and the binary frame formats, and as an MJPEG stream. Actions always succeed.
+
+Usage: python -m pal_agent.provider.palbot.frame_server [trace_dir] [port]
+"""
+import base64
+import io
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+import cv2
+from flask import Flask, Response, jsonify, request
+from requests_toolbelt import MultipartEncoder
+
+from pal_agent.provider.frame.frame_source import TraceFrameSource
+from pal_agent.provider.palbot.frame_protocol import (
+    IMAGE_MODE_RGBD,
+    FRAME_FORMAT_BINARY,
+    colorize_depth,
+    encode_binary_video_frame,
+)
+from pal_agent.provider.palbot.frame_stream import MJPEG_BOUNDARY, encode_mjpeg_part
+from pal_agent.utils.depth_utils import DEPTH_ENCODING_ZLIB, DepthFrame
+
+
+class ServerFrameSource:
+    """Serves the frames of a trace directory in order, one per request, or generates synthetic frames."""
+
+    def __init__(self, trace_dir: str = None, width: int = 640, height: int = 480):
+
+        self.width = width
+        self.height = height
+        self.frame_id = 0
+        self.lock = threading.Lock()
+
+        # Same frame selection and order as the agent's trace replay, stepping one frame per request
+        self.trace = TraceFrameSource(trace_dir, speed=0) if trace_dir is not None else None
+
+
+    def next_frame(self):
+
+        with self.lock:
+            self.frame_id += 1
+            frame_id = self.frame_id
+            if self.trace is not None:
+                rgb_image = self.trace.get_color_frame()
+
+        if self.trace is None:
+            # Moving gradient, so consecutive frames differ
+            x = (np.arange(self.width, dtype=np.uint16) + frame_id * 8) % 256
+            rgb_image = np.repeat(np.tile(x.astype(np.uint8), (self.height, 1))[:, :, None], 3, axis=2)
+
+        # Synthetic depth in millimeters, a plane tilted away from the camera
+        height, width = rgb_image.shape[:2]
+        depth = np.tile(np.linspace(500, 4000, height, dtype=np.float32)[:, None], (1, width)).astype(np.uint16)
+
+        return frame_id, rgb_image, depth
+
+
+def create_app(frame_source: ServerFrameSource) -> Flask:
+
+    app = Flask(__name__)
+
+    @app.route('/video_frame', methods=['GET'])
+    def video_frame():
+
+        mode = request.args.get('mode', 'RGB')
+        frame_format = request.args.get('format', 'json')
+
+        frame_id, rgb_image, depth = frame_source.next_frame()
+        if mode != IMAGE_MODE_RGBD:
+            depth = None
+
+        if frame_format == FRAME_FORMAT_BINARY:
+            body, content_type = encode_binary_video_frame(frame_id, rgb_image, depth, depth_scale=0.001)
+            return Response(body, content_type=content_type)
+
+        json_data = {
+            'frame_id': frame_id,
+            'encoded_rgb_image': base64.b64encode(cv2.imencode('.jpg', rgb_image)[1].tobytes()).decode('utf-8'),
+        }
+
+        fields = {}
+        if depth is not None:
+            json_data['encoded_depth_image'] = base64.b64encode(cv2.imencode('.jpg', colorize_depth(depth, 0.001))[1].tobytes()).decode('utf-8')
+            buffer = io.BytesIO()
+            np.save(buffer, depth)
+
+        fields['json_data'] = ('json_data', json.dumps(json_data), 'application/json')
+        if depth is not None:
+            fields['depth_frame'] = ('depth_frame', buffer.getvalue(), 'application/octet-stream')
+
+        encoder = MultipartEncoder(fields=fields)
+        return Response(encoder.to_string(), content_type=encoder.content_type)
+
+
+    @app.route('/video_stream', methods=['GET'])
+    def video_stream():
+
+        fps = request.args.get('fps', type=float) or 15.
+
+        def generate():
+            while True:
+                start = time.time()
+                frame_id, rgb_image, _ = frame_source.next_frame()
+                yield encode_mjpeg_part(cv2.imencode('.jpg', rgb_image)[1].tobytes(), frame_id, start)
+                time.sleep(max(0., 1. / fps - (time.time() - start)))
+
+        return Response(generate(), mimetype=f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}')
+
+
+    @app.route('/action', methods=['POST'])
+    def action():
+
+        json_file = request.files.get('json_data')
+        json_data = json.loads(json_file.read() if json_file is not None else request.form.get('json_data', '{}'))
+        app.logger.info(f"Action: {json_data}")
+
+        depth_file = request.files.get('depth_frame')
+        if depth_file is not None and json_data.get('depth_encoding') == DEPTH_ENCODING_ZLIB:
+            depth_frame = DepthFrame.decompress(depth_file.read())
+            app.logger.info(f"Depth frame: {depth_frame.shape}, scale {depth_frame.depth_scale}")
+
+        time.sleep(0.05)
+        return jsonify({'success': True, 'error_message': ''})
+
+
+    @app.route('/skills', methods=['GET'])
+    def skills():
+        return jsonify({})
+
+    return app
+
+
+if __name__ == '__main__':
+
+    trace_dir = sys.argv[1] if len(sys.argv) > 1 else None
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 9080
+
+    app = create_app(ServerFrameSource(trace_dir))
+    app.run(host='0.0.0.0', port=port, threaded=True)
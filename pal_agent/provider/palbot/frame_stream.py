@@ -0,0 +1,217 @@
+"""Push-based frame subscription on the robot server "video_stream" MJPEG endpoint."""
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pal_agent.log.logger import Logger
+from pal_agent.provider.palbot.frame_protocol import decode_image_buffer
+
+logger = Logger()
+
+MJPEG_BOUNDARY = 'frame'
+
+
+def encode_mjpeg_part(jpeg: bytes, frame_id, timestamp: float, boundary: str = MJPEG_BOUNDARY) -> bytes:
+    """One part of a multipart/x-mixed-replace MJPEG stream."""
+    headers = (f'--{boundary}\r\n'
+               f'Content-Type: image/jpeg\r\n'
+               f'Content-Length: {len(jpeg)}\r\n'
+               f'X-Frame-Id: {frame_id}\r\n'
+               f'X-Timestamp: {timestamp}\r\n\r\n')
+    return headers.encode('ascii') + jpeg + b'\r\n'
+
+
+class MJPEGParser():
+    """Incremental parser of a multipart/x-mixed-replace stream, fed with arbitrary chunks of bytes."""
+
+    def __init__(self, boundary: str = MJPEG_BOUNDARY):
+        self.boundary = f'--{boundary}'.encode('ascii')
+        self.buffer = bytearray()
+        self.headers = None
+
+
+    def feed(self, chunk: bytes) -> List[Tuple[Dict[str, str], bytes]]:
+
+        self.buffer += chunk
+        parts = []
+
+        while True:
+            if self.headers is None:
+                start = self.buffer.find(self.boundary)
+                if start < 0:
+                    break
+                end = self.buffer.find(b'\r\n\r\n', start)
+                if end < 0:
+                    break
+
+                header_lines = bytes(self.buffer[start + len(self.boundary):end]).decode('ascii', errors='ignore').split('\r\n')
+                headers = {}
+                for line in header_lines:
+                    key, sep, value = line.partition(':')
+                    if sep:
+                        headers[key.strip().lower()] = value.strip()
+
+                del self.buffer[:end + 4]
+                self.headers = headers
+
+            length = int(self.headers.get('content-length', -1))
+            if length < 0:
+                # Without a length, the part ends at the next boundary
+                length = self.buffer.find(self.boundary)
+                if length < 0:
+                    break
+            elif len(self.buffer) < length:
+                break
+
+            parts.append((self.headers, bytes(self.buffer[:length])))
+            del self.buffer[:length]
+            self.headers = None
+
+        return parts
+
+
+class StreamedFrame():
+    """A received frame, kept as JPEG bytes until a consumer actually needs the image."""
+
+    def __init__(self, sequence: int, frame_id, timestamp: float, jpeg: bytes):
+        self.sequence = sequence
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.received_time = time.time()
+        self.jpeg = jpeg
+        self._image = None
+
+
+    @property
+    def image(self) -> np.ndarray:
+        if self._image is None:
+            self._image = decode_image_buffer(self.jpeg)
+        return self._image
+
+
+class FrameSubscription():
+    """
+    Receives the robot camera stream on a background thread into a latest-frame slot.
+
+    The reader never waits for consumers: a frame not taken before the next one arrives is dropped (and never decoded),
+    so a slow consumer always gets the freshest frame and capture follows the camera rate instead of request latency.
+    """
+
+    def __init__(self, client, fps: Optional[float] = None, reconnect_delay: float = 1.0):
+
+        self.client = client
+        self.fps = fps
+        self.reconnect_delay = reconnect_delay
+
+        self.condition = threading.Condition()
+        self.latest: Optional[StreamedFrame] = None
+        self.latest_taken = False
+        self.sequence = 0
+
+        self.received_count = 0
+        self.dropped_count = 0
+        self.taken_count = 0
+
+        self.running = False
+        self.response = None
+        self.thread = None
+
+
+    def start(self) -> None:
+
+        if self.running:
+            return
+
+        self.running = True
+        self.thread = threading.Thread(target=self._receive_frames, name='Frame Stream')
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def stop(self) -> None:
+
+        self.running = False
+
+        response = self.response
+        if response is not None:
+            response.close()
+
+        with self.condition:
+            self.condition.notify_all()
+
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+
+
+    def get_frame(self, after_sequence: int = 0, timeout: Optional[float] = None) -> Optional[StreamedFrame]:
+        """Wait for a frame newer than after_sequence. Returns None on timeout or when stopped."""
+
+        with self.condition:
+            available = self.condition.wait_for(
+                lambda: not self.running or (self.latest is not None and self.latest.sequence > after_sequence),
+                timeout=timeout)
+
+            if not available or self.latest is None or self.latest.sequence <= after_sequence:
+                return None
+
+            if not self.latest_taken:
+                self.latest_taken = True
+                self.taken_count += 1
+
+            return self.latest
+
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.condition:
+            return {
+                "received": self.received_count,
+                "taken": self.taken_count,
+                "dropped": self.dropped_count,
+            }
+
+
+    def _publish(self, headers: Dict[str, str], jpeg: bytes) -> None:
+
+        frame_id = headers.get('x-frame-id')
+        timestamp = float(headers.get('x-timestamp', time.time()))
+
+        with self.condition:
+            if self.latest is not None and not self.latest_taken:
+                self.dropped_count += 1
+
+            self.sequence += 1
+            self.received_count += 1
+            self.latest = StreamedFrame(self.sequence, frame_id, timestamp, jpeg)
+            self.latest_taken = False
+
+            self.condition.notify_all()
+
+
+    def _receive_frames(self) -> None:
+
+        while self.running:
+            try:
+                self.response = self.client.open_video_stream(fps=self.fps)
+                parser = MJPEGParser()
+
+                for chunk in self.response.iter_content(chunk_size=64 * 1024):
+                    if not self.running:
+                        break
+                    for headers, jpeg in parser.feed(chunk):
+                        self._publish(headers, jpeg)
+
+                if self.running:
+                    logger.warning(f"Frame stream ended. Reconnecting in {self.reconnect_delay}s.")
+                    time.sleep(self.reconnect_delay)
+
+            except Exception as e:
+                if self.running:
+                    logger.warning(f"Frame stream interrupted: {e}. Reconnecting in {self.reconnect_delay}s.")
+                    time.sleep(self.reconnect_delay)
+
+            finally:
+                if self.response is not None:
+                    self.response.close()
+                    self.response = None
@@ -1,7 +1,7 @@
 import time
 import cv2
 import os
-from typing import List, Tuple
+from typing import Tuple
 from copy import deepcopy
 
 import numpy as np
@@ -11,9 +11,11 @@ import numpy as np
 from pal_agent.config.config import Config
 from pal_agent.log.logger import Logger
 from pal_agent.utils.image_utils import blurry_detection
+from pal_agent.utils.depth_utils import DepthFrame
 from pal_agent import constants
 from pal_agent.utils.string_utils import dict_to_call_params
 from pal_agent.provider.palbot.client import Client
+from pal_agent.provider.frame.frame_source import TraceFrameSource
 from pal_agent.memory.local_memory import LocalMemory
 # from pal_agent.gameio.game_manager import GameManager
 
@@ -28,27 +30,31 @@ config = Config()
 # io_env = IOEnvironment()
 logger = Logger()
 
-test_using_trace = False
-
-trace_path = f'res/robot/samples/operate_printer_0716'
-
 class PalbotInterface:
 
     def __init__(self):
         self.client = Client(robot_ip, robot_port)
         self.work_dir = config.work_dir
-        self.trace_frame_id = 1
         self.memory = LocalMemory()
 
+        # Replay a recorded trace instead of requesting frames from the robot, one frame per request
+        self.trace_source = None
+        if config.robot_trace_path is not None:
+            self.trace_source = TraceFrameSource(config.robot_trace_path, speed=0, loop=False)
+
 
 class PalbotInterface:
 
     def __init__(self):
         self.client = Client(robot_ip, robot_port)
         self.work_dir = config.work_dir
-        self.trace_frame_id = 1
         self.memory = LocalMemory()
 
+        # Replay a recorded trace instead of requesting frames from the robot, one frame per request
+        self.trace_source = None
+        if config.robot_trace_path is not None:
+            self.trace_source = TraceFrameSource(config.robot_trace_path, speed=0, loop=False)
+
 
     def capture_screen(self, save = True) -> Tuple[str, str]:
         """
@@ -58,10 +64,8 @@ class PalbotInterface:
         logger.info('Request frame from robot camera after action execution.')
 
         # If using predefined trace for testing
-        if test_using_trace is True:
-            image_path = f'{trace_path}/{self.trace_frame_id}.jpg'
-            rgb_image = cv2.imread(image_path)
-            self.trace_frame_id += 1
+        if self.trace_source is not None:
+            rgb_image = self.trace_source.get_color_frame()
 
             # Save the RGB image
             rgb_image_filename = os.path.join(self.work_dir, f'{str(tid)}_rgb.jpg')
@@ -91,8 +95,13 @@ class PalbotInterface:
 
             # Save depth_frame in working directory
             downloaded_depth_frame_path = os.path.join(self.work_dir, f'{frame_id}_downloaded_depth_frame.npy')
-            with open(downloaded_depth_frame_path, 'wb') as f:
-                f.write(depth_frame.content)
+            if isinstance(depth_frame, DepthFrame): # binary frame format
+                depth_frame.save(downloaded_depth_frame_path, config.robot_depth_encoding)
+            elif isinstance(depth_frame, np.ndarray):
+                np.save(downloaded_depth_frame_path, depth_frame)
+            else:
+                with open(downloaded_depth_frame_path, 'wb') as f:
+                    f.write(depth_frame.content)
             print("Save downloaded_depth_frame in working directory.")
 
         # Return the path of RGB image
@@ -112,11 +121,9 @@ class PalbotInterface:
         Request frame from robot camera during action execution.
         """
 
-        tid = time.time()
-
         # Get RGB and Depth image by calling robot API
         target_image_mode = 'RGB'
-        rgb_image, colored_depth_image, frame_id, depth_frame = self.client.get_video_frame(target_image_mode, tid, save = False)
+        frame_id, rgb_image, colored_depth_image, depth_frame = self.client.get_video_frame(target_image_mode)
 
         # Return RGB and depth image
         return rgb_image, colored_depth_image
@@ -0,0 +1,187 @@
+import collections
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from pal_agent.log.logger import Logger
+
+logger = Logger()
+
+DROP_OLDEST = 'drop_oldest' # Discard the oldest queued item to make room, for consumers that only need fresh data
+DROP_NEWEST = 'drop_newest' # Discard the incoming item
+BLOCK = 'block' # Wait for room, for consumers that must see every item
+
+_STOP = object()
+
+
+class ThroughputGauge():
+    """Counts events and reports their rate over the most recent ones."""
+
+    def __init__(self, window: int = 64):
+        self.count = 0
+        self.times = collections.deque(maxlen=window)
+
+
+    def mark(self) -> None:
+        self.count += 1
+        self.times.append(time.time())
+
+
+    def rate(self) -> float:
+        if len(self.times) < 2:
+            return 0.
+        elapsed = self.times[-1] - self.times[0]
+        return (len(self.times) - 1) / elapsed if elapsed > 0 else 0.
+
+
+class PipelineStage():
+    """
+    One worker thread consuming a bounded queue. The output of process is passed to the downstream stages,
+    unless it is None.
+    """
+
+    def __init__(self, name: str, process: Callable[[Any], Any], max_queue_size: int = 8, drop_policy: str = DROP_OLDEST):
+
+        self.name = name
+        self.process = process
+        self.drop_policy = drop_policy
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.downstream: List['PipelineStage'] = []
+
+        self.lock = threading.Lock()
+        self.throughput = ThroughputGauge()
+        self.dropped_count = 0
+        self.error_count = 0
+        self.process_time = 0.
+
+        self.thread = threading.Thread(target=self._run, name=f'Capture {name}')
+        self.thread.daemon = True
+
+
+    def submit(self, item: Any) -> None:
+
+        if self.drop_policy == BLOCK:
+            self.queue.put(item)
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                if self.drop_policy == DROP_NEWEST:
+                    self._count_drop()
+                    return
+
+            try:
+                self.queue.get_nowait()
+                self._count_drop()
+            except queue.Empty:
+                pass
+
+
+    def _count_drop(self) -> None:
+        with self.lock:
+            self.dropped_count += 1
+
+
+    def _run(self) -> None:
+
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+
+            start = time.time()
+            try:
+                output = self.process(item)
+            except Exception as e:
+                logger.error(f'Capture stage {self.name} failed: {e}')
+                with self.lock:
+                    self.error_count += 1
+                continue
+
+            with self.lock:
+                self.process_time += time.time() - start
+                self.throughput.mark()
+
+            if output is not None:
+                for stage in self.downstream:
+                    stage.submit(output)
+
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Process the queued items, then stop. The stop marker is never dropped."""
+        self.queue.put(_STOP)
+        self.thread.join(timeout=timeout)
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            processed = self.throughput.count
+            return {
+                "queue_depth": self.queue.qsize(),
+                "max_queue_size": self.queue.maxsize,
+                "processed": processed,
+                "dropped": self.dropped_count,
+                "errors": self.error_count,
+                "throughput_fps": round(self.throughput.rate(), 2),
+                "avg_process_ms": round(1000 * self.process_time / processed, 2) if processed else 0.,
+            }
+
+
+class CapturePipeline():
+    """
+    Frame processing stages behind the capture thread, so a slow stage delays or drops its own work without
+    stalling frame fetching. Stages are started in order and stopped in order, each draining its queue first.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, PipelineStage] = {}
+        self.entry: Optional[PipelineStage] = None
+        self.fetched = ThroughputGauge()
+        self.running = False
+
+
+    def add_stage(self, name: str, process: Callable[[Any], Any], max_queue_size: int = 8, drop_policy: str = DROP_OLDEST, inputs: List[str] = None) -> PipelineStage:
+        """Add a stage fed by the given stages, or by submit() if inputs is None."""
+
+        stage = PipelineStage(name, process, max_queue_size, drop_policy)
+
+        if inputs is None:
+            self.entry = stage
+        else:
+            for input_name in inputs:
+                self.stages[input_name].downstream.append(stage)
+
+        self.stages[name] = stage
+        return stage
+
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.running = True
+        for stage in self.stages.values():
+            stage.thread.start()
+
+
+    def submit(self, frame: Any) -> None:
+        self.fetched.mark()
+        self.entry.submit(frame)
+
+
+    def stop(self, timeout: Optional[float] = 10.) -> None:
+        if not self.running:
+            return
+        self.running = False
+        for stage in self.stages.values():
+            stage.stop(timeout)
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {"fetch": {"fetched": self.fetched.count, "throughput_fps": round(self.fetched.rate(), 2)}}
+        for name, stage in self.stages.items():
+            stats[name] = stage.get_stats()
+        return stats
@@ -1,10 +1,12 @@
+import collections
+import hashlib
 import os
-from typing import Any, List, Tuple
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
 
 import numpy as np
 import cv2
-import easyocr
 import PIL
 from PIL import Image
 
@@ -16,18 +18,32 @@ from pal_agent.config.config import Config
 from pal_agent.provider.base_provider import BaseProvider
 from pal_agent.utils.encoding_utils import decode_image
 from pal_agent.utils.file_utils import assemble_project_path
+from pal_agent.utils.startup_utils import startup_step
 
 config = Config()
 logger = Logger()
 
 
+def content_digest(image: np.ndarray) -> Tuple:
+    """Exact digest of the image pixels, so two frames with different text never share it."""
+    digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=16).hexdigest()
+    return image.shape, str(image.dtype), digest
+
+
 class VideoOCRExtractorProvider(BaseProvider):
 
     def __init__(self):
         super(VideoOCRExtractorProvider, self).__init__()
 
         self.crop_region = [0, 0, 640, 480]  # Default screen region
-        self.reader = easyocr.Reader(['en', 'ch_sim'])
+        self.languages = ['en', 'ch_sim']
+        self._reader = None # Created on first use, loading the OCR models takes seconds
+
+        # Batch mode: one reader per worker thread, results cached by image content
+        self.worker_readers = threading.local()
+        self.executor = None
+        self.cache = collections.OrderedDict()
+        self.cache_lock = threading.Lock()
 
 
     def to_images(self, data: Any) -> Any:
@@ -54,15 +70,18 @@ class VideoOCRExtractorProvider(BaseProvider):
                 if len(image.shape) == 3 and image.shape[2] == 4:
                     image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
 
-            # crop the image
-            if self.crop_region is not None and config.is_game:
-                x1, y1, x2, y2 = self.crop_region
-                image = image[y1:y2, x1:x2]
-
-            images.append(image)
+            images.append(self.crop_ocr_region(image))
         return images
 
 
+    def crop_ocr_region(self, image: np.ndarray) -> np.ndarray:
+        """The part of the image that is OCR'd."""
+        if self.crop_region is not None and config.is_game:
+            x1, y1, x2, y2 = self.crop_region
+            image = image[y1:y2, x1:x2]
+        return image
+
+
     def extract_text(self, image: Any, return_full: int = 1) -> List[Any]:
         images = self.to_images(image)
         res = []
@@ -74,6 +93,131 @@ class VideoOCRExtractorProvider(BaseProvider):
         return res
 
 
+    def _create_reader(self):
+        with startup_step('easyocr reader'):
+            import easyocr
+            return easyocr.Reader(self.languages)
+
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            self._reader = self._create_reader()
+        return self._reader
+
+
+    def _get_reader(self):
+        if threading.current_thread() is threading.main_thread():
+            return self.reader
+
+        reader = getattr(self.worker_readers, 'reader', None)
+        if reader is None:
+            reader = self._create_reader()
+            self.worker_readers.reader = reader
+        return reader
+
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=config.ocr_max_workers, thread_name_prefix='OCR')
+        return self.executor
+
+
+    @staticmethod
+    def _crop_regions(image: np.ndarray, regions: Optional[List[List[int]]]) -> List[Tuple[Tuple[int, int], np.ndarray]]:
+        if not regions:
+            return [((0, 0), image)]
+        return [((x1, y1), image[y1:y2, x1:x2]) for x1, y1, x2, y2 in regions]
+
+
+    def _read_regions(self, image: np.ndarray, regions, return_full: int) -> List[Any]:
+        reader = self._get_reader()
+        res = []
+        for (x, y), crop in self._crop_regions(image, regions):
+            items = reader.readtext(crop, detail=return_full)
+            if return_full and (x or y):
+                # Bounding boxes back in frame coordinates
+                items = [([[px + x, py + y] for px, py in box], text, prob) for box, text, prob in items]
+            res.extend(items)
+        return res
+
+
+    def _detect_regions(self, image: np.ndarray, regions) -> List[Any]:
+        reader = self._get_reader()
+        res = []
+        for (x, y), crop in self._crop_regions(image, regions):
+            boxes = reader.detect(crop)[0][0] # list of bounding boxes, (x_min, x_max, y_min, y_max)
+            res.extend([[x_min + x, x_max + x, y_min + y, y_max + y] for x_min, x_max, y_min, y_max in boxes])
+        return res
+
+
+    def _run_batch(self, images: List[np.ndarray], task: Callable[[np.ndarray], Any], key: Tuple) -> List[Any]:
+        """
+        Run task on each image with the worker pool. Images with identical content in the batch share one result.
+        Across calls, results are cached by exact image content.
+        """
+
+        cache_keys = {}
+        results: List[Any] = [None] * len(images)
+        pending = {}
+        source = list(range(len(images)))
+
+        first_index = {}
+        for i, image in enumerate(images):
+            digest = content_digest(image)
+            if digest in first_index:
+                source[i] = first_index[digest]
+                continue
+            first_index[digest] = i
+
+            cache_keys[i] = key + digest
+            with self.cache_lock:
+                cached = self.cache.get(cache_keys[i])
+                if cached is not None:
+                    self.cache.move_to_end(cache_keys[i])
+                    results[i] = cached
+                    continue
+
+            pending[i] = self._get_executor().submit(task, images[i])
+
+        for i, future in pending.items():
+            results[i] = future.result()
+            with self.cache_lock:
+                self.cache[cache_keys[i]] = results[i]
+                while len(self.cache) > config.ocr_cache_size:
+                    self.cache.popitem(last=False)
+
+        return [results[source[i]] for i in range(len(images))]
+
+
+    def extract_text_batch(self, image: Any, return_full: int = 1, regions: Optional[List[List[int]]] = None) -> List[Any]:
+        """Batched extract_text, optionally restricted to regions of interest given as [x1, y1, x2, y2]."""
+        images = self.to_images(image)
+        key = ('text', return_full, str(regions))
+        return self._run_batch(images, lambda frame: self._read_regions(frame, regions, return_full), key)
+
+
+    def detect_text_batch(self, image: Any, regions: Optional[List[List[int]]] = None) -> Tuple[List[Any], List[bool]]:
+        images = self.to_images(image)
+        key = ('detect', str(regions))
+        bounding_boxes = self._run_batch(images, lambda frame: self._detect_regions(frame, regions), key)
+
+        has_text_flag = [True if len(item) >0 else False for item in bounding_boxes ]
+        return bounding_boxes, has_text_flag
+
+
+    def extract_text_from_frame_buffer(self, frame_buffer, start_frame_id, end_frame_id = None, return_full: int = 1, regions = None) -> List[Tuple[int, Any]]:
+        """OCR a window of a recorder FrameBuffer, once per stored frame. Returns (frame id, text) per frame id."""
+
+        runs = frame_buffer.get_frame_runs(start_frame_id, end_frame_id)
+        texts = self.extract_text_batch([frame for _, _, frame in runs], return_full=return_full, regions=regions)
+
+        res = []
+        for (run_start, count, _), text in zip(runs, texts):
+            res.extend((run_start + i, text) for i in range(count))
+        return res
+
+
     def extract_text_from_video(self, video_path: str, return_full: int = 1) -> List[Any]:
 
         cap = cv2.VideoCapture(video_path)
@@ -90,12 +234,12 @@ class VideoOCRExtractorProvider(BaseProvider):
         cap.release()
         cv2.destroyAllWindows()
 
-        res = self.extract_text(frames, return_full=return_full)
+        res = self.extract_text_batch(frames, return_full=return_full)
         return res
 
 
     def extract_text_from_frames(self, frames: List, return_full: int = 1) -> List[Any]:
-        res = self.extract_text(frames, return_full=return_full)
+        res = self.extract_text_batch(frames, return_full=return_full)
         return res
 
 
@@ -129,13 +273,13 @@ class VideoOCRExtractorProvider(BaseProvider):
         cap.release()
         cv2.destroyAllWindows()
 
-        bounding_boxes, has_text_flag = self.detect_text(frames)
+        bounding_boxes, has_text_flag = self.detect_text_batch(frames)
 
         return bounding_boxes, has_text_flag
 
 
     def detect_text_from_frames(self, frames: List) -> Tuple[List[Any], List[bool]]:
-        bounding_boxes, has_text_flag = self.detect_text(frames)
+        bounding_boxes, has_text_flag = self.detect_text_batch(frames)
         return bounding_boxes, has_text_flag
 
 
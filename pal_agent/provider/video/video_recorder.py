@@ -1,8 +1,11 @@
+import bisect
+import collections
 import threading
 import os
+import shutil
+import subprocess
 import time
 
-import spacy
 import numpy as np
 import cv2
 import mss
@@ -10,70 +13,245 @@ import mss
 from pal_agent.log.logger import Logger
 from pal_agent.config.config import Config
 from pal_agent.provider.base_provider import BaseProvider
+from pal_agent.utils.image_utils import to_grayscale, count_changed_pixels
+from pal_agent.utils.startup_utils import startup_step
 from pal_agent.provider.video.video_ocr_extractor import VideoOCRExtractorProvider
+from pal_agent.provider.video.capture_pipeline import CapturePipeline, BLOCK, DROP_OLDEST
 from pal_agent.provider.palbot.palbot_interface import PalbotInterface
+from pal_agent.provider.palbot.frame_stream import FrameSubscription
 
 config = Config()
 logger = Logger()
-robot_interface = PalbotInterface()
+_robot_interface = None
+
+
+def get_robot_interface() -> PalbotInterface:
+    """The robot interface used for capture, created on first use rather than at import."""
+    global _robot_interface
+    if _robot_interface is None:
+        _robot_interface = PalbotInterface()
+    return _robot_interface
 
 
 class FrameBuffer():
+    """
+    Fixed-capacity ring buffer of the latest captured frames.
 
-    def __init__(self):
-        self.queue = []
+    Frames are copied into one preallocated numpy block when the first frame arrives. A frame repeated under
+    consecutive ids (config.duplicate_frames) is stored once, as a run of ids, in slot run_index % capacity. Runs are
+    ordered by id, so lookups are a binary search instead of a scan. The capacity is bounded by max_bytes; the oldest
+    runs are overwritten once it is reached.
+    """
+
+    def __init__(self, capacity: int = 10000, max_bytes: int = None):
         self.lock = threading.Lock()
+        self.max_capacity = capacity
+        self.max_bytes = max_bytes
+
+        self.frames = None
+        self.run_starts = None
+        self.run_counts = None
+        self.capacity = 0
+        self.runs_written = 0
+        self.oldest_run = 0
+        self.evicted_count = 0
 
 
-    def add_frame(self, frame_id, frame):
+    def _allocate(self, frame: np.ndarray):
+
+        capacity = self.max_capacity
+        if self.max_bytes is not None:
+            capacity = max(1, min(capacity, self.max_bytes // max(frame.nbytes, 1)))
+
+        self.frames = np.empty((capacity,) + frame.shape, dtype=frame.dtype)
+        self.run_starts = np.zeros(capacity, dtype=np.int64)
+        self.run_counts = np.zeros(capacity, dtype=np.int64)
+        self.capacity = capacity
+        self.runs_written = 0
+        self.oldest_run = 0
+
+
+    def add_frame(self, frame_id, frame, count = 1):
+        """Store a frame under the ids frame_id to frame_id + count - 1. Ids must increase."""
         with self.lock:
-            self.queue.append((frame_id, frame))
+            if self.frames is None:
+                self._allocate(frame)
+            elif frame.shape != self.frames.shape[1:] or frame.dtype != self.frames.dtype:
+                logger.warning(f'Frame shape changed from {self.frames.shape[1:]} to {frame.shape}, resetting the frame buffer')
+                self.evicted_count += self.runs_written - self.oldest_run
+                self._allocate(frame)
+
+            if self.runs_written - self.oldest_run == self.capacity:
+                self.oldest_run += 1
+                self.evicted_count += 1
+
+            slot = self.runs_written % self.capacity
+            self.frames[slot] = frame
+            self.run_starts[slot] = frame_id
+            self.run_counts[slot] = count
+            self.runs_written += 1
+
+
+    def _find_run(self, frame_id):
+        # Index of the last run starting at or before frame_id. Caller holds the lock
+        run_index = bisect.bisect_right(range(self.oldest_run, self.runs_written), frame_id,
+                                        key=lambda index: self.run_starts[index % self.capacity])
+        return self.oldest_run + run_index - 1
+
+
+    def _get_runs(self, start_frame_id, end_frame_id):
+        # Caller holds the lock
+        if self.runs_written == self.oldest_run:
+            return []
+
+        first = max(self._find_run(start_frame_id), self.oldest_run)
+        runs = []
+
+        for run_index in range(first, self.runs_written):
+            slot = run_index % self.capacity
+            run_start = int(self.run_starts[slot])
+            run_end = run_start + int(self.run_counts[slot]) - 1
+
+            if end_frame_id is not None and run_start > end_frame_id:
+                break
+
+            # Clip the run to the requested range
+            run_start = max(run_start, start_frame_id)
+            if end_frame_id is not None:
+                run_end = min(run_end, end_frame_id)
+            if run_end < run_start:
+                continue
+
+            # Copied, so the returned frames are not overwritten by later captures
+            runs.append((run_start, run_end - run_start + 1, self.frames[slot].copy()))
+
+        return runs
 
 
     def get_last_frame(self):
         with self.lock:
-            if len(self.queue) == 0:
+            if self.runs_written == self.oldest_run:
                 return None
             else:
-                return self.queue[-1]
+                slot = (self.runs_written - 1) % self.capacity
+                return int(self.run_starts[slot] + self.run_counts[slot] - 1), self.frames[slot].copy()
 
 
     def get_frame_by_frame_id(self, frame_id):
         with self.lock:
-            for frame in self.queue:
-                if frame[0] == frame_id:
-                    return frame
+            if self.runs_written == self.oldest_run:
+                return None
 
-        return None
+            run_index = self._find_run(frame_id)
+            if run_index < self.oldest_run:
+                return None
 
+            slot = run_index % self.capacity
+            if frame_id >= self.run_starts[slot] + self.run_counts[slot]:
+                return None
 
-    def get_frames_to_latest(self, frame_id, before_frame_nums=5):
-        frames = []
-        with self.lock:
-            for frame in self.queue:
-                if frame[0] >= frame_id - before_frame_nums and frame[0] <= frame_id:
-                    frames.append(frame)
+            return frame_id, self.frames[slot].copy()
 
-        return frames
+
+    def get_frames_to_latest(self, frame_id, before_frame_nums=5):
+        return self.get_frames(frame_id - before_frame_nums, frame_id)
 
 
     def clear(self):
         with self.lock:
-            self.queue.clear()
+            self.oldest_run = self.runs_written
+
+
+    def get_frame_runs(self, start_frame_id, end_frame_id=None):
+        """Stored frames in the id range, as (first frame id, number of ids, frame)."""
+        with self.lock:
+            return self._get_runs(start_frame_id, end_frame_id)
 
 
     def get_frames(self, start_frame_id, end_frame_id=None):
         frames = []
-        with self.lock:
-            for frame in self.queue:
-                if frame[0] >= start_frame_id:
-                    if end_frame_id is not None and frame[0] > end_frame_id:
-                        break
-                    frames.append(frame)
+        for run_start, count, frame in self.get_frame_runs(start_frame_id, end_frame_id):
+            frames.extend((run_start + i, frame) for i in range(count))
 
         return frames
 
 
+    def get_stats(self):
+        with self.lock:
+            runs = self.runs_written - self.oldest_run
+            frame_ids = 0
+            for run_index in range(self.oldest_run, self.runs_written):
+                frame_ids += int(self.run_counts[run_index % self.capacity])
+
+            return {
+                "capacity": self.capacity,
+                "stored_frames": runs,
+                "frame_ids": frame_ids,
+                "bytes": 0 if self.frames is None else self.frames.nbytes,
+                "evicted": self.evicted_count,
+            }
+
+
+class VideoSliceIndex():
+    """Frame id range of each video slice written by the recorder, to reuse slices as clips."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slices = []
+
+
+    def open_slice(self, path, first_frame_id):
+        with self.lock:
+            self.slices.append({
+                'path': path,
+                'first_frame_id': first_frame_id,
+                'last_frame_id': first_frame_id - 1,
+                'frames': 0,
+                'complete': False,
+            })
+
+
+    def add_frame(self, first_frame_id, count):
+        with self.lock:
+            video_slice = self.slices[-1]
+            video_slice['last_frame_id'] = first_frame_id + count - 1
+            video_slice['frames'] += 1
+
+
+    def close_slice(self):
+        with self.lock:
+            if self.slices:
+                self.slices[-1]['complete'] = True
+
+
+    def find_slices(self, start_frame_id, end_frame_id):
+        """
+        Complete slices exactly covering the id range, with one video frame per id, or None. Slices of frames
+        stored under several ids (config.duplicate_frames > 1) never qualify.
+        """
+
+        with self.lock:
+            starts = [video_slice['first_frame_id'] for video_slice in self.slices]
+            position = bisect.bisect_left(starts, start_frame_id)
+            if position == len(starts) or starts[position] != start_frame_id:
+                return None
+
+            covering = []
+            next_frame_id = start_frame_id
+            for video_slice in self.slices[position:]:
+                span = video_slice['last_frame_id'] - video_slice['first_frame_id'] + 1
+                if (not video_slice['complete'] or video_slice['first_frame_id'] != next_frame_id
+                        or video_slice['frames'] != span or video_slice['last_frame_id'] > end_frame_id):
+                    return None
+
+                covering.append(video_slice['path'])
+                next_frame_id = video_slice['last_frame_id'] + 1
+                if video_slice['last_frame_id'] == end_frame_id:
+                    return covering
+
+            return None
+
+
 class VideoRecordProvider(BaseProvider):
 
     def __init__(self,
@@ -86,7 +264,6 @@ class VideoRecordProvider(BaseProvider):
             video_path = os.path.join(config.work_dir, 'video.mp4')
 
         self.fps = config.video_fps
-        self.max_size = 10000
         self.video_path = video_path
         self.frames_per_slice = config.frames_per_slice
         self.frames_count = 0
@@ -97,14 +274,28 @@ class VideoRecordProvider(BaseProvider):
         self.screen_region = [0, 0, 640, 480]
         self.frame_size = (self.screen_region[2], self.screen_region[3])
 
-        self.current_frame_id = -1
+        self.current_frame_id = -1 # Last id assigned by the capture thread
+        self.buffered_frame_id = -1 # Last id written to the frame buffer by the pipeline
+        self.buffered_condition = threading.Condition()
         self.current_frame = None
-        self.frame_buffer = FrameBuffer()
+        self.frame_buffer = FrameBuffer(config.frame_buffer_capacity, config.frame_buffer_max_bytes)
         self.thread_flag = True
 
+        self.frame_subscription = None
+        capture_target = self.capture_screen_from_robot
+        if config.robot_frame_streaming:
+            stream_fps = config.robot_stream_fps or config.video_fps / config.duplicate_frames
+            self.frame_subscription = FrameSubscription(get_robot_interface().client, fps=stream_fps)
+            capture_target = self.capture_screen_from_stream
+
+        self.video_writer = None
+        self.slice_index = VideoSliceIndex()
+        self.clips = collections.OrderedDict()
+        self.clip_lock = threading.Lock()
+        self.capture_pipeline = self._build_capture_pipeline()
+
         self.thread = threading.Thread(
-            target=self.capture_screen_from_robot,
-            args=(self.frame_buffer, ),
+            target=capture_target,
             name='Screen Capture'
         )
         self.thread.daemon = True
@@ -114,12 +305,25 @@ class VideoRecordProvider(BaseProvider):
         self.video_splits_dir = os.path.join(os.path.dirname(self.video_path), 'video_splits')
         os.makedirs(self.video_splits_dir, exist_ok=True)
 
-        self.nlp = spacy.load("en_core_web_lg")
+        self._nlp = None # Loaded on first use, only needed when OCR is enabled
         self.pre_text = None
+        self.pre_text_doc = None
+        self.pre_ocr_region = None # Grayscale OCR region of the last OCR'd frame
+        self.ocr_runs = 0
+        self.ocr_gate_skipped = 0
 
         self.video_ocr_extractor = VideoOCRExtractorProvider()
 
 
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            with startup_step('spacy model'):
+                import spacy
+                self._nlp = spacy.load("en_core_web_lg")
+        return self._nlp
+
+
     def get_frames(self, start_frame_id, end_frame_id = None):
         return self.frame_buffer.get_frames(start_frame_id, end_frame_id)
 
@@ -129,12 +333,80 @@ class VideoRecordProvider(BaseProvider):
 
 
     def get_video(self, start_frame_id, end_frame_id = None):
-        path = os.path.join(self.video_splits_dir, 'video_{:06d}.mp4'.format(start_frame_id))
+        """
+        Clip of the frames in the id range. Ranges made of whole recorded slices reuse the slice files without
+        re-encoding, other ranges are encoded from the frame buffer. Clips are memoized by range once all of its
+        frames are recorded.
+
+        Slices hold one video frame per capture, so they are only reused when config.duplicate_frames is 1; with
+        repeated ids, clips are always encoded from the buffer, which writes each frame once per id.
+        """
+
+        if end_frame_id is None:
+            end_frame_id = self.current_frame_id
+
+        # Frames numbered by the capture thread may still be queued in the pipeline
+        if not self.wait_buffered(end_frame_id):
+            logger.warning(f'Frame {end_frame_id} is not in the frame buffer yet, the clip may be incomplete.')
+
+        key = (start_frame_id, end_frame_id)
+        with self.clip_lock:
+            path = self.clips.get(key)
+            if path is not None and os.path.exists(path):
+                self.clips.move_to_end(key)
+                return path
+
+        path = os.path.join(self.video_splits_dir, 'video_{:06d}_{:06d}.mp4'.format(start_frame_id, end_frame_id))
+
+        slice_paths = self.slice_index.find_slices(start_frame_id, end_frame_id)
+        if slice_paths is None or not self._concat_video_slices(slice_paths, path):
+            path = self._encode_clip(start_frame_id, end_frame_id, path)
+        elif len(slice_paths) == 1:
+            path = slice_paths[0]
+
+        # A range reaching past the recorded frames gives a truncated clip, it must not be served again
+        if end_frame_id <= self.buffered_frame_id:
+            with self.clip_lock:
+                self.clips[key] = path
+                while len(self.clips) > config.video_clip_cache_size:
+                    self.clips.popitem(last=False)
+
+        return path
+
+
+    def _concat_video_slices(self, slice_paths, path):
+
+        if len(slice_paths) == 1:
+            return True
+
+        # Stream copy needs ffmpeg, OpenCV can only re-encode
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            return False
+
+        list_path = path + '.txt'
+        with open(list_path, 'w') as f:
+            for slice_path in slice_paths:
+                f.write("file '{}'\n".format(os.path.abspath(slice_path)))
+
+        result = subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', path],
+                                capture_output=True)
+        os.remove(list_path)
+
+        if result.returncode != 0:
+            logger.warning(f'Failed to concatenate video slices: {result.stderr.decode(errors="ignore")}')
+            return False
+
+        return True
+
+
+    def _encode_clip(self, start_frame_id, end_frame_id, path):
         writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, self.frame_size)
 
-        frames = self.get_frames(start_frame_id, end_frame_id)
-        for frame in frames:
-            writer.write(frame[1])
+        # A frame stored once for several ids is written once per id, to keep the video timing
+        for run_start, count, frame in self.frame_buffer.get_frame_runs(start_frame_id, end_frame_id):
+            for i in range(count):
+                writer.write(frame)
         writer.release()
 
         return path
@@ -158,86 +430,228 @@ class VideoRecordProvider(BaseProvider):
         return self.current_frame_id
 
 
-    def capture_screen_from_robot(self, frame_buffer: FrameBuffer):
-        logger.write('Screen capture started')
-
+    def _open_video_writer(self, first_frame_id):
         video_name = os.path.split(self.video_path)[1].split('.')[0]
         video_slice_path = os.path.join(self.video_path_dir, video_name + '_slice_{:06d}.mp4'.format(self.frames_count // self.frames_per_slice))
-        video_writer = cv2.VideoWriter(video_slice_path,
-                                       cv2.VideoWriter_fourcc(*'mp4v'),
-                                       self.fps,
-                                       self.frame_size)
+        self.slice_index.open_slice(video_slice_path, first_frame_id)
+        return cv2.VideoWriter(video_slice_path,
+                               cv2.VideoWriter_fourcc(*'mp4v'),
+                               self.fps,
+                               self.frame_size)
+
+
+    def _check_ocr_text(self, frame):
+        """
+        Set config.ocr_different_previous_text when the on-screen text changes. Frames whose OCR region has almost
+        no changed pixels since the last OCR'd frame skip OCR and leave the flag as it is; identical text skips the
+        similarity model.
+        """
+
+        # if config.ocr_enabled is false, the ocr is not enabled, so the pre_text should be None
+        if not config.ocr_enabled:
+            self.pre_text = None
+            self.pre_text_doc = None
+            self.pre_ocr_region = None
+            return
+
+        # Pixel level, a perceptual hash barely changes when a few characters do
+        region = to_grayscale(self.video_ocr_extractor.crop_ocr_region(frame))
+        if (self.pre_ocr_region is not None and region.shape == self.pre_ocr_region.shape
+                and count_changed_pixels(region, self.pre_ocr_region, config.ocr_gate_pixel_threshold) <= config.ocr_gate_max_changed_pixels):
+            self.ocr_gate_skipped += 1
+            return
+
+        self.pre_ocr_region = region
+        self.ocr_runs += 1
+
+        cur_text = self.video_ocr_extractor.extract_text(frame, return_full=0)
+        cur_text = cur_text[0]
+        cur_text = " ".join(cur_text)
+
+        if self.pre_text is None:
+            self.pre_text = cur_text
+            return
+
+        if cur_text == self.pre_text:
+            config.ocr_different_previous_text = False
+            return
+
+        if not cur_text or not self.pre_text:
+            config.ocr_different_previous_text = True
+            self.pre_text = cur_text
+            self.pre_text_doc = None
+            return
+
+        # The previous doc is kept, so each changed text is embedded once
+        if self.pre_text_doc is None:
+            self.pre_text_doc = self.nlp(self.pre_text)
+        cur_text_doc = self.nlp(cur_text)
+
+        score = self.pre_text_doc.similarity(cur_text_doc)
+
+        if score < config.ocr_similarity_threshold:
+            config.ocr_different_previous_text = True
+        else:
+            config.ocr_different_previous_text = False
+
+        self.pre_text = cur_text
+        self.pre_text_doc = cur_text_doc
+
+
+    def _submit_frame(self, frame):
+        """Number the frame on the capture thread and queue it, so the ids follow capture even when the pipeline lags."""
+
+        first_frame_id = self.current_frame_id + 1
+        self.current_frame_id += config.duplicate_frames
+        self.capture_pipeline.submit((first_frame_id, config.duplicate_frames, frame))
+
+
+    def wait_buffered(self, frame_id, timeout=1.0):
+        """Wait until the frame id is in the frame buffer. Returns False on timeout."""
+        with self.buffered_condition:
+            return self.buffered_condition.wait_for(lambda: self.buffered_frame_id >= frame_id, timeout)
+
+
+    def _convert_frame(self, item):
+        """Pipeline stage: normalize the frame and publish it to the frame buffer."""
+
+        first_frame_id, count, frame = item
+
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+
+        self.current_frame = frame
+        self.frame_buffer.add_frame(first_frame_id, frame, count=count)
+
+        with self.buffered_condition:
+            self.buffered_frame_id = first_frame_id + count - 1
+            self.buffered_condition.notify_all()
+
+        return first_frame_id, count, frame
+
+
+    def _encode_frame(self, item):
+        """Pipeline stage: write the frame to the current video slice, rotating slices."""
+
+        first_frame_id, count, frame = item
+
+        if self.video_writer is None:
+            self.video_writer = self._open_video_writer(first_frame_id)
+
+        self.video_writer.write(frame)
+        self.slice_index.add_frame(first_frame_id, count)
+        self.frames_count += 1
+
+        if self.frames_count % self.frames_per_slice == 0:
+            # Release the previous video writer, the next frame opens a new one
+            self._release_video_writer()
+
+
+    def _release_video_writer(self):
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+            self.slice_index.close_slice()
+
+
+    def _build_capture_pipeline(self):
+
+        queue_sizes = config.capture_queue_sizes
+
+        pipeline = CapturePipeline()
+        # Frames are numbered at capture, so the buffer and the video must not skip any; only OCR needs just the freshest
+        pipeline.add_stage('convert', self._convert_frame, queue_sizes['convert'], BLOCK)
+        pipeline.add_stage('encode', self._encode_frame, queue_sizes['encode'], BLOCK, inputs=['convert'])
+        if config.ocr_enabled:
+            pipeline.add_stage('ocr', lambda item: self._check_ocr_text(item[2]), queue_sizes['ocr'], DROP_OLDEST, inputs=['convert'])
+
+        return pipeline
+
+
+    def get_capture_stats(self):
+        """Queue depth, throughput and drops of each capture stage."""
+        stats = self.capture_pipeline.get_stats()
+        if 'ocr' in stats:
+            stats['ocr']['ocr_runs'] = self.ocr_runs
+            stats['ocr']['gate_skipped'] = self.ocr_gate_skipped
+        return stats
+
+
+    def _wait_next_capture(self, next_capture_time):
+        # Fixed cadence, independent of the time spent fetching
+        period = config.duplicate_frames / config.video_fps
+        next_capture_time = max(next_capture_time + period, time.time())
+        time.sleep(max(0., next_capture_time - time.time()))
+        return next_capture_time
+
+
+    def capture_screen_from_robot(self):
+        logger.info('Screen capture started')
+
+        self.capture_pipeline.start()
+        next_capture_time = time.time()
 
         while self.thread_flag:
             try:
                 # @NOTE Robot: get frame from robot camera. Call robot api
-                frame, depth_frame = robot_interface.capture_screen_during_action()
-
-                # if config.ocr_enabled is true, start ocr and check whether the text is different from the previous one
-                if config.ocr_enabled:
-                    cur_text = self.video_ocr_extractor.extract_text(frame, return_full=0)
-                    cur_text = cur_text[0]
-                    cur_text = " ".join(cur_text)
-
-                    if self.pre_text is None:
-                        self.pre_text = cur_text
-                    else:
-                        emb1 = self.nlp(self.pre_text)
-                        emb2 = self.nlp(cur_text)
-
-                        score = emb1.similarity(emb2)
-
-                        if score < config.ocr_similarity_threshold:
-                            config.ocr_different_previous_text = True
-                        else:
-                            config.ocr_different_previous_text = False
-                        self.pre_text = cur_text
-
-                # if config.ocr_enabled is false, the ocr is not enabled, so the pre_text should be None
-                if not config.ocr_enabled and self.pre_text is not None:
-                    self.pre_text = None
-
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-                video_writer.write(frame)
-                self.frames_count += 1
-
-                if self.frames_count % self.frames_per_slice == 0:
-                    # Release the previous video writer
-                    video_writer.release()
-
-                    # Create a new video writer
-                    video_slice_path = os.path.join(self.video_path_dir, video_name + '_slice_{:06d}.mp4'.format(self.frames_count // self.frames_per_slice))
-                    video_writer = cv2.VideoWriter(video_slice_path,
-                                                    cv2.VideoWriter_fourcc(*'mp4v'),
-                                                    self.fps,
-                                                    self.frame_size)
-
-                self.current_frame = frame
-                for i in range(config.duplicate_frames):
-                    self.current_frame_id += 1
-                    frame_buffer.add_frame(self.current_frame_id, frame)
-                time.sleep(config.duplicate_frames / config.video_fps - 0.05) # 0.05: time for taking a screenshots
+                frame, depth_frame = get_robot_interface().capture_screen_during_action()
+
+                self._submit_frame(frame)
+                next_capture_time = self._wait_next_capture(next_capture_time)
 
                 # Check the flag at regular intervals
                 if not self.thread_flag:
                     break
 
             except KeyboardInterrupt:
-                logger.write('Screen capture interrupted')
+                logger.info('Screen capture interrupted')
                 self.finish_capture()
 
-        video_writer.release()
+        self._stop_capture_pipeline()
 
 
-    def capture_screen(self, frame_buffer: FrameBuffer):
-        logger.write('Screen capture started')
+    def capture_screen_from_stream(self):
+        """
+        Record frames pushed by the robot server stream at the same cadence as capture_screen_from_robot. Frames
+        arriving between two captures are dropped by the subscription, so each capture takes the freshest one.
+        """
+        logger.info('Screen capture started from the robot frame stream')
 
-        video_name = os.path.split(self.video_path)[1].split('.')[0]
-        video_slice_path = os.path.join(self.video_path_dir, video_name + '_slice_{:06d}.mp4'.format(self.frames_count // self.frames_per_slice))
-        video_writer = cv2.VideoWriter(video_slice_path,
-                                       cv2.VideoWriter_fourcc(*'mp4v'),
-                                       self.fps,
-                                       self.frame_size)
+        self.capture_pipeline.start()
+        self.frame_subscription.start()
+        last_sequence = 0
+        next_capture_time = time.time()
+
+        while self.thread_flag:
+            try:
+                streamed_frame = self.frame_subscription.get_frame(after_sequence=last_sequence, timeout=1.0)
+                if streamed_frame is None:
+                    continue
+                last_sequence = streamed_frame.sequence
+
+                frame = streamed_frame.image
+                if frame is None:
+                    logger.warning(f'Failed to decode streamed frame {streamed_frame.frame_id}')
+                    continue
+
+                self._submit_frame(frame)
+                next_capture_time = self._wait_next_capture(next_capture_time)
+
+            except KeyboardInterrupt:
+                logger.info('Screen capture interrupted')
+                self.finish_capture()
+
+        self.frame_subscription.stop()
+        logger.info(f'Frame stream stats: {self.frame_subscription.get_stats()}')
+
+        self._stop_capture_pipeline()
+
+
+    def capture_screen(self):
+        logger.info('Screen capture started')
+
+        self.capture_pipeline.start()
+        next_capture_time = time.time()
 
         with mss.mss() as sct:
             region = self.screen_region
@@ -253,60 +667,27 @@ class VideoRecordProvider(BaseProvider):
                     frame = sct.grab(region)
                     frame = np.array(frame) # Convert to numpy array
 
-                    # if config.ocr_enabled is true, start ocr and check whether the text is different from the previous one
-                    if config.ocr_enabled:
-                        cur_text = self.video_ocr_extractor.extract_text(frame, return_full=0)
-                        cur_text = cur_text[0]
-                        cur_text = " ".join(cur_text)
-
-                        if self.pre_text is None:
-                            self.pre_text = cur_text
-                        else:
-                            emb1 = self.nlp(self.pre_text)
-                            emb2 = self.nlp(cur_text)
-
-                            score = emb1.similarity(emb2)
-
-                            if score < config.ocr_similarity_threshold:
-                                config.ocr_different_previous_text = True
-                            else:
-                                config.ocr_different_previous_text = False
-                            self.pre_text = cur_text
-
-                    # if config.ocr_enabled is false, the ocr is not enabled, so the pre_text should be None
-                    if not config.ocr_enabled and self.pre_text is not None:
-                        self.pre_text = None
-
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-                    video_writer.write(frame)
-                    self.frames_count += 1
-
-                    if self.frames_count % self.frames_per_slice == 0:
-                        # Release the previous video writer
-                        video_writer.release()
-
-                        # Create a new video writer
-                        video_slice_path = os.path.join(self.video_path_dir, video_name + '_slice_{:06d}.mp4'.format(self.frames_count // self.frames_per_slice))
-                        video_writer = cv2.VideoWriter(video_slice_path,
-                                                       cv2.VideoWriter_fourcc(*'mp4v'),
-                                                       self.fps,
-                                                       self.frame_size)
-
-                    self.current_frame = frame
-                    for i in range(config.duplicate_frames):
-                        self.current_frame_id += 1
-                        frame_buffer.add_frame(self.current_frame_id, frame)
-                    time.sleep(config.duplicate_frames / config.video_fps - 0.05) # 0.05: time for taking a screenshots
+                    self._submit_frame(frame)
+                    next_capture_time = self._wait_next_capture(next_capture_time)
 
                     # Check the flag at regular intervals
                     if not self.thread_flag:
                         break
 
                 except KeyboardInterrupt:
-                    logger.write('Screen capture interrupted')
+                    logger.info('Screen capture interrupted')
                     self.finish_capture()
 
-            video_writer.release()
+        self._stop_capture_pipeline()
+
+
+    def _stop_capture_pipeline(self):
+
+        # Drains the queued frames, so the last video slice is complete
+        self.capture_pipeline.stop()
+        self._release_video_writer()
+
+        logger.info(f'Capture pipeline stats: {self.capture_pipeline.get_stats()}')
 
 
     def start_capture(self):
@@ -315,9 +696,11 @@ class VideoRecordProvider(BaseProvider):
 
     def finish_capture(self):
         if not self.thread.is_alive():
-            logger.write('Screen capture thread is not executing')
+            logger.info('Screen capture thread is not executing')
         else:
             self.thread_flag = False  # Set the flag to False to signal the thread to stop
+            if self.frame_subscription is not None:
+                self.frame_subscription.stop()  # Wake up the capture thread if it waits for a frame
             self.thread.join()  # Now we wait for the thread to finish
-            logger.write('Screen capture finished')
+            logger.info('Screen capture finished')
 
@@ -0,0 +1,123 @@
+import struct
+import zlib
+from typing import Optional, Sequence
+
+import numpy as np
+
+DEPTH_ENCODING_NPY = 'npy'
+DEPTH_ENCODING_ZLIB = 'zlib'
+
+_MAGIC = b'PDZ1'
+_HEADER = struct.Struct('<4sIId') # magic, height, width, depth scale
+
+
+class DepthFrame:
+    """
+    Depth map kept as the raw uint16 sensor buffer plus its scale (meters per unit).
+
+    Conversion to float32 meters happens on first use of meters, or per region with to_meters, instead of on every
+    capture. Numpy functions see the metric array through __array__.
+    """
+
+    def __init__(self, raw: np.ndarray, depth_scale: float = 0.001):
+        self.raw = raw
+        self.depth_scale = depth_scale
+        self._meters = None
+
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+
+    @property
+    def nbytes(self) -> int:
+        return self.raw.nbytes
+
+
+    @property
+    def meters(self) -> np.ndarray:
+        if self._meters is None:
+            self._meters = self.to_meters()
+        return self._meters
+
+
+    def to_meters(self, roi: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Float32 meters of the whole frame, or of the region [x1, y1, x2, y2]."""
+        raw = self.raw
+        if roi is not None:
+            x1, y1, x2, y2 = roi
+            raw = raw[y1:y2, x1:x2]
+        return raw.astype(np.float32) * np.float32(self.depth_scale)
+
+
+    def depth_at(self, x: int, y: int) -> float:
+        return float(self.raw[y, x]) * self.depth_scale
+
+
+    def __array__(self, dtype=None, copy=None):
+        return self.meters if dtype is None else self.meters.astype(dtype)
+
+
+    def compress(self, level: int = 1) -> bytes:
+        """
+        Lossless encoding: horizontal deltas of the raw values, then zlib. Neighbouring depths are close, so the
+        deltas are mostly small and compress far better than the raw buffer, even at the fastest zlib level.
+        """
+
+        raw = np.ascontiguousarray(self.raw, dtype=np.uint16)
+        height, width = raw.shape
+
+        deltas = raw.copy()
+        deltas[:, 1:] -= raw[:, :-1] # Wraps around in uint16, undone by the cumulative sum
+
+        return _HEADER.pack(_MAGIC, height, width, self.depth_scale) + zlib.compress(deltas.tobytes(), level)
+
+
+    @staticmethod
+    def is_compressed(data: bytes) -> bool:
+        return data[:len(_MAGIC)] == _MAGIC
+
+
+    @classmethod
+    def decompress(cls, data: bytes) -> "DepthFrame":
+
+        magic, height, width, depth_scale = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a compressed depth frame.")
+
+        deltas = np.frombuffer(zlib.decompress(data[_HEADER.size:]), dtype=np.uint16).reshape(height, width)
+        raw = np.cumsum(deltas, axis=1, dtype=np.uint16)
+
+        return cls(raw, depth_scale)
+
+
+    @classmethod
+    def from_meters(cls, meters: np.ndarray, depth_scale: float = 0.001) -> "DepthFrame":
+        raw = np.clip(np.round(np.asarray(meters, dtype=np.float32) / depth_scale), 0, np.iinfo(np.uint16).max)
+        return cls(raw.astype(np.uint16), depth_scale)
+
+
+    def save(self, path: str, encoding: str = DEPTH_ENCODING_ZLIB) -> None:
+
+        if encoding == DEPTH_ENCODING_NPY:
+            np.save(path, self.raw)
+            return
+
+        with open(path, 'wb') as f:
+            f.write(self.compress())
+
+
+    @classmethod
+    def load(cls, path: str, depth_scale: float = 0.001) -> "DepthFrame":
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        if cls.is_compressed(data):
+            return cls.decompress(data)
+
+        array = np.load(path)
+        if np.issubdtype(array.dtype, np.floating): # Legacy depth in meters
+            return cls.from_meters(array, depth_scale)
+        return cls(array.astype(np.uint16, copy=False), depth_scale)
@@ -1,6 +1,8 @@
 import base64
 import os
-from typing import Any, List
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
 import io
 
 import numpy as np
@@ -8,8 +10,11 @@ import cv2
 from PIL import Image
 
 from pal_agent.utils.file_utils import assemble_project_path
+from pal_agent.utils.frame_utils import Frame, ImagePayloadPolicy, encode_jpeg
 from pal_agent.log.logger import Logger
+from pal_agent.config.config import Config
 
+config = Config()
 logger = Logger()
 
 def encode_base64(payload):
@@ -47,22 +52,113 @@ def decode_image(base64_encoded_image):
     return decode_base64(base64_encoded_image)
 
 
-def encode_data_to_base64_path(data: Any) -> List[str]:
+class EncodedImageCache():
+    """
+    Bounded LRU cache of base64 data URLs for image files.
+
+    Entries are keyed by path, modification time, size and payload policy, so a file rewritten in place
+    is re-encoded. In-memory frames are only counted in the stats.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def _get_key(self, path: str, policy: Optional[ImagePayloadPolicy] = None) -> Tuple:
+        stat = os.stat(path)
+        return path, stat.st_mtime_ns, stat.st_size, policy.key() if policy is not None else None
+
+
+    def get(self, path: str, policy: Optional[ImagePayloadPolicy] = None) -> Optional[str]:
+        key = self._get_key(path, policy)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        return None
+
+
+    def put(self, path: str, data_url: str, policy: Optional[ImagePayloadPolicy] = None) -> None:
+        key = self._get_key(path, policy)
+        with self.lock:
+            self.entries[key] = data_url
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+    def get_or_encode(self, path: str, policy: Optional[ImagePayloadPolicy] = None) -> str:
+        data_url = self.get(path, policy)
+        if data_url is None:
+            if policy is None:
+                encoded_image = encode_image_path(path)
+                image_type = path.split(".")[-1].lower()
+            else:
+                encoded_image = encode_image_binary(encode_jpeg(cv2.imread(path), policy), path)
+                image_type = "jpeg"
+            data_url = f"data:image/{image_type};base64,{encoded_image}"
+            self.put(path, data_url, policy)
+        return data_url
+
+
+    def get_frame_data_url(self, frame: Frame, policy: Optional[ImagePayloadPolicy] = None) -> str:
+        # Frames keep their own encodings, only the hit and miss counts are recorded here
+        hit = frame.has_data_url(policy)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return frame.get_data_url(policy)
+
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.,
+                "entries": len(self.entries),
+            }
+
+
+encoded_image_cache = EncodedImageCache(max_entries=config.encoded_image_cache_size)
+
+
+def encode_data_to_base64_path(data: Any, policy: Optional[ImagePayloadPolicy] = None) -> List[str]:
+    """
+    Encode images (paths, frames, arrays or PIL images) to base64 data URLs.
+    If a payload policy is given, images are downscaled and re-compressed as JPEG accordingly.
+    """
 
     encoded_images = []
 
-    if isinstance(data, (str, Image.Image, np.ndarray, bytes)):
+    if isinstance(data, (str, Image.Image, np.ndarray, bytes, Frame)):
         data = [data]
 
     for item in data:
 
-        if isinstance(item, str):
+        if isinstance(item, Frame):
+            encoded_images.append(encoded_image_cache.get_frame_data_url(item, policy))
+            continue
+
+        elif isinstance(item, str):
 
             if os.path.exists(assemble_project_path(item)):
                 path = assemble_project_path(item)
-                encoded_image = encode_image_path(path)
-                image_type = path.split(".")[-1].lower()
-                encoded_image = f"data:image/{image_type};base64,{encoded_image}"
+                encoded_image = encoded_image_cache.get_or_encode(path, policy)
                 encoded_images.append(encoded_image)
 
             else:
@@ -74,9 +170,14 @@ def encode_data_to_base64_path(data: Any) -> List[str]:
             image = Image.frombytes('RGB', item.size, item.bgra, 'raw', 'BGRX')
             buffered = io.BytesIO()
             image.save(buffered, format="JPEG")
+        elif isinstance(item, Image.Image) and policy is not None:  # PIL image
+            image = cv2.cvtColor(np.array(item.convert('RGB')), cv2.COLOR_RGB2BGR)
+            buffered = io.BytesIO(encode_jpeg(image, policy))
         elif isinstance(item, Image.Image):  # PIL image
             buffered = io.BytesIO()
             item.save(buffered, format="JPEG")
+        elif isinstance(item, np.ndarray) and policy is not None:  # cv2 image array
+            buffered = io.BytesIO(encode_jpeg(item, policy))
         elif isinstance(item, np.ndarray):  # cv2 image array
             item = cv2.cvtColor(item, cv2.COLOR_BGR2RGB)  # convert to RGB
             image = Image.fromarray(item)
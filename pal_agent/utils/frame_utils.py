@@ -0,0 +1,152 @@
+import base64
+import queue
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import cv2
+
+from pal_agent.log.logger import Logger
+
+logger = Logger()
+
+
+@dataclass(frozen=True)
+class ImagePayloadPolicy:
+    """How an image is shrunk before it is sent to the LLM."""
+
+    max_width: int = 640
+    max_height: int = 480
+    jpeg_quality: int = 95
+    detail: Optional[str] = None # 'low', 'high' or 'auto', passed through to the image_url
+
+
+    @classmethod
+    def from_dict(cls, policy: Dict[str, Any]) -> "ImagePayloadPolicy":
+        return cls(**policy)
+
+
+    def key(self) -> Tuple:
+        return self.max_width, self.max_height, self.jpeg_quality
+
+
+    def degrade(self) -> "ImagePayloadPolicy":
+        """A cheaper policy, used when the per-turn byte budget would be exceeded."""
+        return replace(self,
+                       max_width=max(self.max_width // 2, 64),
+                       max_height=max(self.max_height // 2, 64),
+                       jpeg_quality=max(self.jpeg_quality - 20, 40),
+                       detail='low')
+
+
+def payload_image_size(image: np.ndarray, policy: Optional[ImagePayloadPolicy] = None) -> Tuple[int, int]:
+    """(width, height) of the image once encoded with the policy."""
+
+    height, width = image.shape[:2]
+    if policy is not None:
+        scale = min(policy.max_width / width, policy.max_height / height)
+        if scale < 1:
+            return max(int(width * scale), 1), max(int(height * scale), 1)
+    return width, height
+
+
+def encode_jpeg(image: np.ndarray, policy: Optional[ImagePayloadPolicy] = None) -> bytes:
+    """Encode a cv2 image as JPEG, downscaling it to fit the policy resolution if needed."""
+
+    params = []
+
+    if policy is not None:
+        size = payload_image_size(image, policy)
+        if size != (image.shape[1], image.shape[0]):
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        params = [cv2.IMWRITE_JPEG_QUALITY, policy.jpeg_quality]
+
+    success, buffer = cv2.imencode('.jpg', image, params)
+    if not success:
+        raise ValueError("Failed to encode image as JPEG.")
+
+    return buffer.tobytes()
+
+
+class Frame():
+    """
+    An in-memory camera frame (cv2 BGR array) with lazily encoded JPEGs.
+
+    The full-size JPEG is encoded once and shared by the prompt assembler and the disk writer.
+    Smaller payloads for the LLM are cached per payload policy.
+    """
+
+    def __init__(self, image: np.ndarray, path: Optional[str] = None, timestamp: Optional[float] = None):
+        self.image = image
+        self.path = path
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.saved = threading.Event() # Set when the write finished, successfully or not
+        self.save_error: Optional[Exception] = None
+
+        self._encoded = {}
+        self._data_urls = {}
+        self._lock = threading.Lock()
+
+
+    def get_encoded(self, policy: Optional[ImagePayloadPolicy] = None) -> bytes:
+        key = policy.key() if policy is not None else None
+        with self._lock:
+            if key not in self._encoded:
+                self._encoded[key] = encode_jpeg(self.image, policy)
+            return self._encoded[key]
+
+
+    def has_data_url(self, policy: Optional[ImagePayloadPolicy] = None) -> bool:
+        return (policy.key() if policy is not None else None) in self._data_urls
+
+
+    def get_data_url(self, policy: Optional[ImagePayloadPolicy] = None) -> str:
+        key = policy.key() if policy is not None else None
+        if key not in self._data_urls:
+            self._data_urls[key] = f"data:image/jpeg;base64,{base64.b64encode(self.get_encoded(policy)).decode('utf-8')}"
+        return self._data_urls[key]
+
+
+    def wait_saved(self, timeout: Optional[float] = None) -> bool:
+        return self.saved.wait(timeout)
+
+
+    def __str__(self):
+        return self.path if self.path is not None else f"<Frame {self.timestamp}>"
+
+
+class FrameWriter():
+    """Persists frames to disk on a background thread, off the agent loop's critical path."""
+
+    def __init__(self, max_queue_size: int = 64):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = threading.Thread(target=self._write_frames, name='Frame Writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def save(self, frame: Frame) -> None:
+        if frame.path is None:
+            raise ValueError("Frame has no path to be saved to.")
+        self.queue.put(frame)
+
+
+    def flush(self) -> None:
+        self.queue.join()
+
+
+    def _write_frames(self):
+        while True:
+            frame = self.queue.get()
+            try:
+                with open(frame.path, 'wb') as f:
+                    f.write(frame.get_encoded())
+            except Exception as e:
+                frame.save_error = e
+                logger.error(f"Failed to save frame to {frame.path}: {e}")
+            finally:
+                # Waiters are released on failure too, they check save_error
+                frame.saved.set()
+                self.queue.task_done()
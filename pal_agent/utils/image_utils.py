@@ -7,13 +7,9 @@ import math
 from typing import List, Dict, Tuple
 
 import cv2
-import matplotlib.pyplot as plt
 import mss
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont, ImageChops
-import supervision as sv
-import torch
-from torchvision.ops import box_convert
 
 from pal_agent import constants
 from pal_agent.config.config import Config
@@ -265,6 +261,51 @@ def calculate_pixel_diff(path_1, path_2):
     return calculate_pixel_diff_with_diffimage_path(diff_image_path)
 
 
+def calculate_frame_diff(frame_1: np.ndarray, frame_2: np.ndarray, size: Tuple[int, int] = (64, 48)) -> float:
+    """Mean absolute difference of two cv2 frames, downscaled to grayscale, normalized to [0, 1]."""
+
+    def to_small_gray(frame):
+        if len(frame.shape) == 3 and frame.shape[2] == 4:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY)
+        elif len(frame.shape) == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    diff = cv2.absdiff(to_small_gray(frame_1), to_small_gray(frame_2))
+    return float(np.mean(diff)) / 255.
+
+
+def compute_dhash(frame: np.ndarray, hash_size: int = 8) -> int:
+    """Difference hash of a cv2 frame: signs of horizontal gradients of a tiny grayscale version, as an integer."""
+
+    if len(frame.shape) == 3 and frame.shape[2] == 4:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY)
+    elif len(frame.shape) == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    small = cv2.resize(frame, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(hash_1: int, hash_2: int) -> int:
+    return bin(hash_1 ^ hash_2).count('1')
+
+
+def to_grayscale(frame: np.ndarray) -> np.ndarray:
+    if len(frame.shape) == 3 and frame.shape[2] == 4:
+        return cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY)
+    elif len(frame.shape) == 3:
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return frame
+
+
+def count_changed_pixels(gray_1: np.ndarray, gray_2: np.ndarray, threshold: int = 32) -> int:
+    """Pixels of two grayscale frames differing by more than threshold, at full resolution so small text edits count."""
+    return int(np.count_nonzero(cv2.absdiff(gray_1, gray_2) > threshold))
+
+
 def resize_image(image: Image.Image | str | np.ndarray, resize_ratio: float) -> Image.Image:
     """Resize the given image.
 
@@ -587,6 +628,7 @@ def plot_som(screenshot_filename, bounding_boxes):
 
 
 def plot_som_multicolor(screenshot_filename, bounding_boxes):
+    import matplotlib.pyplot as plt # Imported on first use, slow to load
 
     org_img = Image.open(screenshot_filename)
     font_path = "arial.ttf"
@@ -1540,6 +1582,11 @@ def filter_intersecting_rectangles(rectangles1: List[Tuple[Dict, str]], rectangl
 
 
 def annotate_with_coordinates(image_source, boxes, logits, phrases):
+    # Imported on first use, torch and its ecosystem are slow to load
+    import supervision as sv
+    import torch
+    from torchvision.ops import box_convert
+
     h, w, _ = image_source.shape
     boxes = boxes * torch.Tensor([w, h, w, h])
     xyxy = box_convert(boxes=boxes, in_fmt="cxcywh", out_fmt="xyxy").numpy()
@@ -1561,6 +1608,7 @@ def annotate_with_coordinates(image_source, boxes, logits, phrases):
 
 
 def save_annotate_frame(image_source, boxes, logits, phrases, text_prompt, cur_screenshot_path):
+    import torch # Imported on first use, slow to load
 
     # Remove the main character itself from boxes
     if "person" in text_prompt.lower():
@@ -1,11 +1,10 @@
 import json
 import re
-from typing import Optional, Tuple, Dict
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from collections import OrderedDict
 from collections.abc import Mapping, Iterable
 from datetime import datetime
-
-import torch
+import sys
 
 from pal_agent import constants
 from pal_agent.utils.string_utils import contains_punctuation, is_numbered_bullet_list_item
@@ -20,9 +19,12 @@ def load_json(file_path):
 def serialize_data(item):
     """Recursively convert non-serializable items in the dictionary."""
 
+    # torch is heavy to import, and no tensor can exist unless something else already imported it
+    torch = sys.modules.get('torch')
+
     if isinstance(item, (str, int, float, bool)):
         return item
-    elif isinstance(item, torch.Tensor):
+    elif torch is not None and isinstance(item, torch.Tensor):
         # Check if the tensor is 0-d (a scalar)
         if item.dim() == 0:
             # Convert scalar tensor to a Python number
@@ -194,6 +196,105 @@ def parse_semi_formatted_text(text):
     return result_dict
 
 
+_SECTION_END_KEY = 'semi_formatted_section_end'
+_SECTION_END_LINE = 'Semi formatted section end:'
+
+
+class SemiFormattedTextParser():
+    """
+    Incremental version of parse_semi_formatted_text, for streamed responses.
+
+    Text is fed in chunks. A section is complete when the next key line arrives, and its parsed
+    values are emitted through on_section(key, value) right away. finish() returns the same dict
+    as parse_semi_formatted_text on the whole text.
+    """
+
+    def __init__(self, on_section: Callable[[str, Any], None] = None):
+        self.on_section = on_section
+
+        self.chunks = []
+        self.buffer = ''
+        self.current_key = None
+        self.section_lines = []
+        self.in_code_flag = False
+        self.sections = {}
+
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk of text, returning the (key, value) pairs of the sections it completed."""
+
+        self.chunks.append(chunk)
+        self.buffer += chunk
+
+        *lines, self.buffer = self.buffer.split('\n')
+
+        completed = []
+        for line in lines:
+            completed.extend(self._process_line(line))
+
+        return completed
+
+
+    def finish(self) -> Dict[str, Any]:
+
+        if self.buffer:
+            self._process_line(self.buffer)
+            self.buffer = ''
+
+        self._complete_section(last=True)
+
+        return parse_semi_formatted_text(''.join(self.chunks))
+
+
+    def _process_line(self, line: str) -> List[Tuple[str, Any]]:
+
+        line = line.rstrip()
+        if not line:
+            return []
+
+        # Same key detection as parse_semi_formatted_text
+        clean_line = line.replace("**", "").replace("###", "").replace("##", "")
+        is_key, key_candidate = _is_line_key_candidate(clean_line)
+
+        if is_key and self.in_code_flag == False:
+            completed = self._complete_section()
+            self.current_key = key_candidate.replace(" ", "_").lower()
+            self.section_lines = [line]
+            return completed
+
+        if self.current_key == constants.ACTION_GUIDANCE:
+            self.in_code_flag = clean_line.strip() != '```' and clean_line.strip().lower() != 'null'
+        else:
+            self.in_code_flag = False
+
+        self.section_lines.append(line)
+        return []
+
+
+    def _complete_section(self, last: bool = False) -> List[Tuple[str, Any]]:
+
+        if self.current_key is None:
+            return []
+
+        # Parsing the section on its own applies the same value post-processing, e.g. splitting actions.
+        # A section followed by another key is parsed before a placeholder key, as the last section of the
+        # whole text is parsed differently (e.g. action guidance code blocks).
+        lines = self.section_lines if last else self.section_lines + [_SECTION_END_LINE]
+        section = parse_semi_formatted_text('\n'.join(lines))
+        section.pop(_SECTION_END_KEY, None)
+
+        self.current_key = None
+        self.section_lines = []
+
+        completed = list(section.items())
+        for key, value in completed:
+            self.sections[key] = value
+            if self.on_section is not None:
+                self.on_section(key, value)
+
+        return completed
+
+
 class JsonFrameStructure():
 
     def __init__(self):
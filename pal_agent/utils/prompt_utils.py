@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from pal_agent import constants
+from pal_agent.utils.file_utils import assemble_project_path
+from pal_agent.log.logger import Logger
+
+logger = Logger()
+
+PARAGRAPH_PATTERN = re.compile(r"(.+?)(?=\n\n|$)", re.DOTALL)
+PLACEHOLDER_PATTERN = re.compile(r"<\$[^\$]+\$>")
+
+
+class PromptParagraph():
+    """
+    A paragraph of a prompt template, split around its placeholder.
+
+    As in the original template handling, only the first placeholder of a paragraph is a slot,
+    and all its occurrences in the paragraph are filled with the same value.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+
+        placeholder = re.search(PLACEHOLDER_PATTERN, text)
+        if placeholder is None:
+            self.placeholder_name = None
+            self.segments = [text]
+        else:
+            placeholder = placeholder.group()
+            self.placeholder_name = placeholder.replace("<$", "").replace("$>", "")
+            self.segments = text.split(placeholder)
+
+
+    def is_static(self) -> bool:
+        return self.placeholder_name is None
+
+
+    def fill(self, params: Dict[str, Any], allow_scalars: bool = False) -> Optional[str]:
+        """Return the filled paragraph, or None if the placeholder has no input and the paragraph is dropped."""
+
+        if self.is_static():
+            return self.text
+
+        paragraph_input = params.get(self.placeholder_name, None)
+        if paragraph_input is None or paragraph_input == "" or paragraph_input == []:
+            return None
+
+        if isinstance(paragraph_input, str):
+            value = paragraph_input
+        elif allow_scalars and (isinstance(paragraph_input, bool) or isinstance(paragraph_input, int) or isinstance(paragraph_input, float)):
+            value = str(paragraph_input)
+        elif isinstance(paragraph_input, list):
+            value = json.dumps(paragraph_input)
+        else:
+            raise ValueError(f"Unexpected input type: {type(paragraph_input)}")
+
+        return value.join(self.segments)
+
+
+class CompiledPromptTemplate():
+    """
+    A tripartite prompt template split into paragraphs once, so each turn only fills the placeholder slots.
+
+    <system message>
+
+    <user message part 1 before image introduction>
+    <image introduction>
+    <user message part 2 after image introduction>
+    """
+
+    def __init__(self, template_str: str):
+
+        paragraphs = re.findall(PARAGRAPH_PATTERN, template_str)
+        filtered_paragraphs = [p for p in paragraphs if p.strip() != '']
+
+        self.system_content = filtered_paragraphs[0]  # the system content defaults to the first paragraph of the template
+
+        image_introduction_paragraph_index = None
+        self.image_introduction_paragraph = None
+
+        for i, paragraph in enumerate(filtered_paragraphs):
+            if "<$" + constants.IMAGE_INTRODUCTION + "$>" in paragraph:
+                image_introduction_paragraph_index = i
+                self.image_introduction_paragraph = paragraph
+                break
+
+        if image_introduction_paragraph_index is None:
+            part1_paragraphs = filtered_paragraphs[1:]
+            part2_paragraphs = []
+        else:
+            part1_paragraphs = filtered_paragraphs[1:image_introduction_paragraph_index]
+            part2_paragraphs = filtered_paragraphs[image_introduction_paragraph_index + 1:]
+
+        self.part1_paragraphs = [PromptParagraph(p) for p in part1_paragraphs]
+        self.part2_paragraphs = [PromptParagraph(p) for p in part2_paragraphs]
+
+
+    def fill_part1(self, params: Dict[str, Any]) -> List[str]:
+        contents = [paragraph.fill(params) for paragraph in self.part1_paragraphs]
+        return [content for content in contents if content is not None]
+
+
+    def fill_part2(self, params: Dict[str, Any]) -> List[str]:
+        contents = [paragraph.fill(params, allow_scalars=True) for paragraph in self.part2_paragraphs]
+        return [content for content in contents if content is not None]
+
+
+class PromptTemplateCache():
+    """Compiled prompt templates by path, recompiled when the file on disk changes."""
+
+    def __init__(self):
+        self.templates: Dict[str, Tuple[Tuple[int, int], CompiledPromptTemplate]] = {}
+        self.lock = threading.Lock()
+
+
+    def get(self, path: str) -> CompiledPromptTemplate:
+
+        assert "./res/" in path, 'Path should include ./res/'
+
+        full_path = assemble_project_path(path)
+        stat = os.stat(full_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            entry = self.templates.get(path)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+
+        with open(full_path, "r", encoding="utf-8") as fd:
+            template = CompiledPromptTemplate(fd.read())
+
+        if entry is not None:
+            logger.info(f"Prompt template {path} changed, recompiled.")
+
+        with self.lock:
+            self.templates[path] = (version, template)
+
+        return template
+
+
+    def clear(self) -> None:
+        with self.lock:
+            self.templates.clear()
+
+
+prompt_template_cache = PromptTemplateCache()
+
+
+def load_prompt_template(path: str) -> CompiledPromptTemplate:
+    return prompt_template_cache.get(path)
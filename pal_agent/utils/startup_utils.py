@@ -0,0 +1,40 @@
+import collections
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from pal_agent.log.logger import Logger
+
+logger = Logger()
+
+# Close to interpreter start, this module is imported early by the runners
+_start_time = time.time()
+
+startup_timings: Dict[str, float] = collections.OrderedDict()
+
+
+def record_startup_time(name: str, seconds: float) -> None:
+    startup_timings[name] = startup_timings.get(name, 0.) + seconds
+
+
+@contextmanager
+def startup_step(name: str):
+    """Time a block of initialization code, for the startup report."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_startup_time(name, time.time() - start)
+
+
+def log_startup_report() -> None:
+
+    total = time.time() - _start_time
+    accounted = sum(startup_timings.values())
+
+    lines = [f"Startup took {total:.2f}s"]
+    for name, seconds in startup_timings.items():
+        lines.append(f"  {name}: {seconds:.2f}s")
+    lines.append(f"  imports and other: {max(total - accounted, 0.):.2f}s")
+
+    logger.info("\n".join(lines))
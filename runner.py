@@ -1,24 +1,69 @@
-from copy import deepcopy
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from dotenv import load_dotenv
 
+import numpy as np
+
 load_dotenv()
 
 from pal_agent import constants
 from pal_agent.log.logger import Logger
 from pal_agent.config.config import Config
-from pal_agent.utils.file_utils import read_resource_file
-from pal_agent.utils.json_utils import parse_semi_formatted_text
+from pal_agent.utils.startup_utils import startup_step, log_startup_report
+from pal_agent.utils.prompt_utils import load_prompt_template
+from pal_agent.utils.json_utils import parse_semi_formatted_text, SemiFormattedTextParser
+from pal_agent.utils.image_utils import calculate_frame_diff
+from pal_agent.utils.encoding_utils import encoded_image_cache
+from pal_agent.utils.frame_utils import Frame
 from pal_agent.environment.skill_registry_factory import SkillRegistryFactory
 from pal_agent.provider.llm.llm_factory import LLMFactory
 from pal_agent.provider.palbot.palbot_interface import PalbotInterface
 from pal_agent.gameio.game_manager import GameManager
 from pal_agent.module.executor import Executor
+from pal_agent.module.scheduler import TurnScheduler
 from pal_agent.memory.local_memory import LocalMemory
 from pal_agent.provider.frame.frame_provider import FrameProvider
 
 config = Config()
 logger = Logger()
 
+class SpeculativeGathering:
+
+    def __init__(self):
+        self.frame = None
+        self.future = None
+        self.image_bytes = 0
+        self.discarded = False
+
+
+class TurnLatencyStats:
+    """Per-turn latency of the agent loop, split into the reasoning stages and the action execution."""
+
+    def __init__(self):
+        self.turns = []
+
+
+    def record(self, stages: float, action: float) -> None:
+        self.turns.append({"stages": stages, "action": action, "total": stages + action})
+
+
+    def get_stats(self):
+
+        stats = {"turns": len(self.turns)}
+        for key in ("stages", "action", "total"):
+            values = np.array([turn[key] for turn in self.turns])
+            if len(values) == 0:
+                continue
+            stats[key] = {
+                "mean": round(float(values.mean()), 3),
+                "p50": round(float(np.percentile(values, 50)), 3),
+                "p95": round(float(np.percentile(values, 95)), 3),
+                "max": round(float(values.max()), 3),
+            }
+        return stats
+
+
 class PipelineRunner:
 
     def __init__(self,
@@ -35,6 +80,7 @@ class PipelineRunner:
         self.pipeline_info = {}
 
         self.count = 0
+        self.turn_latency = TurnLatencyStats()
 
         self.set_internal_params()
 
@@ -42,16 +88,18 @@ class PipelineRunner:
 
         self.pipeline_info[constants.TASK_DESCRIPTION] = self.task_description
 
-        lf = LLMFactory()
-        self.llm_provider, self.embedding_provider = lf.create(self.llm_provider_config_path)
+        with startup_step('llm providers'):
+            lf = LLMFactory()
+            self.llm_provider, self.embedding_provider = lf.create(self.llm_provider_config_path)
 
         # Init memory
         self.memory = LocalMemory(memory_path=config.work_dir,
                                   max_recent_steps=config.max_recent_steps)
         # self.memory.load(config.memory_load_path) # !!!
-        srf = SkillRegistryFactory()
-        srf.register_builder(config.env_short_name, config.skill_registry_name)
-        self.skill_registry = srf.create(config.env_short_name, skill_configs=config.skill_configs, embedding_provider=self.embedding_provider)
+        with startup_step('skill registry'):
+            srf = SkillRegistryFactory()
+            srf.register_builder(config.env_short_name, config.skill_registry_name)
+            self.skill_registry = srf.create(config.env_short_name, skill_configs=config.skill_configs, embedding_provider=self.embedding_provider)
         logger.info(f"Skill registry: {self.skill_registry}")
 
         self.gm = GameManager(env_name=config.env_name,
@@ -60,9 +108,10 @@ class PipelineRunner:
                               skill_registry=self.skill_registry,
                              )
 
-        skills = self.gm.retrieve_skills(query_task=self.task_description,
-                                    skill_num=config.skill_configs[constants.SKILL_CONFIG_MAX_COUNT],
-                                    screen_type=constants.GENERAL_GAME_INTERFACE)
+        with startup_step('skill retrieval'):
+            skills = self.gm.retrieve_skills(query_task=self.task_description,
+                                        skill_num=config.skill_configs[constants.SKILL_CONFIG_MAX_COUNT],
+                                        screen_type=constants.GENERAL_GAME_INTERFACE)
 
         self.skill_library = self.gm.get_skill_information(skills, False)
 
@@ -78,12 +127,24 @@ class PipelineRunner:
         # transformed_skill_library = self.skill_registry.transform_skill_library_format(self.skill_library)
 
         # Init frame provider
-        self.frame_provider = FrameProvider()
-        self.last_frame_path = self.current_frame_path = self.frame_provider.get_current_frame_path()
-        self.pipeline_info[constants.IMAGE_PATH] = self.current_frame_path
+        with startup_step('first frame'):
+            self.frame_provider = FrameProvider()
+            self.last_frame = self.current_frame = self.frame_provider.capture_frame()
+        self.pipeline_info[constants.IMAGE_PATH] = self.current_frame
 
         # Init skill execute provider
-        self.skill_execute = Executor(env_manager=self.gm, robot_interface=self.palbot_interface)
+        with startup_step('executor'):
+            self.skill_execute = Executor(env_manager=self.gm, robot_interface=self.palbot_interface)
+
+        self.turn_scheduler = self.build_turn_scheduler()
+
+        # Speculative information gathering during skill execution
+        self.speculative_response = None
+        self.speculative_image_bytes = 0
+        self.speculation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Speculation')
+        self.action_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Action')
+
+        log_startup_report()
 
 
     def run(self):
@@ -94,22 +155,24 @@ class PipelineRunner:
         while not self.success_flag:
             try:
 
-                self.run_information_gathering()
+                turn_start = time.perf_counter()
 
-                self.run_self_reflection()
+                self.llm_provider.reset_image_payload_budget()
+                self.run_turn_stages()
                 if self.success_flag:
                     logger.info("Task completed successfully.")
                     break
 
-                self.run_task_inference()
-
-                self.run_action_planning()
-
+                stages_end = time.perf_counter()
                 self.execute_action()
 
+                self.turn_latency.record(stages_end - turn_start, time.perf_counter() - stages_end)
+                logger.info(f"Turn latency: {self.turn_latency.turns[-1]}")
+
                 self.memory.save()
 
                 self.count += 1
+                logger.info(f"Encoded image cache: {encoded_image_cache.get_stats()}")
                 logger.info(f"---------------- Count Turn: {self.count} ----------------")
 
                 if self.count > constants.MAX_TURN_COUNT:
@@ -124,31 +187,128 @@ class PipelineRunner:
 
 
     def pipeline_shutdown(self):
+        self.speculation_executor.shutdown(wait=False, cancel_futures=True)
+        self.action_executor.shutdown(wait=True)
+        logger.info(f"Turn latency summary: {self.turn_latency.get_stats()}")
+        self.memory.close() # Flush pending memory events
         logger.info(">>> Bye Bye <<<")
 
 
+    def build_turn_scheduler(self):
+
+        scheduler = TurnScheduler()
+
+        # Self reflection reads the image description, target name and target reasoning that information
+        # gathering writes in the same turn, so it waits for it. Each stage depends on the previous one, so the
+        # stages run sequentially; the scheduler only pays off once a stage without these inputs is added.
+        scheduler.add_stage(constants.INFORMATION_GATHERING_STAGE, self.run_information_gathering_async)
+        scheduler.add_stage(constants.SELF_REFLECTION_STAGE, self.run_self_reflection_async,
+                            depends_on=[constants.INFORMATION_GATHERING_STAGE])
+        scheduler.add_stage(constants.TASK_INFERENCE_STAGE, self.run_task_inference_async,
+                            depends_on=[constants.INFORMATION_GATHERING_STAGE, constants.SELF_REFLECTION_STAGE])
+        scheduler.add_stage(constants.ACTION_PLANNING_STAGE, self.run_action_planning_async,
+                            depends_on=[constants.INFORMATION_GATHERING_STAGE, constants.SELF_REFLECTION_STAGE, constants.TASK_INFERENCE_STAGE])
+
+        return scheduler
+
+
+    def run_turn_stages(self):
+
+        if config.concurrent_stages:
+            self.turn_scheduler.run(stop_condition=lambda: self.success_flag)
+        else:
+            self.run_information_gathering()
+
+            self.run_self_reflection()
+            if self.success_flag:
+                return
+
+            self.run_task_inference()
+
+            self.run_action_planning()
+
+
+    def stage_params(self, stage, params = None):
+        """Prompt parameters for a stage, with the stage's image payload policy applied."""
+
+        if params is None:
+            params = self.pipeline_info
+
+        stage_params = dict(params)
+        stage_params[constants.IMAGE_PAYLOAD_POLICY] = config.image_payload_policies.get(stage)
+        return stage_params
+
+
+    def run_stage(self, prepare, process, on_section = None):
+        messages = prepare()
+
+        if on_section is None:
+            response, _ = self.llm_provider.create_completion(messages=messages)
+        else:
+            parser = SemiFormattedTextParser(on_section=on_section)
+            response, _ = self.llm_provider.create_completion_stream(messages=messages, on_delta=parser.feed)
+            parser.finish()
+
+        process(response)
+
+
+    async def run_stage_async(self, prepare, process, on_section = None):
+        messages = prepare()
+
+        if on_section is None:
+            response, _ = await self.llm_provider.create_completion_async(messages=messages)
+        else:
+            parser = SemiFormattedTextParser(on_section=on_section)
+            response, _ = await self.llm_provider.create_completion_stream_async(messages=messages, on_delta=parser.feed)
+            parser.finish()
+
+        process(response)
+
+
     def run_information_gathering(self):
+        if self.commit_speculative_gathering():
+            return
+        self.run_stage(self.prepare_information_gathering, self.process_information_gathering)
+
+
+    async def run_information_gathering_async(self):
+        if self.commit_speculative_gathering():
+            return
+        await self.run_stage_async(self.prepare_information_gathering, self.process_information_gathering)
+
+
+    def prepare_information_gathering(self, frame = None, params = None):
 
         logger.info("Running information gathering...")
 
+        if frame is None:
+            frame = self.current_frame
+
+        if params is None:
+            params = self.pipeline_info
+
         # Information gathering preprocess
         image_introduction = [
             {
             constants.IMAGE_INTRO: "This is the end image from the last action performed.",
-            constants.IMAGE_PATH: self.current_frame_path,
+            constants.IMAGE_PATH: frame,
             constants.ASSISTANT: ""
             }]
 
-        self.pipeline_info[constants.IMAGE_INTRODUCTION] = image_introduction
+        params[constants.IMAGE_INTRODUCTION] = image_introduction
 
-        information_gathering_prompt_template = read_resource_file(constants.INFORMATION_GATHERING_PROMPT_FILE_PATH)
-        information_gathering_prompt = self.llm_provider.assemble_prompt(template_str=information_gathering_prompt_template, params=self.pipeline_info)
+        information_gathering_prompt_template = load_prompt_template(constants.INFORMATION_GATHERING_PROMPT_FILE_PATH)
+        information_gathering_prompt = self.llm_provider.assemble_prompt(template=information_gathering_prompt_template,
+                                                                         params=self.stage_params(constants.INFORMATION_GATHERING_STAGE, params))
 
         logger.info(f"Information Gathering Prompt: {information_gathering_prompt}")
 
-        # Information gathering llm process
+        return information_gathering_prompt
 
-        response, _ = self.llm_provider.create_completion(messages=information_gathering_prompt)
+
+    def process_information_gathering(self, response):
+
+        # Information gathering llm response
         processed_response = parse_semi_formatted_text(response)
         logger.info(f"Information Gathering Response: {processed_response}")
 
@@ -162,30 +322,43 @@ class PipelineRunner:
             logger.debug("Response: ", response, " processed_response:", processed_response)
 
     def run_self_reflection(self):
+        self.run_stage(self.prepare_self_reflection, self.process_self_reflection)
+
+
+    async def run_self_reflection_async(self):
+        await self.run_stage_async(self.prepare_self_reflection, self.process_self_reflection)
+
+
+    def prepare_self_reflection(self):
         logger.info("Running self reflection...")
 
         # Self reflection preprocess
         image_introduction = [
             {
             constants.IMAGE_INTRO: "This is the image before the last action performed.",
-            constants.IMAGE_PATH: self.last_frame_path,
+            constants.IMAGE_PATH: self.last_frame,
             constants.ASSISTANT: ""
             },{
             constants.IMAGE_INTRO: "This is the image after the last action performed.",
-            constants.IMAGE_PATH: self.current_frame_path,
+            constants.IMAGE_PATH: self.current_frame,
             constants.ASSISTANT: ""
             }
         ]
 
         self.pipeline_info[constants.IMAGE_INTRODUCTION] = image_introduction
 
-        self_reflection_prompt_template = read_resource_file(constants.SELF_REFLECTION_PROMPT_FILE_PATH)
-        self_reflection_prompt = self.llm_provider.assemble_prompt(template_str=self_reflection_prompt_template, params=self.pipeline_info)
+        self_reflection_prompt_template = load_prompt_template(constants.SELF_REFLECTION_PROMPT_FILE_PATH)
+        self_reflection_prompt = self.llm_provider.assemble_prompt(template=self_reflection_prompt_template,
+                                                                   params=self.stage_params(constants.SELF_REFLECTION_STAGE))
 
         logger.info(f"Self Reflection Prompt: {self_reflection_prompt}")
 
-        # Self reflection llm process
-        response, _ = self.llm_provider.create_completion(messages=self_reflection_prompt)
+        return self_reflection_prompt
+
+
+    def process_self_reflection(self, response):
+
+        # Self reflection llm response
         processed_response = parse_semi_formatted_text(response)
         logger.info(f"Self Reflection Response: {processed_response}")
 
@@ -204,31 +377,44 @@ class PipelineRunner:
 
 
     def run_task_inference(self):
+        self.run_stage(self.prepare_task_inference, self.process_task_inference)
+
+
+    async def run_task_inference_async(self):
+        await self.run_stage_async(self.prepare_task_inference, self.process_task_inference)
+
+
+    def prepare_task_inference(self):
         logger.info("Running task inference...")
 
         # Task inference preprocess
         image_introduction = [
             {
             constants.IMAGE_INTRO: "This is the image before the last action performed.",
-            constants.IMAGE_PATH: self.last_frame_path,
+            constants.IMAGE_PATH: self.last_frame,
             constants.ASSISTANT: ""
             },
             {
             constants.IMAGE_INTRO: "This is the image after the last action performed.",
-            constants.IMAGE_PATH: self.current_frame_path,
+            constants.IMAGE_PATH: self.current_frame,
             constants.ASSISTANT: ""
             }
         ]
 
         self.pipeline_info[constants.IMAGE_INTRODUCTION] = image_introduction
 
-        self_reflection_prompt_template = read_resource_file(constants.TASK_INFERENCE_PROMPT_FILE_PATH)
-        self_reflection_prompt = self.llm_provider.assemble_prompt(template_str=self_reflection_prompt_template, params=self.pipeline_info)
+        self_reflection_prompt_template = load_prompt_template(constants.TASK_INFERENCE_PROMPT_FILE_PATH)
+        self_reflection_prompt = self.llm_provider.assemble_prompt(template=self_reflection_prompt_template,
+                                                                   params=self.stage_params(constants.TASK_INFERENCE_STAGE))
 
         logger.info(f"Task Inference Prompt: {self_reflection_prompt}")
 
-        # Task inference llm process
-        response, _ = self.llm_provider.create_completion(messages=self_reflection_prompt)
+        return self_reflection_prompt
+
+
+    def process_task_inference(self, response):
+
+        # Task inference llm response
         processed_response = parse_semi_formatted_text(response)
         logger.info(f"Task Inference Response: {processed_response}")
 
@@ -243,30 +429,52 @@ class PipelineRunner:
 
 
     def run_action_planning(self):
+        on_section = self.dispatch_planned_action if config.streaming_completions else None
+        self.run_stage(self.prepare_action_planning, self.process_action_planning, on_section=on_section)
+
+
+    async def run_action_planning_async(self):
+        on_section = self.dispatch_planned_action if config.streaming_completions else None
+        await self.run_stage_async(self.prepare_action_planning, self.process_action_planning, on_section=on_section)
+
+
+    def dispatch_planned_action(self, key, value):
+        """Start the first planned action as soon as the actions section is streamed, before the rest of the response."""
+
+        if key == constants.ACTIONS and value and value[0]:
+            self.skill_execute.dispatch_action(value[0])
+
+
+    def prepare_action_planning(self):
         logger.info("Running action planning...")
 
         # Action planning preprocess
         image_introduction = [
             {
             constants.IMAGE_INTRO: "This is the image before the last action performed.",
-            constants.IMAGE_PATH: self.last_frame_path,
+            constants.IMAGE_PATH: self.last_frame,
             constants.ASSISTANT: ""
             },
             {
             constants.IMAGE_INTRO: "This is the image after the last action performed.",
-            constants.IMAGE_PATH: self.current_frame_path,
+            constants.IMAGE_PATH: self.current_frame,
             constants.ASSISTANT: ""
             }
         ]
         self.pipeline_info[constants.IMAGE_INTRODUCTION] = image_introduction
 
-        action_planning_prompt_template = read_resource_file(constants.ACTION_PLANNING_PROMPT_FILE_PATH)
-        action_planning_prompt = self.llm_provider.assemble_prompt(template_str=action_planning_prompt_template, params=self.pipeline_info)
+        action_planning_prompt_template = load_prompt_template(constants.ACTION_PLANNING_PROMPT_FILE_PATH)
+        action_planning_prompt = self.llm_provider.assemble_prompt(template=action_planning_prompt_template,
+                                                                   params=self.stage_params(constants.ACTION_PLANNING_STAGE))
 
         logger.info(f"Action Planning Prompt: {action_planning_prompt}")
 
-        # Action planning llm process
-        response, _ = self.llm_provider.create_completion(messages=action_planning_prompt)
+        return action_planning_prompt
+
+
+    def process_action_planning(self, response):
+
+        # Action planning llm response
         processed_response = parse_semi_formatted_text(response)
         logger.info(f"Action Planning Response: {processed_response}")
 
@@ -284,10 +492,107 @@ class PipelineRunner:
             logger.warning("No valid response from action planning.")
             logger.debug("Response: ", response, " processed_response:", processed_response)
 
+        if not processed_response or not processed_response.get(constants.ACTIONS):
+            self.skill_execute.discard_dispatched_action()
+
+
+    def start_speculative_gathering(self, action_future):
+        """
+        Run the next turn's information gathering on a frame captured while the action is still executing.
+        The result is only used if the scene did not change by the time the action finishes.
+        """
+
+        # The frame is read here, on the main thread, which owns the frame source, as for capture_frame
+        try:
+            action_future.result(timeout=config.speculation_delay)
+            return None # Finished early, the turn's own capture comes right away
+        except TimeoutError:
+            pass
+
+        # Same camera as capture_frame, so the frame can be compared with the one taken after the action
+        image = self.frame_provider.frame_source.get_color_frame()
+        if image is None:
+            logger.info("No frame from the frame source, skipping speculative information gathering.")
+            return None
+
+        speculation = SpeculativeGathering()
+        speculation.frame = image.copy()
+        frame = Frame(speculation.frame, path=os.path.join(self.frame_provider.frame_path_dir, f'speculative_frame_{self.count}.jpg'))
+        self.frame_provider.frame_writer.save(frame)
+
+        # Snapshot the inputs now, the main thread keeps updating pipeline_info after the action.
+        # The images belong to the next turn, they are charged to its budget when the result is committed.
+        params = dict(self.pipeline_info)
+        params[constants.IMAGE_PAYLOAD_CHARGED] = False
+
+        def speculate():
+            messages = self.prepare_information_gathering(frame=frame, params=params)
+            speculation.image_bytes = self.llm_provider.get_image_payload_bytes(messages)
+            if speculation.discarded:
+                return None
+
+            response, _ = self.llm_provider.create_completion(messages=messages)
+            return response
+
+        speculation.future = self.speculation_executor.submit(speculate)
+        return speculation
+
+
+    def discard_speculative_gathering(self, speculation, reason):
+        speculation.discarded = True
+        if not speculation.future.cancel():
+            # A running completion cannot be interrupted, leave it to finish on its own worker so it does not
+            # delay the next speculation; its result is ignored
+            self.speculation_executor.shutdown(wait=False)
+            self.speculation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Speculation')
+        logger.info(f"Speculative information gathering discarded, {reason}.")
+
+
+    def resolve_speculative_gathering(self, speculation):
+        """Keep the speculative result if the frame it saw matches the turn's frame from capture_frame."""
+
+        self.speculative_response = None
+        self.speculative_image_bytes = 0
+
+        frame_diff = calculate_frame_diff(speculation.frame, self.current_frame.image)
+        if frame_diff > config.speculation_diff_threshold:
+            self.discard_speculative_gathering(speculation, f"frame diff {frame_diff:.4f} > {config.speculation_diff_threshold}")
+            return
+
+        try:
+            self.speculative_response = speculation.future.result()
+            self.speculative_image_bytes = speculation.image_bytes
+            logger.info(f"Speculative information gathering committed, frame diff {frame_diff:.4f}.")
+        except Exception as e:
+            logger.warning(f"Speculative information gathering failed: {e}")
+
+
+    def commit_speculative_gathering(self):
+
+        if self.speculative_response is None:
+            return False
+
+        response = self.speculative_response
+        self.speculative_response = None
+
+        # Called in the new turn, after its budget was reset
+        self.llm_provider.charge_image_payload(self.speculative_image_bytes)
+
+        logger.info("Using speculative information gathering result.")
+        self.process_information_gathering(response)
+        return True
+
 
     def execute_action(self):
 
-        response = self.skill_execute()
+        speculation = None
+        if config.speculative_gathering:
+            # The action runs on a worker meanwhile, so the main thread can take the speculative frame
+            action_future = self.action_executor.submit(self.skill_execute)
+            speculation = self.start_speculative_gathering(action_future)
+            response = action_future.result()
+        else:
+            response = self.skill_execute()
 
         self.pipeline_info[constants.PRE_ACTION] = self.pipeline_info[constants.PREVIOUS_ACTION]         = self.memory.get_recent_history(constants.ACTION)
 
@@ -299,8 +604,11 @@ class PipelineRunner:
         self.pipeline_info[constants.EXECUTING_ACTION_ERROR] = excuting_action_error
         self.pipeline_info[constants.KEY_REASON_OF_LAST_ACTION] = self.memory.get_recent_history(constants.KEY_REASON_OF_LAST_ACTION)
 
-        self.last_frame_path = self.current_frame_path
-        self.current_frame_path = self.frame_provider.get_current_frame_path()
+        self.last_frame = self.current_frame
+        self.current_frame = self.frame_provider.capture_frame()
+
+        if speculation is not None:
+            self.resolve_speculative_gathering(speculation)
 
 
 if __name__ == "__main__":
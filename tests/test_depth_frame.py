@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from pal_agent.utils.depth_utils import DepthFrame, DEPTH_ENCODING_NPY, DEPTH_ENCODING_ZLIB
+
+
+def make_depth(height=48, width=64):
+    rng = np.random.default_rng(0)
+    ramp = np.linspace(500, 3000, width, dtype=np.float64)[None, :].repeat(height, axis=0)
+    raw = ramp + rng.integers(-20, 20, (height, width))
+    raw[5:10, 5:10] = 0 # Holes
+    raw[0, 0] = 65535
+    return raw.astype(np.uint16)
+
+
+def test_compress_round_trip_is_lossless():
+    depth = DepthFrame(make_depth(), depth_scale=0.00025)
+
+    data = depth.compress()
+    restored = DepthFrame.decompress(data)
+
+    assert DepthFrame.is_compressed(data)
+    assert np.array_equal(restored.raw, depth.raw)
+    assert restored.depth_scale == depth.depth_scale
+    assert len(data) < depth.nbytes
+
+
+def test_decompress_rejects_other_data():
+    with pytest.raises(Exception):
+        DepthFrame.decompress(b'not depth data at all, long enough for the header')
+    assert not DepthFrame.is_compressed(b'\x93NUMPY')
+
+
+def test_meters():
+    depth = DepthFrame(np.array([[1000, 2000], [0, 500]], dtype=np.uint16), depth_scale=0.001)
+
+    assert depth.meters.dtype == np.float32
+    assert np.allclose(depth.meters, [[1., 2.], [0., .5]])
+    assert np.allclose(depth.to_meters([1, 0, 2, 2]), [[2.], [.5]])
+    assert depth.depth_at(1, 0) == pytest.approx(2.)
+    assert np.allclose(np.asarray(depth), depth.meters)
+
+
+def test_from_meters():
+    depth = DepthFrame.from_meters(np.array([[1.0004, -1.], [100., 0.5]], dtype=np.float32), depth_scale=0.001)
+
+    assert depth.raw.tolist() == [[1000, 0], [65535, 500]]
+
+
+@pytest.mark.parametrize("encoding", [DEPTH_ENCODING_ZLIB, DEPTH_ENCODING_NPY])
+def test_save_and_load(tmp_path, encoding):
+    depth = DepthFrame(make_depth(), depth_scale=0.001)
+    path = str(tmp_path / 'depth.npy')
+
+    depth.save(path, encoding)
+    loaded = DepthFrame.load(path)
+
+    assert np.array_equal(loaded.raw, depth.raw)
+
+
+def test_load_legacy_meters(tmp_path):
+    path = str(tmp_path / 'depth.npy')
+    np.save(path, np.array([[1., 2.5]], dtype=np.float32))
+
+    assert DepthFrame.load(path, depth_scale=0.001).raw.tolist() == [[1000, 2500]]
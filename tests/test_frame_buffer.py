@@ -0,0 +1,76 @@
+import numpy as np
+
+from pal_agent.provider.video.video_recorder import FrameBuffer
+
+
+def make_frame(value):
+    return np.full((4, 6, 3), value, dtype=np.uint8)
+
+
+def test_lookup_inside_runs():
+    buffer = FrameBuffer(capacity=8)
+    buffer.add_frame(0, make_frame(1), count=3)
+    buffer.add_frame(3, make_frame(2), count=2)
+
+    for frame_id, value in [(0, 1), (2, 1), (3, 2), (4, 2)]:
+        found_id, frame = buffer.get_frame_by_frame_id(frame_id)
+        assert found_id == frame_id
+        assert frame[0, 0, 0] == value
+
+    assert buffer.get_frame_by_frame_id(5) is None
+    assert buffer.get_frame_by_frame_id(-1) is None
+
+
+def test_frame_runs_are_clipped_to_the_range():
+    buffer = FrameBuffer(capacity=8)
+    buffer.add_frame(0, make_frame(1), count=3)
+    buffer.add_frame(3, make_frame(2), count=3)
+
+    runs = buffer.get_frame_runs(1, 4)
+    assert [(start, count) for start, count, _ in runs] == [(1, 2), (3, 2)]
+
+    frames = buffer.get_frames(1, 4)
+    assert [frame_id for frame_id, _ in frames] == [1, 2, 3, 4]
+
+
+def test_eviction_drops_the_oldest_runs():
+    buffer = FrameBuffer(capacity=3)
+    for run in range(5):
+        buffer.add_frame(run * 2, make_frame(run), count=2)
+
+    stats = buffer.get_stats()
+    assert stats["stored_frames"] == 3
+    assert stats["frame_ids"] == 6
+    assert stats["evicted"] == 2
+
+    assert buffer.get_frame_by_frame_id(3) is None
+    assert buffer.get_frame_by_frame_id(4)[1][0, 0, 0] == 2
+    assert buffer.get_last_frame()[0] == 9
+    assert [start for start, _, _ in buffer.get_frame_runs(0)] == [4, 6, 8]
+
+
+def test_capacity_is_bounded_by_bytes():
+    frame = make_frame(0)
+    buffer = FrameBuffer(capacity=100, max_bytes=frame.nbytes * 4)
+    buffer.add_frame(0, frame)
+
+    assert buffer.get_stats()["capacity"] == 4
+
+
+def test_returned_frames_are_copies():
+    buffer = FrameBuffer(capacity=2)
+    buffer.add_frame(0, make_frame(1))
+
+    _, frame = buffer.get_frame_by_frame_id(0)
+    frame[:] = 0
+
+    assert buffer.get_frame_by_frame_id(0)[1][0, 0, 0] == 1
+
+
+def test_clear():
+    buffer = FrameBuffer(capacity=4)
+    buffer.add_frame(0, make_frame(1))
+    buffer.clear()
+
+    assert buffer.get_last_frame() is None
+    assert buffer.get_frames(0) == []
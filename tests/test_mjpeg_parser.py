@@ -0,0 +1,59 @@
+from pal_agent.provider.palbot.frame_stream import MJPEGParser, encode_mjpeg_part
+
+
+JPEGS = [b'\xff\xd8first\xff\xd9', b'\xff\xd8second frame\r\n--not a boundary\xff\xd9', b'\xff\xd8third\xff\xd9']
+
+
+def make_stream():
+    return b''.join(encode_mjpeg_part(jpeg, frame_id, 100. + frame_id) for frame_id, jpeg in enumerate(JPEGS))
+
+
+def feed_in_chunks(parser, data, chunk_size):
+    parts = []
+    for i in range(0, len(data), chunk_size):
+        parts.extend(parser.feed(data[i:i + chunk_size]))
+    return parts
+
+
+def test_whole_stream():
+    parts = MJPEGParser().feed(make_stream())
+
+    assert [body for _, body in parts] == JPEGS
+    assert [headers["x-frame-id"] for headers, _ in parts] == ["0", "1", "2"]
+    assert parts[0][0]["content-type"] == "image/jpeg"
+
+
+def test_every_chunk_boundary():
+    stream = make_stream()
+
+    for chunk_size in range(1, 40):
+        parts = feed_in_chunks(MJPEGParser(), stream, chunk_size)
+        assert [body for _, body in parts] == JPEGS, chunk_size
+
+
+def test_split_inside_headers():
+    stream = make_stream()
+    split = stream.index(b'Content-Length') + 5
+
+    parser = MJPEGParser()
+    assert parser.feed(stream[:split]) == []
+    parts = parser.feed(stream[split:])
+
+    assert [body for _, body in parts] == JPEGS
+
+
+def test_incomplete_body_waits_for_more_data():
+    part = encode_mjpeg_part(JPEGS[0], 0, 0.)
+    parser = MJPEGParser()
+
+    assert parser.feed(part[:-len(JPEGS[0])]) == []
+    assert [body for _, body in parser.feed(part[-len(JPEGS[0]):])] == [JPEGS[0]]
+
+
+def test_part_without_length_ends_at_next_boundary():
+    stream = (b'--frame\r\nContent-Type: image/jpeg\r\n\r\nabc'
+              b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: 3\r\n\r\ndef')
+
+    parts = MJPEGParser().feed(stream)
+
+    assert [body for _, body in parts] == [b'abc', b'def']
@@ -0,0 +1,45 @@
+import pytest
+
+from pal_agent.utils.json_utils import SemiFormattedTextParser, parse_semi_formatted_text
+
+
+RESPONSES = [
+    "Reasoning:\nThe cup is on the left.\nIt is close.\n\nActions:\n```python\nturn_left()\nmove_forward(distance=0.5) # approach\n```\n",
+    "**Decision Making Reasoning:**\nGo to the door.\n\n**Actions:**\nmove_forward()\n\n**Key reason of last action:**\nThe door is ahead.",
+    "## Success:\nTrue\n\n## Self reflection reasoning:\nThe task is done.",
+    "Action guidance:\n```\nmove_forward()\n```\nnull\n\nSummary:\nDone.",
+    "1. Target name:\ncup\n2. Reasoning for target:\nIt is red.",
+]
+
+
+def feed_in_chunks(parser, text, chunk_size):
+    for i in range(0, len(text), chunk_size):
+        parser.feed(text[i:i + chunk_size])
+    return parser.finish()
+
+
+@pytest.mark.parametrize("text", RESPONSES)
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1000])
+def test_streamed_result_matches_whole_text(text, chunk_size):
+    assert feed_in_chunks(SemiFormattedTextParser(), text, chunk_size) == parse_semi_formatted_text(text)
+
+
+@pytest.mark.parametrize("text", RESPONSES)
+def test_sections_match_whole_text(text):
+    sections = {}
+    parser = SemiFormattedTextParser(on_section=lambda key, value: sections.__setitem__(key, value))
+    expected = feed_in_chunks(parser, text, 5)
+
+    for key, value in sections.items():
+        assert expected[key] == value
+
+
+def test_section_is_emitted_when_the_next_key_arrives():
+    emitted = []
+    parser = SemiFormattedTextParser(on_section=lambda key, value: emitted.append((key, value)))
+
+    parser.feed("Actions:\nturn_left()\nmove_forward()\n")
+    assert emitted == []
+
+    parser.feed("Reasoning:\n")
+    assert emitted == [("actions", ["turn_left()", "move_forward()"])]
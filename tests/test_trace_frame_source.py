@@ -0,0 +1,98 @@
+import numpy as np
+import cv2
+import pytest
+
+from pal_agent.provider.frame.frame_source import TraceFrameSource
+from pal_agent.utils.depth_utils import DepthFrame
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.time = 0.
+
+    def __call__(self):
+        return self.time
+
+
+@pytest.fixture
+def trace_dir(tmp_path):
+    # Frames 1, 2 and 10, to check the numeric order, with the gray level as the frame id
+    for frame_id in [1, 2, 10]:
+        cv2.imwrite(str(tmp_path / f'{frame_id}.png'), np.full((8, 8, 3), frame_id, dtype=np.uint8))
+
+    DepthFrame(np.full((8, 8), 1500, dtype=np.uint16)).save(str(tmp_path / '2_depth.npy'))
+    # Not frames of the trace
+    cv2.imwrite(str(tmp_path / '1_depth.jpg'), np.zeros((8, 8, 3), dtype=np.uint8))
+    (tmp_path / 'notes.txt').write_text('trace notes')
+
+    return str(tmp_path)
+
+
+def frame_id_of(frame):
+    return int(frame[0, 0, 0])
+
+
+def test_step_mode_advances_one_frame_per_request(trace_dir):
+    source = TraceFrameSource(trace_dir, speed=0, loop=False)
+
+    assert [frame_id_of(source.get_color_frame()) for _ in range(5)] == [1, 2, 10, 10, 10]
+
+
+def test_step_mode_loops(trace_dir):
+    source = TraceFrameSource(trace_dir, speed=0, loop=True)
+
+    assert [frame_id_of(source.get_color_frame()) for _ in range(4)] == [1, 2, 10, 1]
+
+
+def test_timed_replay_follows_the_clock(trace_dir):
+    clock = FakeClock()
+    source = TraceFrameSource(trace_dir, fps=10, speed=2, loop=True, clock=clock)
+
+    frame_ids = []
+    for elapsed in [0., 0.04, 0.05, 0.1, 0.15]:
+        clock.time = elapsed
+        frame_ids.append(frame_id_of(source.get_color_frame()))
+
+    # 20 frames per second of clock time
+    assert frame_ids == [1, 1, 2, 10, 1]
+
+
+def test_runs_are_reproducible(trace_dir):
+    runs = []
+    for _ in range(2):
+        source = TraceFrameSource(trace_dir, speed=0)
+        runs.append([frame_id_of(source.get_color_frame()) for _ in range(7)])
+
+    assert runs[0] == runs[1]
+
+
+def test_depth_of_the_last_frame(trace_dir):
+    source = TraceFrameSource(trace_dir, speed=0)
+
+    source.get_color_frame()
+    assert source.get_depth_frame() is None
+
+    source.get_color_frame()
+    assert source.get_depth_frame().depth_at(0, 0) == pytest.approx(1.5)
+
+
+def test_returned_frames_are_copies(trace_dir):
+    source = TraceFrameSource(trace_dir, fps=10, speed=1, clock=FakeClock())
+
+    source.get_color_frame()[:] = 0
+
+    assert frame_id_of(source.get_color_frame()) == 1
+
+
+def test_unreadable_frame_raises(tmp_path):
+    (tmp_path / '1.jpg').write_bytes(b'not an image')
+    source = TraceFrameSource(str(tmp_path), speed=0)
+
+    with pytest.raises(IOError):
+        source.get_color_frame()
+
+
+def test_empty_trace_raises(tmp_path):
+    with pytest.raises(ValueError):
+        TraceFrameSource(str(tmp_path))
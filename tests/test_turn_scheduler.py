@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from pal_agent.module.scheduler import TurnScheduler
+
+
+def make_stage(log, name, delay=0.):
+    async def stage():
+        log.append(('start', name))
+        await asyncio.sleep(delay)
+        log.append(('end', name))
+        return name
+    return stage
+
+
+def test_dependencies_finish_before_dependents():
+    log = []
+    scheduler = TurnScheduler()
+    scheduler.add_stage('plan', make_stage(log, 'plan'), depends_on=['gather', 'reflect'])
+    scheduler.add_stage('gather', make_stage(log, 'gather', 0.02))
+    scheduler.add_stage('reflect', make_stage(log, 'reflect', 0.01), depends_on=['gather'])
+
+    results = scheduler.run()
+
+    assert results == {'gather': 'gather', 'reflect': 'reflect', 'plan': 'plan'}
+    assert log.index(('end', 'gather')) < log.index(('start', 'reflect'))
+    assert log.index(('end', 'reflect')) < log.index(('start', 'plan'))
+
+
+def test_independent_stages_overlap():
+    log = []
+    scheduler = TurnScheduler()
+    scheduler.add_stage('a', make_stage(log, 'a', 0.05))
+    scheduler.add_stage('b', make_stage(log, 'b', 0.05))
+
+    scheduler.run()
+
+    assert log[:2] == [('start', 'a'), ('start', 'b')]
+    assert scheduler.timings['b']['start'] < scheduler.timings['a']['end']
+
+
+def test_execution_order():
+    scheduler = TurnScheduler()
+    scheduler.add_stage('c', make_stage([], 'c'), depends_on=['b'])
+    scheduler.add_stage('b', make_stage([], 'b'), depends_on=['a'])
+    scheduler.add_stage('a', make_stage([], 'a'))
+
+    assert scheduler.get_execution_order() == ['a', 'b', 'c']
+
+
+def test_cycle_and_unknown_dependency_raise():
+    scheduler = TurnScheduler()
+    scheduler.add_stage('a', make_stage([], 'a'), depends_on=['b'])
+    scheduler.add_stage('b', make_stage([], 'b'), depends_on=['a'])
+    with pytest.raises(ValueError):
+        scheduler.get_execution_order()
+
+    scheduler = TurnScheduler()
+    scheduler.add_stage('a', make_stage([], 'a'), depends_on=['missing'])
+    with pytest.raises(ValueError):
+        scheduler.get_execution_order()
+
+
+def test_duplicate_stage_raises():
+    scheduler = TurnScheduler()
+    scheduler.add_stage('a', make_stage([], 'a'))
+    with pytest.raises(ValueError):
+        scheduler.add_stage('a', make_stage([], 'a'))
+
+
+def test_stop_condition_skips_pending_stages():
+    log = []
+    stopped = []
+
+    async def reflect():
+        stopped.append(True)
+        return 'success'
+
+    scheduler = TurnScheduler()
+    scheduler.add_stage('reflect', reflect)
+    scheduler.add_stage('plan', make_stage(log, 'plan'), depends_on=['reflect'])
+
+    results = scheduler.run(stop_condition=lambda: bool(stopped))
+
+    assert results == {'reflect': 'success'}
+    assert log == []
+
+
+def test_stage_error_propagates():
+    async def fail():
+        raise RuntimeError('stage failed')
+
+    log = []
+    scheduler = TurnScheduler()
+    scheduler.add_stage('fail', fail)
+    scheduler.add_stage('after', make_stage(log, 'after'), depends_on=['fail'])
+
+    with pytest.raises(RuntimeError):
+        scheduler.run()
+    assert log == []